@@ -1,7 +1,26 @@
 """
-Package where the model is implemented and the important classes are made available directly.
+Package where the model is implemented and the important classes are made available directly. They are imported upon
+first access, so that importing a single module of the package, e.g. from the command line tools, does not import the
+rest of them.
 """
+import importlib
 
-from .detectors import ChangeDetector
-from .detectors import VesselDetector
-from .downloader import Downloader
+_EXPORTS = {
+    "ChangeDetector": ".detectors",
+    "VesselDetector": ".detectors",
+    "Downloader": ".downloader",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value  # Later accesses do not go through this function
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
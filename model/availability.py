@@ -0,0 +1,149 @@
+"""Module for resolving the access status (online or offline) of many products at once."""
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from sentinelsat import SentinelAPI
+
+from .download_queue import backoff, is_retryable
+
+
+class AvailabilityResolver:
+    """
+    Resolves the Online flag of many products with a few batched OData requests, which are launched concurrently over a
+    pooled session. Throttled or failed batches are retried after a jittered backoff. Resolved flags are kept in a
+    short-lived in-process cache keyed by UUID.
+    """
+
+    def __init__(self,
+                 api_url: str,
+                 auth: tuple = None,
+                 batch_size: int = 50,
+                 max_workers: int = 4,
+                 ttl: float = 300.0,
+                 timeout: float = 60.0,
+                 headers: dict = None,
+                 limiter=None,
+                 max_attempts: int = 5):
+        """
+        :param api_url: str. Hub URL, e.g. https://apihub.copernicus.eu/apihub/.
+        :param auth: tuple, optional. (username, password) pair. Defaults to None.
+        :param batch_size: int, optional. Maximal number of UUIDs asked for in a single OData request. Defaults to 50.
+        :param max_workers: int, optional. Maximal number of concurrent requests. Defaults to 4, which is the number of
+            concurrent requests allowed per user by the Open Access Hub.
+        :param ttl: float, optional. Seconds a resolved flag is considered valid. Defaults to 300.
+        :param timeout: float, optional. Request timeout in seconds. Defaults to 60.
+        :param headers: dict, optional. Extra headers to send with every request. Defaults to None.
+        :param limiter: AdaptiveLimiter, optional. Limiter shared with the other requests to the hub, e.g. the
+            Downloader's dl_limit_semaphore, taken by every request. Defaults to None, which only bounds them by
+            max_workers.
+        :param max_attempts: int, optional. Attempts per batch before its error is raised. Defaults to 5.
+        """
+        self.api_url = api_url if api_url.endswith("/") else api_url + "/"
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+
+        # Pooled session, so that connections are reused between batches and workers
+        self.session = requests.Session()
+        self.session.auth = auth
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._cache = {}  # { uuid: (online, expiry) }
+        self._lock = threading.Lock()
+
+    def resolve(self, uuids) -> dict:
+        """
+        Resolves the Online flag of the given products. Only the products that are not cached are requested.
+        :param uuids: Iterable of product UUIDs.
+        :return: dict with the format { uuid: bool }. Products unknown to the hub are considered offline.
+        """
+        uuids = list(dict.fromkeys(uuids))  # Remove duplicates keeping the order
+        now = time.monotonic()
+
+        flags = {}
+        missing = []
+        with self._lock:
+            for uuid in uuids:
+                cached = self._cache.get(uuid)
+                if cached and cached[1] > now:
+                    flags[uuid] = cached[0]
+                else:
+                    missing.append(uuid)
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                for resolved in executor.map(self._request_batch, batches):
+                    flags.update(resolved)
+
+            expiry = time.monotonic() + self.ttl
+            with self._lock:
+                for uuid in missing:
+                    flags.setdefault(uuid, False)
+                    self._cache[uuid] = (flags[uuid], expiry)
+
+        return {uuid: flags[uuid] for uuid in uuids}
+
+    def is_online(self, uuid: str) -> bool:
+        """
+        Resolves the Online flag of a single product.
+        :param uuid: str. Product UUID.
+        :return: bool. True if online, False if in the Long Term Archive.
+        """
+        return self.resolve([uuid])[uuid]
+
+    def invalidate(self, uuids=None) -> None:
+        """
+        Removes cached flags.
+        :param uuids: Iterable of product UUIDs, optional. If not given, the whole cache is cleared.
+        :return: None.
+        """
+        with self._lock:
+            if uuids is None:
+                self._cache.clear()
+            else:
+                for uuid in uuids:
+                    self._cache.pop(uuid, None)
+
+    def _request_batch(self, uuids: list) -> dict:
+        """
+        Asks the OData API for the Online flag of a batch of products.
+        :param uuids: list of product UUIDs.
+        :return: dict with the format { uuid: bool }.
+        """
+        id_filter = " or ".join(f"Id eq '{uuid}'" for uuid in uuids)
+        params = {
+            "$format": "json",
+            "$select": "Id,Online",
+            "$top": len(uuids),
+            "$filter": id_filter
+        }
+
+        attempt = 1
+        while True:
+            try:
+                # Checked within the limiter, so that it learns about throttled responses
+                with self.limiter if self.limiter is not None else contextlib.nullcontext():
+                    response = self.session.get(f"{self.api_url}odata/v1/Products", params=params,
+                                                timeout=self.timeout)
+                    SentinelAPI._check_scihub_response(response)
+                break
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                time.sleep(backoff(attempt))
+                attempt += 1
+
+        # DHuS versions that do not set the Online attribute serve every product online
+        return {entry["Id"]: bool(entry.get("Online", True)) for entry in response.json()["d"]["results"]}
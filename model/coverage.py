@@ -0,0 +1,395 @@
+"""Module for the vectorized computation of the AoI coverage of product footprints."""
+from __future__ import annotations
+
+import re
+import string
+import warnings
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+import utils
+
+gpd = utils.LazyModule("geopandas")
+
+# Vertices of polygons: their coordinates, the ring each one belongs to and the position of its polygon, and whether
+# each ring, by id, is an exterior ring or a hole
+Rings = namedtuple("Rings", ["x", "y", "ring", "owner", "exterior"])
+
+# The parentheses that open exterior rings and holes are replaced by -inf and nan and the polygons are separated by inf,
+# so that numpy parses the coordinates of every WKT string in a single call
+_EXTERIOR = re.compile(r"\(\s*\((?!\s*\()")
+_HOLE = re.compile(r"\((?!\s*\()")
+_NOT_NUMBERS = str.maketrans({x: " " for x in string.ascii_uppercase.replace("E", "") + "(),"})
+
+
+def parse_footprints(footprints, crs: str = "EPSG:4326") -> gpd.GeoSeries:
+    """
+    Parses all the footprint WKT strings in one bulk call.
+    :param footprints: Series or list of WKT strings.
+    :param crs: str, optional. CRS of the footprints. Defaults to EPSG:4326.
+    :return: GeoSeries. It keeps the index of footprints if it was a Series.
+    """
+    index = footprints.index if isinstance(footprints, pd.Series) else None
+    return gpd.GeoSeries.from_wkt(np.asarray(footprints, dtype=object), index=index, crs=crs)
+
+
+def prepare(geometry):
+    """
+    Prepares a geometry so that repeated predicates against it are faster.
+    :param geometry: Shapely geometry.
+    :return: An object supporting the binary predicates. With shapely >= 2.0 it is the same geometry, prepared in
+        place, otherwise a shapely.prepared.PreparedGeometry.
+    """
+    if hasattr(shapely, "prepare"):
+        shapely.prepare(geometry)
+        return geometry
+    return prep(geometry)
+
+
+def num_vertices(geometry) -> int:
+    """
+    Counts the vertices of a geometry.
+    :param geometry: Shapely geometry.
+    :return: int.
+    """
+    if hasattr(shapely, "get_num_coordinates"):
+        return int(shapely.get_num_coordinates(geometry))
+    if hasattr(geometry, "geoms"):
+        return sum(num_vertices(part) for part in geometry.geoms)
+    if hasattr(geometry, "exterior"):
+        return len(geometry.exterior.coords) + sum(len(ring.coords) for ring in geometry.interiors)
+    return len(geometry.coords)
+
+
+def wkt_rings(footprints) -> Rings:
+    """
+    Extracts the vertices of 2D WKT polygons and multipolygons without parsing them into geometries, which is slow with
+    shapely < 2.0.
+    :param footprints: Iterable of WKT strings.
+    :return: Rings. The owners are the positions of the footprints.
+    """
+    footprints = list(footprints)
+    text = " inf ".join(footprints).replace("EMPTY", " ") + " inf "
+    values = np.fromstring(_HOLE.sub(" nan ", _EXTERIOR.sub(" -inf ", text)).translate(_NOT_NUMBERS), sep=" ")
+
+    ends = np.isposinf(values)
+    starts = np.isneginf(values) | np.isnan(values)
+    coords = ~(ends | starts)
+    owner = np.cumsum(ends) - ends
+    ring = np.cumsum(starts) - 1
+    exterior = np.isneginf(values[starts])
+
+    if ends.sum() != len(footprints) or (np.bincount(ring[coords], minlength=len(exterior)) % 2).any():
+        raise ValueError("Only 2D WKT polygons and multipolygons are supported.")
+
+    xy = values[coords].reshape(-1, 2)
+    return Rings(xy[:, 0], xy[:, 1], ring[coords][::2], owner[coords][::2], exterior)
+
+
+def geometry_rings(geometries) -> Rings:
+    """
+    Extracts the vertices of polygons and multipolygons. With shapely < 2.0, writing them as WKT and extracting the
+    vertices from it is faster than going through their coordinates one ring at a time.
+    :param geometries: Iterable of shapely geometries.
+    :return: Rings. The owners are the positions of the geometries.
+    """
+    return wkt_rings([geometry.wkt for geometry in geometries])
+
+
+def _edges(rings: Rings) -> np.ndarray:
+    """
+    :param rings: Rings.
+    :return: np.ndarray. Index of the first vertex of every edge, which goes on to the next one.
+    """
+    return np.flatnonzero(rings.ring[:-1] == rings.ring[1:])
+
+
+def _ring_areas(rings: Rings, edges: np.ndarray) -> np.ndarray:
+    """
+    Computes the area of every ring with the shoelace formula. WKT rings are closed, so their edges are all there.
+    :param rings: Rings.
+    :param edges: np.ndarray. Edges of rings.
+    :return: np.ndarray. Area of every ring, by id, negative for the holes.
+    """
+    x1, y1, x2, y2 = rings.x[edges], rings.y[edges], rings.x[edges + 1], rings.y[edges + 1]
+    areas = np.abs(np.bincount(rings.ring[edges], weights=x1 * y2 - x2 * y1, minlength=len(rings.exterior))) / 2
+    return np.where(rings.exterior, areas, -areas)
+
+
+def _ray_cast(rings: Rings, edges: np.ndarray, point: tuple, n: int) -> np.ndarray:
+    """
+    Finds the polygons that contain a point by counting the edges that a ray cast from it crosses.
+    :param rings: Rings.
+    :param edges: np.ndarray. Edges of rings.
+    :param point: tuple. x and y of the point.
+    :param n: int. Number of polygons.
+    :return: np.ndarray. Whether each polygon contains the point.
+    """
+    px, py = point
+    x1, y1, x2, y2 = rings.x[edges], rings.y[edges], rings.x[edges + 1], rings.y[edges + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):  # Horizontal edges are not crossed anyway
+        crossed = ((y1 > py) != (y2 > py)) & (px < x1 + (py - y1) * (x2 - x1) / (y2 - y1))
+    return np.bincount(rings.owner[edges[crossed]], minlength=n) % 2 == 1
+
+
+def _meeting_edges(rings: Rings, edges: np.ndarray, other: Rings, other_edges: np.ndarray) -> np.ndarray:
+    """
+    Finds the edges that cross or touch an edge of other rings. Pairs of edges are compared in blocks, so that the
+    memory used is bounded.
+    :param rings: Rings.
+    :param edges: np.ndarray. Edges of rings.
+    :param other: Rings. Other rings, e.g. those of the AoI.
+    :param other_edges: np.ndarray. Edges of other.
+    :return: np.ndarray. Whether each edge of rings meets an edge of other.
+    """
+    meet = np.zeros(len(edges), dtype=bool)
+    a, b, c, d = (x[:, None] for x in (rings.x[edges], rings.y[edges], rings.x[edges + 1], rings.y[edges + 1]))
+
+    block = max(1, 2 ** 20 // max(1, len(edges)))
+    for i in range(0, len(other_edges), block):
+        k = other_edges[i:i + block]
+        u1, v1, u2, v2 = (x[None, :] for x in (other.x[k], other.y[k], other.x[k + 1], other.y[k + 1]))
+
+        boxes = (np.minimum(a, c) <= np.maximum(u1, u2)) & (np.maximum(a, c) >= np.minimum(u1, u2)) & \
+                (np.minimum(b, d) <= np.maximum(v1, v2)) & (np.maximum(b, d) >= np.minimum(v1, v2))
+        # Each edge must have the ends of the other on both sides, or on it
+        sides = (((u2 - u1) * (b - v1) - (v2 - v1) * (a - u1)) * ((u2 - u1) * (d - v1) - (v2 - v1) * (c - u1)) <= 0) & \
+                (((c - a) * (v1 - b) - (d - b) * (u1 - a)) * ((c - a) * (v2 - b) - (d - b) * (u2 - a)) <= 0)
+        meet |= (boxes & sides).any(axis=1)
+
+    return meet
+
+
+def relate(rings: Rings, n: int, aoi) -> tuple:
+    """
+    Finds which polygons intersect the AoI, and the areas of the intersections, with array operations. Where the
+    boundaries of a polygon and of the AoI do not meet, every ring of either one is wholly inside or outside the other
+    one, and the area of their intersection is the sum of the areas of the rings inside the other geometry, those of
+    the holes being negative. Where they meet, the polygon intersects the AoI, but the area is left for shapely.
+    :param rings: Rings. Vertices of the polygons.
+    :param n: int. Number of polygons, the owners of rings being their positions.
+    :param aoi: Shapely polygon or multipolygon. The AoI.
+    :return: tuple of np.ndarray. Whether each polygon intersects the AoI, the area of the intersection, and whether
+        their boundaries meet, in which case the area is not computed.
+    """
+    from shapely import vectorized
+
+    intersects = np.zeros(n, dtype=bool)
+    area = np.zeros(n, dtype=float)
+    meet = np.zeros(n, dtype=bool)
+    if not len(rings.x):
+        return intersects, area, meet
+
+    edges = _edges(rings)
+    other = geometry_rings([aoi])
+    other_edges = _edges(other)
+    meet[rings.owner[edges[_meeting_edges(rings, edges, other, other_edges)]]] = True
+
+    # Rings of the polygons inside the AoI, tested by their first vertex
+    present, first = np.unique(rings.ring, return_index=True)
+    inside = vectorized.contains(aoi, rings.x[first], rings.y[first])
+    owners = rings.owner[first][inside]
+    area += np.bincount(owners, weights=_ring_areas(rings, edges)[present][inside], minlength=n)
+    intersects[owners] = True
+
+    # Rings of the AoI inside the polygons
+    other_areas = _ring_areas(other, other_edges)
+    for ring, k in zip(*np.unique(other.ring, return_index=True)):
+        contains = _ray_cast(rings, edges, (other.x[k], other.y[k]), n)
+        area += contains * other_areas[ring]
+        intersects |= contains
+
+    intersects |= meet
+    return intersects, area, meet
+
+
+def stand_in(aoi, max_vertices: int = 50):
+    """
+    Finds a geometry with few vertices that covers the AoI, so that it can be sent to the hub in its place. Every
+    footprint that intersects the AoI also intersects its stand-in. The candidates are the AoI simplified after being
+    buffered by the simplification tolerance, its convex hull and its envelope, and the smallest one is chosen.
+    :param aoi: Shapely geometry. The AoI.
+    :param max_vertices: int, optional. Maximal number of vertices of the stand-in. Defaults to 50.
+    :return: Shapely geometry. The AoI itself if it is already small enough.
+    """
+    if num_vertices(aoi) <= max_vertices:
+        return aoi
+
+    options = [aoi.envelope]
+
+    hull = aoi.convex_hull
+    if num_vertices(hull) <= max_vertices:
+        options.append(hull)
+
+    minx, miny, maxx, maxy = aoi.bounds
+    size = max(maxx - minx, maxy - miny)
+    tolerance = size / 1000
+    while tolerance < size:
+        # Simplifying moves the boundary by the tolerance at most, so the buffer keeps the AoI inside
+        simplified = aoi.buffer(tolerance * 1.5, 2).simplify(tolerance, preserve_topology=True)
+        if num_vertices(simplified) <= max_vertices:
+            if simplified.covers(aoi):
+                options.append(simplified)
+            break
+        tolerance *= 2
+
+    return min(options, key=lambda option: option.area)
+
+
+def _tree(geometries: np.ndarray) -> STRtree:
+    """
+    :param geometries: np.ndarray of shapely geometries.
+    :return: STRtree of the geometries.
+    """
+    with warnings.catch_warnings():
+        # shapely 1.8 warns about the API change of 2.0, both are handled by the callers
+        warnings.filterwarnings("ignore", message="STRtree will be changed")
+        return STRtree(geometries)
+
+
+def _bounds_candidates(rings: Rings, n: int, aoi) -> tuple:
+    """
+    Keeps the polygons whose bounding box intersects that of the AoI.
+    :param rings: Rings. Vertices of the polygons, sorted by owner.
+    :param n: int. Number of polygons.
+    :param aoi: Shapely geometry. The AoI.
+    :return: tuple. Sorted positions of the kept polygons, and their Rings, owned by their positions among the kept.
+    """
+    present, starts = np.unique(rings.owner, return_index=True)
+    if not len(present):
+        return np.array([], dtype=int), rings
+
+    min_x, max_x = np.minimum.reduceat(rings.x, starts), np.maximum.reduceat(rings.x, starts)
+    min_y, max_y = np.minimum.reduceat(rings.y, starts), np.maximum.reduceat(rings.y, starts)
+    aoi_min_x, aoi_min_y, aoi_max_x, aoi_max_y = aoi.bounds
+    idx = present[(min_x <= aoi_max_x) & (max_x >= aoi_min_x) & (min_y <= aoi_max_y) & (max_y >= aoi_min_y)]
+
+    keep = np.isin(rings.owner, idx)
+    kept = Rings(rings.x[keep], rings.y[keep], rings.ring[keep], np.searchsorted(idx, rings.owner[keep]),
+                 rings.exterior)
+    return idx, kept
+
+
+def _intersection_areas(footprints: gpd.GeoSeries, aoi) -> np.ndarray:
+    """
+    :param footprints: GeoSeries. Product footprints.
+    :param aoi: Shapely geometry. The AoI.
+    :return: np.ndarray. Area of the intersection of each footprint with the AoI.
+    """
+    with warnings.catch_warnings():
+        # Areas in a geographic CRS are not meaningful on their own, but their ratio is what is needed here
+        warnings.filterwarnings("ignore", message="Geometry is in a geographic CRS")
+        return footprints.intersection(aoi).area.to_numpy()
+
+
+def candidates(footprints: gpd.GeoSeries, aoi) -> np.ndarray:
+    """
+    Uses an STRtree to find the footprints that intersect the AoI.
+    :param footprints: GeoSeries. Product footprints.
+    :param aoi: Shapely geometry. The AoI.
+    :return: np.ndarray. Sorted positional indices of the footprints that intersect the AoI.
+    """
+    if footprints.empty:
+        return np.array([], dtype=int)
+
+    geometries = np.asarray(footprints.values, dtype=object)
+    tree = _tree(geometries)
+
+    if hasattr(tree, "query_items"):  # shapely < 2.0 only filters by bounding box, refine with array operations
+        idx = np.sort(np.fromiter(tree.query_items(aoi), dtype=int))
+        idx = idx[relate(geometry_rings(geometries[idx]), len(idx), aoi)[0]]
+    else:
+        idx = tree.query(prepare(aoi), predicate="intersects")
+
+    return np.sort(np.asarray(idx, dtype=int))
+
+
+def aoi_coverage(footprints, aoi) -> np.ndarray:
+    """
+    Computes which percent of the AoI each footprint covers. Intersection areas are only computed for the footprints
+    that intersect the AoI. With shapely < 2.0, which handles one geometry at a time, most of them are computed with
+    array operations instead, see relate, and WKT footprints are not even parsed.
+    :param footprints: GeoSeries of product footprints, or Series or list of their WKT strings.
+    :param aoi: Shapely geometry. The AoI.
+    :return: np.ndarray of floats between 0 and 100, in the same order as footprints.
+    """
+    coverage = np.zeros(len(footprints), dtype=float)
+    if not len(footprints):
+        return coverage
+
+    if hasattr(shapely, "from_wkt"):
+        if not isinstance(footprints, gpd.GeoSeries):
+            footprints = parse_footprints(footprints)
+        idx = candidates(footprints, aoi)
+        if len(idx):
+            coverage[idx] = _intersection_areas(footprints.iloc[idx], aoi) / aoi.area * 100
+        return coverage
+
+    if isinstance(footprints, gpd.GeoSeries):
+        geometries = np.asarray(footprints.values, dtype=object)
+        idx = np.sort(np.fromiter(_tree(geometries).query_items(aoi), dtype=int))
+        rings = geometry_rings(geometries[idx])
+        geometry = lambda positions: footprints.iloc[idx[positions]]
+    else:
+        wkts = np.asarray(footprints, dtype=object)
+        idx, rings = _bounds_candidates(wkt_rings(wkts), len(wkts), aoi)
+        geometry = lambda positions: parse_footprints(wkts[idx[positions]])
+
+    _, areas, meet = relate(rings, len(idx), aoi)
+    meeting = np.flatnonzero(meet)
+    if len(meeting):
+        areas[meeting] = _intersection_areas(geometry(meeting), aoi)
+    coverage[idx] = areas / aoi.area * 100
+
+    return coverage
+
+
+def coverage_matrix(footprints: gpd.GeoSeries, aois: gpd.GeoSeries) -> pd.DataFrame:
+    """
+    Computes which percent of every AoI each footprint covers. All the intersecting pairs are found with a single
+    STRtree, and their intersection areas are computed in one vectorized call.
+    :param footprints: GeoSeries. Product footprints.
+    :param aois: GeoSeries. AoIs, indexed by name.
+    :return: DataFrame of floats between 0 and 100, with the index of footprints as rows and that of aois as columns.
+    """
+    matrix = np.zeros((len(footprints), len(aois)), dtype=float)
+
+    if not footprints.empty and not aois.empty:
+        geometries = np.asarray(footprints.values, dtype=object)
+        tree = _tree(geometries)
+
+        if hasattr(tree, "query_items"):  # shapely < 2.0 queries one geometry at a time
+            pairs = []
+            for j, aoi in enumerate(aois.values):
+                idx = np.sort(np.fromiter(tree.query_items(aoi), dtype=int))
+                idx = idx[relate(geometry_rings(geometries[idx]), len(idx), aoi)[0]]
+                pairs += [(i, j) for i in idx]
+            idx = np.array(pairs, dtype=int).reshape(-1, 2).T
+        else:  # Pairs of (aoi, footprint) positions
+            idx = tree.query(np.asarray(aois.values, dtype=object), predicate="intersects")[::-1]
+
+        i, j = idx
+        if len(i):
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message="Geometry is in a geographic CRS")
+                pairs = gpd.GeoSeries(geometries[i], crs=footprints.crs)
+                areas = pairs.intersection(gpd.GeoSeries(aois.values[j], crs=aois.crs), align=False).area.to_numpy()
+                aoi_areas = aois.area.to_numpy()
+            matrix[i, j] = areas / aoi_areas[j] * 100
+
+    return pd.DataFrame(matrix, index=footprints.index, columns=aois.index)
+
+
+def datatake_coverage(coverage: pd.Series, datatakes: pd.Series) -> pd.Series:
+    """
+    Sums up the coverages of the products that belong to the same datatake.
+    :param coverage: Series. Coverage percent of each product.
+    :param datatakes: Series. Datatake identifier of each product. Same index as coverage.
+    :return: Series with the datatake's total coverage for every product. Same index as coverage.
+    """
+    return coverage.groupby(datatakes, sort=False, observed=True).transform("sum")
@@ -0,0 +1,324 @@
+"""Module for the queue of detection jobs, which run in worker processes."""
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class DetectionJob:
+    """
+    Detection job of a DetectionQueue, e.g. the processing chain of a single product. Its attributes are updated by the
+    queue when it is polled.
+    """
+
+    def __init__(self, job_id: int, target, args: tuple, kwargs: dict, description: str = "", depends=()):
+        """
+        :param job_id: int. Identifier of the job within its queue.
+        :param target: Callable. Picklable callable, e.g. a method of a detector, run in the worker process. It is
+            passed a progress keyword argument, which it calls with the name of each step.
+        :param args: tuple. Positional arguments of target, after the results of the jobs it depends on.
+        :param kwargs: dict. Keyword arguments of target.
+        :param description: str, optional. Short description to display. Defaults to "".
+        :param depends: Iterable, optional. Ids of the jobs whose results are passed to target as its first arguments.
+            Defaults to ().
+        """
+        self.id = job_id
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.depends = tuple(depends)
+
+        self.status = QUEUED
+        self.step = ""
+        self.timings = []  # (step, seconds) of the completed steps
+        self.result = None
+        self.error = ""
+
+        self.submitted = time.monotonic()
+        self.started = None
+        self.ended = None
+        self._step_started = None
+
+    @property
+    def finished(self) -> bool:
+        """
+        :return: bool. Whether the job is done, failed or cancelled.
+        """
+        return self.status in FINISHED
+
+    @property
+    def elapsed(self) -> float:
+        """
+        :return: float. Seconds the job has been running for, or ran for if it is finished. 0 if it never started.
+        """
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.monotonic()) - self.started
+
+    def _set_step(self, step: str, now: float) -> None:
+        """
+        Records the start of a step, and the timing of the previous one.
+        :param step: str. Name of the step, empty when the job ends.
+        :param now: float. Monotonic time at which it started.
+        :return: None.
+        """
+        if self.step and self._step_started is not None:
+            self.timings.append((self.step, now - self._step_started))
+        self.step = step
+        self._step_started = now
+
+    def _end(self, status: str, now: float) -> None:
+        """
+        Marks the job as finished.
+        :param status: str. Final status.
+        :param now: float. Monotonic time at which it ended.
+        :return: None.
+        """
+        self._set_step("", now)
+        self.status = status
+        self.ended = now if self.started is not None else None
+
+
+def jvm_budget(memory: str = "", parallelism: int = 0) -> None:
+    """
+    Sets the maximal heap and the GPF parallelism of the JVM that snappy starts in this process. It must be called
+    before snappy is imported, e.g. as the initializer of a DetectionQueue. The options are added to _JAVA_OPTIONS, so
+    that they take precedence over those of snappy's configuration.
+    :param memory: str, optional. Maximal heap, e.g. 8G. Defaults to snappy's configuration.
+    :param parallelism: int, optional. Threads with which GPF computes tiles. Defaults to the number of cores.
+    :return: None.
+    """
+    options = []
+    if memory:
+        options.append(f"-Xmx{memory}")
+    if parallelism:
+        options.append(f"-Dsnap.parallelism={parallelism}")
+    if options:
+        os.environ["_JAVA_OPTIONS"] = " ".join([os.environ.get("_JAVA_OPTIONS", ""), *options]).strip()
+
+
+def _run(target, args, kwargs, conn, initializer=None, initargs=()) -> None:
+    """
+    Entry point of the worker processes. Runs a job and sends its steps and outcome through the pipe as
+    (kind, payload) tuples, with kind being step, done or failed.
+    :param target: Callable. Job target.
+    :param args: tuple. Positional arguments.
+    :param kwargs: dict. Keyword arguments.
+    :param conn: Connection. Writing end of the job's pipe.
+    :param initializer: Callable, optional. Called with initargs before the job. Defaults to None.
+    :param initargs: tuple, optional. Arguments of initializer. Defaults to ().
+    :return: None.
+    """
+    try:
+        if initializer is not None:
+            initializer(*initargs)
+        result = target(*args, progress=lambda step: conn.send(("step", step)), **kwargs)
+    except BaseException as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    else:
+        conn.send(("done", result))
+    finally:
+        conn.close()
+
+
+class DetectionQueue:
+    """
+    Queue of detection jobs, each run in a process of its own so that SNAP, which runs in its own JVM, neither blocks
+    the GUI nor leaks memory across jobs, and so that a running job can be cancelled by terminating its process. At most
+    max_workers jobs run at the same time; the rest wait in submission order for their turn and for the jobs they
+    depend on. The queue has no thread of its own: poll it regularly, e.g. from a timer, to start jobs and collect
+    their progress.
+    """
+
+    def __init__(self, max_workers: int = 2, initializer=None, initargs=()):
+        """
+        :param max_workers: int, optional. Jobs run at the same time. Bear in mind that each one starts a JVM of its
+            own, with the memory SNAP is configured to use unless it is budgeted by the initializer. Defaults to 2.
+        :param initializer: Callable, optional. Picklable callable run in each worker process before its job, e.g.
+            jvm_budget. Defaults to None.
+        :param initargs: tuple, optional. Arguments of initializer. Defaults to ().
+        """
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.jobs = {}  # id: DetectionJob, in submission order
+
+        self._ids = itertools.count(1)
+        self._ctx = multiprocessing.get_context("spawn")  # Forking a process with a running JVM is not safe
+        self._workers = {}  # id: (process, connection) of the running jobs
+
+    def submit(self, target, *args, description: str = "", depends=(), **kwargs) -> int:
+        """
+        Queues a job.
+        :param target: Callable. Picklable callable run in the worker process, with the results of the jobs it depends
+            on as its first arguments, then args, kwargs and a progress keyword argument.
+        :param args: Positional arguments of target.
+        :param description: str, optional. Short description to display. Defaults to "".
+        :param depends: Iterable, optional. Ids of the jobs that must be done before this one starts. If any of them
+            fails or is cancelled, so is this one. Defaults to ().
+        :param kwargs: Keyword arguments of target.
+        :return: int. Id of the job.
+        """
+        for dep in depends:
+            if dep not in self.jobs:
+                raise KeyError(f"Unknown job: {dep}")
+
+        job_id = next(self._ids)
+        self.jobs[job_id] = DetectionJob(job_id, target, args, kwargs, description=description, depends=depends)
+        return job_id
+
+    def cancel(self, job_id: int) -> list:
+        """
+        Cancels a job, terminating its process if it is running, and the queued jobs that depend on it.
+        :param job_id: int. Id of the job.
+        :return: list. Jobs that were cancelled.
+        """
+        job = self.jobs[job_id]
+        if job.finished:
+            return []
+
+        if job_id in self._workers:
+            process, conn = self._workers.pop(job_id)
+            process.terminate()
+            process.join()
+            conn.close()
+
+        job._end(CANCELLED, time.monotonic())
+        return [job] + self._cancel_dependents()
+
+    def cancel_all(self) -> list:
+        """
+        Cancels every queued and running job.
+        :return: list. Jobs that were cancelled.
+        """
+        cancelled = []
+        for job_id in list(self.jobs):
+            cancelled += self.cancel(job_id)
+        return cancelled
+
+    def poll(self) -> list:
+        """
+        Collects the progress of the running jobs, and starts queued jobs while there are free workers. Never blocks.
+        :return: list. Jobs whose status or step changed, in submission order.
+        """
+        changed = set()
+        now = time.monotonic()
+
+        for job_id, (process, conn) in list(self._workers.items()):
+            job = self.jobs[job_id]
+            try:
+                while not job.finished and conn.poll():
+                    kind, payload = conn.recv()
+                    if kind == "step":
+                        job._set_step(payload, now)
+                    elif kind == "done":
+                        job.result = payload
+                        job._end(DONE, now)
+                    else:
+                        job.error = payload
+                        job._end(FAILED, now)
+                    changed.add(job)
+            except (EOFError, OSError):  # The process exited without reporting, e.g. killed by the system
+                process.join()
+                job.error = f"Worker process exited with code {process.exitcode}."
+                job._end(FAILED, now)
+                changed.add(job)
+
+            if job.finished:
+                del self._workers[job_id]
+                conn.close()
+
+        self._ctx.active_children()  # Joins the workers that have exited, without waiting for the others
+        changed.update(self._cancel_dependents())
+        changed.update(self._start_ready())
+
+        return sorted(changed, key=lambda x: x.id)
+
+    def join(self, interval: float = 0.5, callback=None) -> bool:
+        """
+        Polls the queue until every job is finished, for scripts that have nothing else to do meanwhile. If interrupted,
+        the remaining jobs are cancelled.
+        :param interval: float, optional. Seconds between polls. Defaults to 0.5.
+        :param callback: Callable, optional. Called with each job whose status or step changed. Defaults to None.
+        :return: bool. Whether every job is done.
+        """
+        try:
+            while not all(x.finished for x in self.jobs.values()):
+                for job in self.poll():
+                    if callback is not None:
+                        callback(job)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            for job in self.cancel_all():
+                if callback is not None:
+                    callback(job)
+
+        return all(x.status == DONE for x in self.jobs.values())
+
+    def clear_finished(self) -> None:
+        """
+        Forgets the finished jobs that no queued or running job depends on.
+        :return: None.
+        """
+        needed = {dep for job in self.jobs.values() if not job.finished for dep in job.depends}
+        for job_id in [x.id for x in self.jobs.values() if x.finished and x.id not in needed]:
+            del self.jobs[job_id]
+
+    def shutdown(self) -> None:
+        """
+        Cancels every job and terminates the worker processes.
+        :return: None.
+        """
+        self.cancel_all()
+
+    def _cancel_dependents(self) -> list:
+        """
+        Cancels the queued jobs that depend on failed or cancelled ones.
+        :return: list. Jobs that were cancelled.
+        """
+        cancelled = []
+        now = time.monotonic()
+        for job in self.jobs.values():  # Dependencies are submitted first, so a single pass cascades
+            if job.status == QUEUED and any(self.jobs[x].status in (FAILED, CANCELLED) for x in job.depends):
+                job.error = "A job it depends on did not finish."
+                job._end(CANCELLED, now)
+                cancelled.append(job)
+        return cancelled
+
+    def _start_ready(self) -> list:
+        """
+        Starts queued jobs whose dependencies are done while there are free workers.
+        :return: list. Jobs that were started.
+        """
+        started = []
+        for job in self.jobs.values():
+            if len(self._workers) >= self.max_workers:
+                break
+            if job.status != QUEUED or any(self.jobs[x].status != DONE for x in job.depends):
+                continue
+
+            args = tuple(self.jobs[x].result for x in job.depends) + job.args
+            reader, writer = self._ctx.Pipe(duplex=False)
+            process = self._ctx.Process(target=_run, args=(job.target, args, job.kwargs, writer, self.initializer,
+                                                           self.initargs),
+                                        name=job.description, daemon=True)
+            process.start()
+            writer.close()  # Kept by the worker only, so that reading reaches EOF when it exits
+
+            self._workers[job.id] = (process, reader)
+            job.status = RUNNING
+            job.started = time.monotonic()
+            started.append(job)
+
+        return started
@@ -6,6 +6,7 @@ import numpy as np
 from PIL import Image
 
 import utils as u
+from model.detection_queue import DONE
 from model.detectors.detector import Detector
 
 
@@ -35,7 +36,11 @@ class ChangeDetector(Detector):
                  proc_dir: str = "processed",
                  stack_dir: str = "stacks",
                  steps: bool = False,
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 backend: str = "snappy",
+                 gpt_threads: int = 0,
+                 gpt_cache: str = "",
+                 cache=None):
         super(ChangeDetector, self).__init__(
             subset=subset,
             src_bands=src_bands,
@@ -43,7 +48,11 @@ class ChangeDetector(Detector):
             detec_dir=detect_dir,
             proc_dir=proc_dir,
             steps=steps,
-            verbose=verbose
+            verbose=verbose,
+            backend=backend,
+            gpt_threads=gpt_threads,
+            gpt_cache=gpt_cache,
+            cache=cache
         )
 
         self.stack_dir = os.path.join(self.out_dir, stack_dir)
@@ -117,90 +126,188 @@ class ChangeDetector(Detector):
 
         return rgb
 
-    def detect(self, *products) -> None:
+    def detect(self, *products, workers: int = 1, jvm_memory: str = "", gpf_threads: int = 0) -> dict:
         """
-        Launches the detection process chain for the given product paths.
+        Launches the detection process chain for the given product paths. A product that fails is reported and skipped,
+        the rest of the batch goes on.
         :param products: str. Source product paths.
-        :return: None.
+        :param workers: int, optional. Products processed at the same time, each in a worker process with a JVM of its
+            own. Defaults to 1, which processes them one after the other in this process.
+        :param jvm_memory: str, optional. Maximal heap of each worker's JVM, e.g. 8G. Defaults to snappy's
+            configuration.
+        :param gpf_threads: int, optional. GPF parallelism of each worker's JVM. Defaults to the cores split among the
+            workers.
+        :return: dict. Paths of the saved PNGs, in the order of the inputs, and the error of each failed product or
+            comparison.
         """
+        if workers > 1:
+            queue = self.batch_queue(workers, jvm_memory, gpf_threads)
+            ids = self.submit_jobs(queue, *products)
+            queue.join(callback=self.report_job)
+
+            jobs = [queue.jobs[x] for x in ids]
+            return {"pngs": [x.result for x in jobs if x.status == DONE],
+                    "failed": {x.description: x.error for x in queue.jobs.values() if x.error}}
+
         import snappy
 
+        pngs = []
+        failed = {}
+
+        def run(description, func):
+            try:
+                return func()
+            except Exception as e:
+                failed[description] = self.error_message(e)
+                if self.verbose:
+                    print(f"{description} failed: {failed[description]}")
+
+        def preprocess(path):
+            return ChangeDetector.preprocess(path, self.subset, self.proc_dir, backend=self.backend,
+                                             gpt_threads=self.gpt_threads, gpt_cache=self.gpt_cache, pol=self.rgb_pol,
+                                             cache=self.cache)
+
         # First check if there is a reference product generated, otherwise create it
         if not isinstance(self.ref_prod, snappy.Product):
-            self.ref_prod = ChangeDetector.preprocess(self.ref_prod_path, self.subset, self.proc_dir)
+            self.ref_prod = run(self.ref_prod_path, lambda: preprocess(self.ref_prod_path))
+            if self.ref_prod is None:
+                return {"pngs": pngs, "failed": failed}
 
         procs = []
         for p in products:
-            proc = ChangeDetector.preprocess(p, self.subset, self.proc_dir)
+            proc = run(p, lambda: preprocess(p))
+            if proc is None:
+                continue
             procs.append(proc)
 
             cmp_name = u.gen_cmp_path(self.ref_prod.getName(), proc.getName())
-            cmp_path = os.path.join(self.stack_dir, cmp_name)
-
-            rgb = ChangeDetector.rgb_cmp(self.ref_prod, proc, self.ref_color, self.rgb_pol, cmp_path)
-
-            rgb.save(os.path.join(self.detect_dir, cmp_name + ".png"))
+            pngs.append(run(cmp_name, lambda: self.compare_products(self.ref_prod, proc)))
 
             if self.sequential and len(procs) > 1:
                 cmp_name = u.gen_cmp_path(procs[-2].getName(), proc.getName())
-                cmp_path = os.path.join(self.stack_dir, cmp_name)
+                pngs.append(run(cmp_name, lambda: self.compare_products(procs[-2], proc)))
 
-                rgb = ChangeDetector.rgb_cmp(procs[-2], proc, self.ref_color, self.rgb_pol, cmp_path)
+        return {"pngs": [x for x in pngs if x is not None], "failed": failed}
 
-                rgb.save(os.path.join(self.detect_dir, cmp_name + ".png"))
+    def submit_jobs(self, queue, *products) -> list:
+        """
+        Submits the preprocessing of the reference and the given products, and their comparisons, to a DetectionQueue.
+        :param queue: DetectionQueue.
+        :param products: str. Source product paths.
+        :return: list. Ids of the comparison jobs, whose results are the paths of the PNGs.
+        """
+        name = lambda path: os.path.splitext(os.path.basename(path))[0]
+        ref = queue.submit(self.preprocess_product, self.ref_prod_path, description=name(self.ref_prod_path))
+
+        ids = []
+        prev = None
+        for path in products:
+            proc = queue.submit(self.preprocess_product, path, description=name(path))
+            ids.append(queue.submit(self.compare, description=f"{name(self.ref_prod_path)} / {name(path)}",
+                                    depends=(ref, proc)))
+            if self.sequential and prev is not None:
+                ids.append(queue.submit(self.compare, description=f"{name(prev[0])} / {name(path)}",
+                                        depends=(prev[1], proc)))
+            prev = path, proc
+
+        return ids
+
+    def preprocess_product(self, prod_path: str, progress=None) -> str:
+        """
+        Preprocesses a single product. Meant to be run as a job of a DetectionQueue, so that the preprocessed product is
+        passed on to the comparisons by path.
+        :param prod_path: str. Path to the product.
+        :param progress: Callable, optional. Called with the name of each step of the chain. Defaults to None.
+        :return: str. Path to the preprocessed BEAM-DIMAP product.
+        """
+        prod = ChangeDetector.preprocess(prod_path, self.subset, self.proc_dir, steps=self.steps, progress=progress,
+                                         backend=self.backend, gpt_threads=self.gpt_threads,
+                                         gpt_cache=self.gpt_cache, pol=self.rgb_pol, cache=self.cache)
+        return prod.getFileLocation().getAbsolutePath()
+
+    def compare(self, prod_a_path: str, prod_b_path: str, progress=None) -> str:
+        """
+        Creates and saves the RGB PNG comparison of two preprocessed products.
+        :param prod_a_path: str. Path to the preprocessed primary product, e.g. the reference product.
+        :param prod_b_path: str. Path to the preprocessed second product.
+        :param progress: Callable, optional. Called with the name of each step. Defaults to None.
+        :return: str. Path to the saved PNG.
+        """
+        import model.preprocessing.operators as op
+
+        report = progress or (lambda step: None)
+
+        report("Read")
+        prod_a = op.read_product(prod_a_path)
+        prod_b = op.read_product(prod_b_path)
+
+        return self.compare_products(prod_a, prod_b, progress=progress)
+
+    def compare_products(self, prod_a, prod_b, progress=None) -> str:
+        """
+        Creates and saves the RGB PNG comparison of two opened preprocessed products.
+        :param prod_a: snappy.Product. Preprocessed primary product, e.g. the reference product.
+        :param prod_b: snappy.Product. Preprocessed second product.
+        :param progress: Callable, optional. Called with the name of each step. Defaults to None.
+        :return: str. Path to the saved PNG.
+        """
+        report = progress or (lambda step: None)
+
+        report("RGB composition")
+        cmp_name = u.gen_cmp_path(prod_a.getName(), prod_b.getName())
+        cmp_path = os.path.join(self.stack_dir, cmp_name)
+        rgb = ChangeDetector.rgb_cmp(prod_a, prod_b, self.ref_color, self.rgb_pol, cmp_path)
+
+        report("Write")
+        png_path = os.path.join(self.detect_dir, cmp_name + ".png")
+        rgb.save(png_path)
+
+        return png_path
 
     @staticmethod
     def preprocess(prod_path, subset: str = "", out_dir: str = "", out_name_fmt: str = "Subset_{}_Orb_Cal_Spk_TC",
-                   steps: bool = False):
+                   steps: bool = False, progress=None, backend: str = "snappy", gpt_threads: int = 0,
+                   gpt_cache: str = "", subset_first: bool = True, subset_padding: float = 500.0, pol: str = "",
+                   cache=None):
         """
         Preprocessing chain to apply to the source products prior to create the RGB PNG composition.
         :param prod_path: str. Path to the product.
         :param subset: str. Subset string in WKT format.
         :param out_dir: str. Output directory path.
-        :param out_name_fmt: str. Unused. Output naming template to use when saving the resulting products. Since snappy
-                is being used, the output name is automatically generated.
+        :param out_name_fmt: str. Unused. Output naming template to use when saving the resulting products. The chain
+                names the products after its operators, which follows this template.
         :param steps: bool. If set, writes out the intermediary products after application of each operator.
+        :param progress: Callable, optional. Called with the name of each step before it is run. Defaults to None.
+        :param backend: str, optional. Backend of the chain, snappy or gpt. Defaults to snappy.
+        :param gpt_threads: int, optional. Parallelism of the gpt backend. Defaults to gpt's default.
+        :param gpt_cache: str, optional. Tile cache size of the gpt backend, e.g. 4G. Defaults to gpt's default.
+        :param subset_first: bool, optional. If set, the product is also subset in radar geometry, before calibration,
+            to the subset padded by subset_padding, so that only the AoI is calibrated, filtered and terrain corrected.
+            Defaults to True.
+        :param subset_padding: float, optional. Padding in meters, wide enough for the speckle filter window and the
+            terrain correction resampling to have data beyond the AoI. Defaults to 500.
+        :param pol: str, optional. Polarisation of the RGB composition, either VV or VH. If given, only its band,
+            Sigma0_<pol>, is calibrated, filtered, corrected and written. Defaults to "", which keeps every
+            polarisation.
+        :param cache: ProductCache, optional. If given, the preprocessed product is read from it if it was already
+            computed, e.g. for the reference product, and stored otherwise. Defaults to None.
         :return: snappy.Product: The preprocessed product.
         """
 
         import model.preprocessing.operators as op
-
-        # 1. Read products
-        prod = op.read_product(prod_path)
-
-        # 2. Apply orbit file
-        prod = op.apply_orbit_file(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 3. Calibration
-        prod = op.calibration(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 4. Speckle filtering
-        prod = op.speckle_filtering(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 5. Geocoding
-        prod = op.terrain_correction(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 6 Create subset
+        from model.preprocessing.chain import OperatorChain
+
+        chain = OperatorChain(bands=[f"Sigma0_{pol}"] if pol else []).add("apply_orbit_file")
+        if subset and subset_first:
+            chain.add("create_subset", subset_polygon=u.pad_wkt(subset, subset_padding))
+        chain.add("calibration").add("speckle_filtering")
+        # On the standard grid, the pixels do not depend on the extent of the product, i.e. on whether it was subset
+        chain.add("terrain_correction", standard_grid=bool(subset))
         if subset:
-            prod = op.create_subset(prod, subset)
-            if steps:
-                out_path = os.path.join(out_dir, prod.getName())
-                prod = op.write_product(prod, out_path)
+            chain.add("create_subset", subset_polygon=subset)
 
-        # 7. Write
-        out_path = os.path.join(out_dir, prod.getName())
-        prod = op.write_product(prod, out_path)
+        out_path = os.path.join(out_dir, chain.product_name(prod_path))
+        path = chain.run(prod_path, out_path, backend=backend, steps_dir=out_dir if steps else "",
+                         gpt_threads=gpt_threads, gpt_cache=gpt_cache, progress=progress, cache=cache)
 
-        return prod
+        return op.read_product(path)
@@ -1,10 +1,12 @@
 """Module for the definition of a Detector."""
 import os
+import traceback
 from abc import ABC, abstractmethod
 
 import pandas as pd
 
 import utils
+from model.detection_queue import DetectionQueue, jvm_budget
 
 
 class Detector(ABC):
@@ -17,7 +19,11 @@ class Detector(ABC):
                  detec_dir: str = "",
                  proc_dir: str = "",
                  steps: bool = False,
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 backend: str = "snappy",
+                 gpt_threads: int = 0,
+                 gpt_cache: str = "",
+                 cache=None):
 
         self.subset = subset
         self.src_bands = src_bands
@@ -27,6 +33,12 @@ class Detector(ABC):
         self.steps = steps
         self.verbose = verbose
 
+        # Processing chain backend, see model.preprocessing.chain.OperatorChain.run
+        self.backend = backend
+        self.gpt_threads = gpt_threads
+        self.gpt_cache = gpt_cache
+        self.cache = cache  # ProductCache of the intermediate products, if any
+
         # Create folder structure
         if not os.path.isdir(out_dir):
             os.mkdir(out_dir)
@@ -45,6 +57,35 @@ class Detector(ABC):
         """
         pass
 
+    @staticmethod
+    def batch_queue(workers: int, jvm_memory: str = "", gpf_threads: int = 0) -> DetectionQueue:
+        """
+        Creates the queue of a parallel batch, whose workers run a JVM each with its own memory and parallelism.
+        :param workers: int. Products processed at the same time.
+        :param jvm_memory: str, optional. Maximal heap of each JVM, e.g. 8G. Defaults to snappy's configuration.
+        :param gpf_threads: int, optional. GPF parallelism of each JVM. Defaults to the cores split among the workers.
+        :return: DetectionQueue.
+        """
+        threads = gpf_threads or max(1, (os.cpu_count() or 1) // workers)
+        return DetectionQueue(max_workers=workers, initializer=jvm_budget, initargs=(jvm_memory, threads))
+
+    @staticmethod
+    def error_message(e: BaseException) -> str:
+        """
+        :param e: Exception raised while processing a product.
+        :return: str. Message and traceback, as reported for the failed jobs of a DetectionQueue.
+        """
+        return f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+    def report_job(self, job) -> None:
+        """
+        Prints the status of a batch job if verbose.
+        :param job: DetectionJob.
+        :return: None.
+        """
+        if self.verbose and job.finished:
+            print(f"{job.description}: {job.status} after {job.elapsed:.0f} s.")
+
     @staticmethod
     def order_by_name(*products) -> pd.DataFrame:
         """
@@ -7,6 +7,7 @@ import os.path
 import pandas as pd
 
 import utils as u
+from model.detection_queue import DONE
 from .detector import Detector
 
 
@@ -25,11 +26,16 @@ class VesselDetector(Detector):
                  max_tgt: float = 50.0,
                  land_mask: str = "",
                  src_bands: str = "",
+                 polarisations: str = "",
                  out_dir: str = "vessel_detections",
                  detect_dir: str = "detections",
                  proc_dir: str = "processed",
                  steps: bool = False,
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 backend: str = "snappy",
+                 gpt_threads: int = 0,
+                 gpt_cache: str = "",
+                 cache=None):
 
         super(VesselDetector, self).__init__(
             subset=subset,
@@ -38,7 +44,11 @@ class VesselDetector(Detector):
             detec_dir=detect_dir,
             proc_dir=proc_dir,
             steps=steps,
-            verbose=verbose
+            verbose=verbose,
+            backend=backend,
+            gpt_threads=gpt_threads,
+            gpt_cache=gpt_cache,
+            cache=cache
         )
 
         # Params
@@ -50,6 +60,7 @@ class VesselDetector(Detector):
         self.max_tgt = max_tgt
 
         self.land_mask: str = land_mask  # Land mask file to import to the product if wanted
+        self.polarisations = polarisations  # Comma separated polarisations to detect on, all of them if empty
 
     def add_mask(self, *products, mask_path: str):
         """
@@ -65,7 +76,9 @@ class VesselDetector(Detector):
     def sea_object_detection_chain(prod_path: str, land_mask: str = "", subset: str = "", bands: str = "",
                                    tgt_window: int = 30, guard_wd_size: float = 500.0, bg_wd_size: float = 800.0,
                                    pfa: float = 12.5, min_tgt: float = 30.0, max_tgt: float = 600.0,
-                                   out_dir: str = "", terrain_correction: bool = True, steps: bool = False):
+                                   out_dir: str = "", terrain_correction: bool = True, steps: bool = False,
+                                   progress=None, backend: str = "snappy", gpt_threads: int = 0, gpt_cache: str = "",
+                                   polarisations: str = "", cache=None):
         """
         Sea Object Detection processing chain implemented as if it is run from SNAP.
         :param prod_path: str. Path to the product.
@@ -82,130 +95,198 @@ class VesselDetector(Detector):
         :param terrain_correction: bool, optional. If set, applies terrain correction in the end so product is visible
             more user friendly when opened with SNAP. Defaults to True.
         :param steps: bool, optional. If set, all intermediary products are also stored. Defaults to False.
-        :return: The processed product.
+        :param progress: Callable, optional. Called with the name of each step before it is run. Defaults to None.
+        :param backend: str, optional. Backend of the chain, snappy or gpt. Defaults to snappy.
+        :param gpt_threads: int, optional. Parallelism of the gpt backend. Defaults to gpt's default.
+        :param gpt_cache: str, optional. Tile cache size of the gpt backend, e.g. 4G. Defaults to gpt's default.
+        :param polarisations: str, optional. Comma separated polarisations to detect on, e.g. VH. If given, only their
+            bands are processed and written. Defaults to "", which keeps every polarisation.
+        :param cache: ProductCache, optional. If given, the calibrated product and the detections are read from it if
+            they were already computed with the same parameters, and stored otherwise. Defaults to None.
+        :return: The processed product and its path, without extension.
         """
         import model.preprocessing.operators as op
+        from model.preprocessing.chain import OperatorChain
 
-        # 0 Read
-        prod = op.read_product(prod_path)
-
-        # 1 Add mask_dile if specified
+        # Add mask_dile if specified
         if land_mask:
             pass  # TODO
 
-        # 2 Orbit File
-        prod = op.apply_orbit_file(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
+        # Object discrimination needs the calibrated band of each polarisation and its ship mask
+        demand = [x for pol in polarisations.split(",") if pol
+                  for x in (f"Sigma0_{pol}", f"Sigma0_{pol}_ship_bit_msk")]
 
-        # 3 Subset
+        chain = OperatorChain(bands=demand).add("apply_orbit_file")
         if subset:
-            prod = op.create_subset(prod, subset)
-            if steps:
-                out_path = os.path.join(out_dir, prod.getName())
-                prod = op.write_product(prod, out_path)
-
-        # 4 Land-Sea-Mask
-        prod = op.land_sea_mask(prod, bands)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 5 Calibration
-        prod = op.calibration(prod)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 6 Adaptive Thresholding
-        prod = op.adaptive_thresholding(prod, target_window=tgt_window, guard_window=guard_wd_size,
-                                        bg_window=bg_wd_size, pfa=pfa)
-        if steps:
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
-
-        # 7 Object Discrimination
-        prod = op.object_discrimination(prod, min_tgt=min_tgt, max_tgt=max_tgt)
-
-        # 8 Write
-        # out_path = u.generate_output_string(prod_path, out_dir, "", suffix)
-        out_path = os.path.join(out_dir, prod.getName())
-        prod = op.write_product(prod, out_path)
-
-        # 9 Terrain correction
+            chain.add("create_subset", subset_polygon=subset)
+        chain.add("land_sea_mask", source_bands=bands)
+        chain.add("calibration").checkpoint()  # The thresholds are what is tuned between runs
+        chain.add("adaptive_thresholding", target_window=tgt_window, guard_window=guard_wd_size,
+                  bg_window=bg_wd_size, pfa=pfa)
+        chain.add("object_discrimination", min_tgt=min_tgt, max_tgt=max_tgt)
+
+        options = {"backend": backend, "gpt_threads": gpt_threads, "gpt_cache": gpt_cache, "progress": progress,
+                   "cache": cache}
+        out_path = os.path.join(out_dir, chain.product_name(prod_path))
+        path = chain.run(prod_path, out_path, steps_dir=out_dir if steps else "", **options)
+
         if terrain_correction:
-            prod = op.terrain_correction(prod)
-            out_path = os.path.join(out_dir, prod.getName())
-            prod = op.write_product(prod, out_path)
+            chain = OperatorChain(bands=demand).add("terrain_correction")
+            out_path = os.path.join(out_dir, chain.product_name(path))
+            path = chain.run(path, out_path, **options)
 
-        return prod, out_path
+        return op.read_product(path), out_path
 
-    def detect(self, *prods):
-        """Detects vessels for the given inputs.
+    def detect(self, *prods, workers: int = 1, jvm_memory: str = "", gpf_threads: int = 0):
+        """Detects vessels for the given inputs. A product that fails is reported and skipped, the rest of the batch
+        goes on.
 
         :param prods: Paths to the input products.
-        :return: Summary DataFrame, a list of detection DataFrames, a list of resulting products, and a list of resulting names
+        :param workers: int, optional. Products processed at the same time, each in a worker process with a JVM of its
+            own. Defaults to 1, which processes them one after the other in this process.
+        :param jvm_memory: str, optional. Maximal heap of each worker's JVM, e.g. 8G. Defaults to snappy's
+            configuration.
+        :param gpf_threads: int, optional. GPF parallelism of each worker's JVM. Defaults to the cores split among the
+            workers.
+        :return: Summary DataFrame, a list of detection DataFrames, a list of resulting products, a list of resulting
+            names, in the order of the inputs, and a dict with the error of each failed input.
         """
+        import model.preprocessing.operators as op
+
+        outcomes = []  # (prod, out_name, detect_df, info, error) of each input, in order
+        if workers > 1:
+            queue = self.batch_queue(workers, jvm_memory, gpf_threads)
+            ids = [queue.submit(self._process_product, p, description=os.path.basename(p)) for p in prods]
+            queue.join(callback=self.report_job)
+
+            for job_id in ids:
+                job = queue.jobs[job_id]
+                if job.status == DONE:
+                    out_name, detect_df, info = job.result
+                    outcomes.append((op.read_product(f"{out_name}.dim"), out_name, detect_df, info, ""))
+                else:
+                    outcomes.append((None, None, None, None, job.error))
+        else:
+            for i, p in enumerate(prods):  # For each input product
+                # Execute the defined processing chain
+                start_t = dt.datetime.now()
+                try:
+                    outcomes.append((*self._process(p), ""))
+                except Exception as e:
+                    outcomes.append((None, None, None, None, self.error_message(e)))
+                end_t = dt.datetime.now()
+
+                if self.verbose:
+                    print(f"Product {i + 1} of {len(prods)} took {end_t - start_t} to process.")
 
         results = []
         result_names = []
         detections = []
         summary = []
+        failed = {}
 
-        for i, p in enumerate(prods):  # For each input product
-            # Execute the defined processing chain
-            start_t = dt.datetime.now()
-            prod, out_name = VesselDetector.sea_object_detection_chain(p, self.land_mask, self.subset, self.src_bands,
-                                                                       out_dir=self.proc_dir, steps=self.steps,
-                                                                       terrain_correction=False,
-                                                                       tgt_window=self.tgt_window,
-                                                                       guard_wd_size=self.guard_wd_size,
-                                                                       bg_wd_size=self.bg_wd_size, pfa=self.pfa,
-                                                                       min_tgt=self.min_tgt, max_tgt=self.max_tgt)
-            end_t = dt.datetime.now()
-
-            if self.verbose:
-                print(f"Product {i + 1} of {len(prods)} took {end_t - start_t} to process.")
+        for p, (prod, out_name, detect_df, info, error) in zip(prods, outcomes):
+            if error:
+                failed[p] = error
+                if self.verbose:
+                    print(f"{os.path.basename(p)} failed: {error}")
+                continue
 
             results.append(prod)  # Attach the output paths to the list
             result_names.append(out_name)  # Attach the output path to the list
 
-            # Calculate ShipDetections.csv path
-            detect_file = os.path.join(f"{out_name}.data", "vector_data", "ShipDetections.csv")
-
-            if os.path.isfile(detect_file):
-                # Load it to a DataFrame
-                detect_df = pd.read_csv(detect_file, skiprows=1, sep="\t", index_col=0, header=0,
-                                        names=["targets", "x", "y", "lat", "lon", "width", "length"],
-                                        usecols=[0, 2, 3, 4, 5, 6, 7])
-
+            if detect_df is not None:
                 detections.append(detect_df)  # Append to list
+                summary.append(info)
 
-                # Extract filename information
-                product_info = u.extract_name_info(p)
+        summary_df = self.save_summary(summary)
 
-                # Add info to summary dict
-                summary.append(
-                    {
-                        "file": prod.getName(),
-                        "datetime": dt.datetime.strptime(f"{product_info['start']}", "%Y%m%dT%H%M%S"),
-                        "prod_id": product_info["prod_id"],
-                        "datatake": product_info["take_id"],
-                        "n_detects": len(detect_df)
-                    }
-                )
+        return {"summary": summary_df, "detections": detections, "results": results, "resultnames": result_names,
+                "failed": failed}
+
+    def detect_product(self, prod_path: str, progress=None):
+        """
+        Detects vessels in a single product. Meant to be run as a job of a DetectionQueue, so that only picklable
+        values are returned.
+        :param prod_path: str. Path to the input product.
+        :param progress: Callable, optional. Called with the name of each step of the chain. Defaults to None.
+        :return: dict. Row of the summary for the product, or None if no detections file was written.
+        """
+        _, _, _, info = self._process(prod_path, progress=progress)
+        return info
 
-                # Save formatted detection dataframe to specified dir
-                detect_file = os.path.join(self.detect_dir, f"{prod.getName()}.csv")
-                detect_df.to_csv(detect_file)
+    def _process_product(self, prod_path: str, progress=None):
+        """
+        Runs _process as a job of a parallel batch, returning only picklable values.
+        :param prod_path: str. Path to the input product.
+        :param progress: Callable, optional. Called with the name of each step of the chain. Defaults to None.
+        :return: The path of the resulting product, the detection DataFrame and the summary row.
+        """
+        _, out_name, detect_df, info = self._process(prod_path, progress=progress)
+        return out_name, detect_df, info
 
+    def save_summary(self, summary) -> pd.DataFrame:
+        """
+        Saves the summary of the detections to the output directory.
+        :param summary: list. Summary rows of the products, as returned by detect_product.
+        :return: Summary DataFrame.
+        """
         # Convert summary to dataframe
-        summary_df = pd.DataFrame(summary)
+        summary_df = pd.DataFrame(summary, columns=["file", "datetime", "prod_id", "datatake", "n_detects"])
         summary_df.set_index("file", inplace=True)
 
         # Save summary df to csv
         summary_file = os.path.join(self.out_dir, f"detections_{u.formatted_ts()}.csv")
         summary_df.to_csv(summary_file, sep=";", decimal=",")
 
-        return {"summary": summary_df, "detections": detections, "results": results, "resultnames": result_names}
+        return summary_df
+
+    def _process(self, prod_path: str, progress=None):
+        """
+        Runs the processing chain on a product and saves its formatted detections.
+        :param prod_path: str. Path to the input product.
+        :param progress: Callable, optional. Called with the name of each step of the chain. Defaults to None.
+        :return: The resulting product, its path, the detection DataFrame and the summary row. The last two are None
+            if no detections file was written.
+        """
+        prod, out_name = VesselDetector.sea_object_detection_chain(prod_path, self.land_mask, self.subset,
+                                                                   self.src_bands, out_dir=self.proc_dir,
+                                                                   steps=self.steps, terrain_correction=False,
+                                                                   tgt_window=self.tgt_window,
+                                                                   guard_wd_size=self.guard_wd_size,
+                                                                   bg_wd_size=self.bg_wd_size, pfa=self.pfa,
+                                                                   min_tgt=self.min_tgt, max_tgt=self.max_tgt,
+                                                                   progress=progress, backend=self.backend,
+                                                                   gpt_threads=self.gpt_threads,
+                                                                   gpt_cache=self.gpt_cache,
+                                                                   polarisations=self.polarisations,
+                                                                   cache=self.cache)
+
+        # Calculate ShipDetections.csv path
+        detect_file = os.path.join(f"{out_name}.data", "vector_data", "ShipDetections.csv")
+
+        if not os.path.isfile(detect_file):
+            return prod, out_name, None, None
+
+        # Load it to a DataFrame
+        detect_df = pd.read_csv(detect_file, skiprows=1, sep="\t", index_col=0, header=0,
+                                names=["targets", "x", "y", "lat", "lon", "width", "length"],
+                                usecols=[0, 2, 3, 4, 5, 6, 7])
+
+        # Extract filename information
+        product_info = u.extract_name_info(prod_path)
+
+        # Summary row of the product
+        info = {
+            "file": os.path.basename(out_name),
+            "datetime": dt.datetime.strptime(f"{product_info['start']}", "%Y%m%dT%H%M%S"),
+            "prod_id": product_info["prod_id"],
+            "datatake": product_info["take_id"],
+            "n_detects": len(detect_df)
+        }
+
+        # Save formatted detection dataframe to specified dir
+        detect_file = os.path.join(self.detect_dir, f"{os.path.basename(out_name)}.csv")
+        detect_df.to_csv(detect_file)
+
+        return prod, out_name, detect_df, info
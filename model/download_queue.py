@@ -0,0 +1,266 @@
+"""Module for the adaptive-concurrency download queue."""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import requests
+from sentinelsat.exceptions import InvalidChecksumError, SentinelAPIError
+
+# Status codes with which the hub asks clients to slow down
+THROTTLED = (429, 503)
+
+
+class DownloadCancelled(Exception):
+    """Raised when a download is cancelled, either before it started or while it was running."""
+
+
+class AdaptiveLimiter:
+    """
+    Semaphore whose number of slots follows an AIMD policy: it grows by one slot every time as many requests as slots
+    succeed, and halves when the server answers with 429 or 503. It never exceeds its maximum, which should be the hub's
+    per-user limit of concurrent connections. It is used as a context manager around each request, and the outcome of
+    the request is taken from the exception leaving the block, if any.
+    """
+
+    def __init__(self, max_limit: int = 4, initial: int = None, min_limit: int = 1, cooldown: float = 1.0):
+        """
+        :param max_limit: int, optional. Maximal number of concurrent requests. Defaults to 4.
+        :param initial: int, optional. Initial number of concurrent requests. Defaults to max_limit.
+        :param min_limit: int, optional. Minimal number of concurrent requests. Defaults to 1.
+        :param cooldown: float, optional. Seconds after a decrease during which further throttled responses, which
+            were probably sent before it took effect, do not decrease the limit again. Defaults to 1.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.limit = float(initial if initial is not None else max_limit)
+        self.active = 0
+
+        self._cond = threading.Condition()
+        self._decreased = 0.0
+
+    def acquire(self) -> bool:
+        """
+        Waits for a free slot.
+        :return: True.
+        """
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+        return True
+
+    def release(self, throttled: bool = False, succeeded: bool = True) -> None:
+        """
+        Frees a slot and adapts the limit.
+        :param throttled: bool, optional. Whether the server asked to slow down. Defaults to False.
+        :param succeeded: bool, optional. Whether the request succeeded. Other failures leave the limit as it is.
+            Defaults to True.
+        :return: None.
+        """
+        with self._cond:
+            self.active -= 1
+            if throttled:
+                self._decrease()
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def throttled(self) -> None:
+        """
+        Halves the limit because of a throttled response that was checked once its slot had been freed, as sentinelsat
+        does with its metadata requests.
+        :return: None.
+        """
+        with self._cond:
+            self._decrease()
+
+    def _decrease(self) -> None:
+        """
+        Halves the limit, unless it was decreased less than cooldown seconds ago. To be called with the lock held.
+        :return: None.
+        """
+        now = time.monotonic()
+        if now - self._decreased > self.cooldown:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self._decreased = now
+
+    def set_max_limit(self, max_limit: int) -> None:
+        """
+        Changes the maximal number of concurrent requests.
+        :param max_limit: int. New maximum.
+        :return: None.
+        """
+        with self._cond:
+            self.max_limit = max_limit
+            self.limit = min(self.limit, float(max_limit))
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(is_throttled(exc), exc is None)
+        return False
+
+
+def is_throttled(exc: BaseException) -> bool:
+    """
+    Checks whether an exception comes from a response that asks to slow down.
+    :param exc: Exception, or None.
+    :return: bool.
+    """
+    response = getattr(exc, "response", None)
+    return response is not None and getattr(response, "status_code", None) in THROTTLED
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Checks whether a failed download may succeed if it is tried again.
+    :param exc: Exception.
+    :return: bool.
+    """
+    if isinstance(exc, InvalidChecksumError):  # The corrupt file has been removed
+        return True
+    if isinstance(exc, SentinelAPIError):  # Checked responses, e.g. of metadata requests
+        response = exc.response
+        return response is not None and (response.status_code in THROTTLED or response.status_code >= 500)
+    if isinstance(exc, requests.RequestException):
+        response = getattr(exc, "response", None)
+        if response is None:  # Connection errors and timeouts
+            return True
+        return response.status_code in THROTTLED or response.status_code >= 500
+    return False
+
+
+def backoff(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Delay before retrying a failed request. Full jitter, so that throttled requests do not retry all at once.
+    :param attempt: int. Attempt that failed, starting at 1.
+    :param base_delay: float, optional. Maximal delay after the first attempt, in seconds. Defaults to 1.
+    :param max_delay: float, optional. Maximal delay, in seconds. Defaults to 60.
+    :return: float. Seconds to wait.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class DownloadQueue:
+    """
+    Bounded pool of workers that download products in priority order. A failed product is put back in the queue after
+    a jittered exponential backoff, so its retries do not hold a worker nor block the rest of the batch. Products are
+    only started while there are free slots in the limiter, so that ordering is kept when the hub throttles.
+    """
+
+    def __init__(self, fetch, limiter: AdaptiveLimiter, max_workers: int = 4, max_attempts: int = 10,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        :param fetch: Callable. Downloads a product given its uuid and returns its information dict.
+        :param limiter: AdaptiveLimiter. Limiter shared by the requests of every product.
+        :param max_workers: int, optional. Maximal number of products downloaded at the same time. Defaults to 4.
+        :param max_attempts: int, optional. Attempts per product. Defaults to 10.
+        :param base_delay: float, optional. Backoff of the first retry, in seconds. Defaults to 1.
+        :param max_delay: float, optional. Maximal backoff, in seconds. Defaults to 60.
+        """
+        self.fetch = fetch
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def run(self, uuids, priority=None, fail_fast: bool = False, cancel: threading.Event = None, status=None):
+        """
+        Downloads every product.
+        :param uuids: Iterable of product uuids.
+        :param priority: dict or Series, optional. Sort key of each uuid, lower first. Products without key, or every
+            product if not given, go after the others in their original order.
+        :param fail_fast: bool, optional. If set, the first failed product stops the queue and its exception is
+            raised. Defaults to False.
+        :param cancel: threading.Event, optional. Once set, no more products are started. Those that were not
+            downloaded fail with DownloadCancelled. Running downloads are expected to watch it too.
+        :param status: Callable, optional. Called with the uuid and the new status of a product: retrying, failed,
+            downloaded or cancelled. It is called from the worker threads.
+        :return: A tuple with the dicts of downloaded products { uuid: info } and failed ones { uuid: exception }.
+        """
+        cancel = cancel if cancel is not None else threading.Event()
+        status = status if status is not None else (lambda uuid, value: None)
+        priority = {} if priority is None else dict(priority)
+        counter = itertools.count()
+
+        # Entries: (not before, has no priority, priority, order, uuid, attempt)
+        heap = []
+        for uuid in uuids:
+            key = priority.get(uuid)
+            heap.append((0.0, key is None, key if key is not None else 0, next(counter), uuid, 1))
+        heapq.heapify(heap)
+
+        downloaded, failed = {}, {}
+        state = {"running": 0, "error": None}
+        cond = threading.Condition()
+
+        def next_entry():
+            # Waits for a ready entry and a free slot. Returns None once there is nothing left to do
+            with cond:
+                while True:
+                    if state["error"] is not None or cancel.is_set() or (not heap and not state["running"]):
+                        return None
+                    now = time.monotonic()
+                    ready = [entry for entry in heap if entry[0] <= now]
+                    slots = min(self.max_workers, max(1, int(self.limiter.limit)))
+                    if ready and state["running"] < slots:
+                        entry = min(ready, key=lambda e: e[1:4])
+                        heap.remove(entry)
+                        heapq.heapify(heap)
+                        state["running"] += 1
+                        return entry
+                    timeout = min((entry[0] for entry in heap), default=now + 1.0) - now
+                    cond.wait(min(max(timeout, 0.01), 1.0))
+
+        def worker():
+            while True:
+                entry = next_entry()
+                if entry is None:
+                    return
+
+                _, no_priority, key, order, uuid, attempt = entry
+                try:
+                    info = self.fetch(uuid)
+                except Exception as e:
+                    if is_throttled(e):  # Counted again if it left the limiter, which its cooldown ignores
+                        self.limiter.throttled()
+                    with cond:
+                        state["running"] -= 1
+                        if is_retryable(e) and attempt < self.max_attempts and not cancel.is_set():
+                            delay = backoff(attempt, self.base_delay, self.max_delay)
+                            heapq.heappush(heap, (time.monotonic() + delay, no_priority, key, order, uuid, attempt + 1))
+                            status(uuid, "retrying")
+                        else:
+                            failed[uuid] = e
+                            status(uuid, "cancelled" if isinstance(e, DownloadCancelled) else "failed")
+                            if fail_fast:
+                                state["error"] = e
+                        cond.notify_all()
+                else:
+                    with cond:
+                        state["running"] -= 1
+                        downloaded[uuid] = info
+                        status(uuid, "downloaded")
+                        cond.notify_all()
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, self.max_workers))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        if state["error"] is not None:
+            raise state["error"]
+
+        for entry in heap:  # Not started, or waiting to be retried, when the queue was cancelled
+            failed[entry[4]] = DownloadCancelled(f"Download of {entry[4]} was cancelled")
+            status(entry[4], "cancelled")
+
+        return downloaded, failed
@@ -1,32 +1,95 @@
 """Module for downloading, querying and filtering products."""
+from __future__ import annotations
+
 import configparser
 import configparser as cfgp
-import copy
 import json
 import os.path
 import re
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from xml.dom import minidom
 
+import numpy as np
 import pandas as pd
 import sentinelsat
+import shapely.ops
 import shapely.wkt
 from pandas import DataFrame
-from geopandas import GeoDataFrame
 from sentinelsat import SentinelAPI
+from sentinelsat.sentinel import _format_order_by, _parse_opensearch_response
 
 import utils
+from . import coverage, results
+from .availability import AvailabilityResolver
+from .download_queue import AdaptiveLimiter, DownloadCancelled, DownloadQueue
+from .query_cache import QueryCache
+from .quicklooks import QuicklookStore
+from .transfer import RangeDownloader
+from .watch import WatchedQuery
+
+gpd = utils.LazyModule("geopandas")
 
 pd.options.mode.chained_assignment = None
 
+DownloadResult = namedtuple("ResultTuple", ["downloaded", "retrieval_triggered", "failed"])
+QuicklookResult = namedtuple("ResultTuple", ["downloaded", "failed"])
+
 
 class Downloader(SentinelAPI):
     """Downloader, filterer and queryer for Sentinel products."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Every request to the hub goes through sentinelsat's download semaphore, which becomes adaptive
+        self._dl_limit_semaphore = AdaptiveLimiter(self.concurrent_dl_limit)
+
+        self._availability: AvailabilityResolver = None
+        self.query_cache: QueryCache = QueryCache()  # Set to None to disable the query cache
+        self.query_workers: int = 4  # Result pages fetched at the same time. Set to 1 to page serially
+        self.aoi_max_vertices: int = 50  # Larger AoIs are sent to the hub as a simpler stand-in. Set to None to disable
+        self.segments_per_product: int = 4  # Range requests per product downloaded at the same time
+        self.quicklook_store: QuicklookStore = QuicklookStore()
+
+    @property
+    def availability(self) -> AvailabilityResolver:
+        """
+        Bulk resolver of the products' access status. Created upon first use with the session's credentials, and
+        bounded by the same limiter as the other requests to the hub.
+        :return: AvailabilityResolver.
+        """
+        if self._availability is None:
+            self._availability = AvailabilityResolver(self.api_url, self.session.auth,
+                                                      max_workers=self.concurrent_dl_limit,
+                                                      timeout=self.session.timeout, headers=self.session.headers,
+                                                      limiter=self.dl_limit_semaphore)
+        return self._availability
+
+    @property
+    def concurrent_dl_limit(self) -> int:
+        """
+        Maximal number of concurrent requests allowed by the hub per user. Requests are adaptively kept below it.
+        :return: int.
+        """
+        return self._concurrent_dl_limit
+
+    @concurrent_dl_limit.setter
+    def concurrent_dl_limit(self, value: int):
+        self._concurrent_dl_limit = value
+        if isinstance(self._dl_limit_semaphore, AdaptiveLimiter):
+            self._dl_limit_semaphore.set_max_limit(value)
+
     def query(self, aoi=None, start="", end="", platformname="Sentinel-1", producttype="GRD",
-              relative_orbit: int = None, area_relation="Intersects", **kwargs):
+              relative_orbit: int = None, area_relation="Intersects", refresh: bool = False, store: bool = True,
+              **kwargs):
         """
         Reimplemented query function where many default parameters have been set. Returns products ordered in ascending
-        beginposition.
+        beginposition. Results are served from the query cache when the same query has already been run, or filtered
+        locally from a cached broader query that contains every product this one would return. AoIs with more than
+        aoi_max_vertices vertices are replaced by a simpler geometry that covers them, and the products returned by the
+        hub are then checked against the exact AoI locally.
         :param aoi: str. AoI WKT string.
         :param start: str. Start date in format: YYYYMMDD
         :param end: str. End date in format: YYYYMMDD
@@ -34,76 +97,482 @@ class Downloader(SentinelAPI):
         :param producttype: str. Product type. Defaults to GRD.
         :param relative_orbit: int. Relative orbit number.
         :param area_relation: str. Determins how products are retrieved. Possible values are: Intersects, Contains and IsWhithin.
+        :param refresh: bool. If set, the cache is bypassed and the query is sent to the hub. Defaults to False.
+        :param store: bool. If not set, the results of the hub are not stored in the query cache, e.g. for queries that
+            will never be run again. Defaults to True.
         :param kwargs: Other keyword args accepted by the Open Access Hub.
         :return: dict with following structure: { uuid: product_values, ... }
         """
+        res = OrderedDict()
+        for page in self.query_pages(aoi, start, end, platformname, producttype, relative_orbit, area_relation,
+                                     refresh, store, **kwargs):
+            res.update(page)
+        return res
+
+    def query_pages(self, aoi=None, start="", end="", platformname="Sentinel-1", producttype="GRD",
+                    relative_orbit: int = None, area_relation="Intersects", refresh: bool = False,
+                    store: bool = True, **kwargs):
+        """
+        Streaming version of query, with the same parameters. Products are yielded page by page as soon as each page
+        arrives, while the following pages are still being fetched. Results found in the query cache are yielded at
+        once, and the results of the hub are only cached once every page has been received. Closing the generator
+        cancels the pages that have not been requested yet.
+        :return: Generator of dicts with the format { uuid: product_values }, in ascending beginposition.
+        """
+
+        params = QueryCache.normalize(self.api_url, aoi, start, end, platformname, producttype, relative_orbit,
+                                      area_relation, **kwargs)
+        key = QueryCache.key(params)
+
+        if self.query_cache is not None and not refresh:
+            cached = self.query_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+            # A narrower version of a cached query is answered locally
+            for superset_key, outer in self.query_cache.supersets(params, aoi):
+                superset = self.query_cache.get(superset_key)
+                if superset is None:
+                    continue
+
+                # Only what the broader query did not already filter on the hub needs to be checked
+                attributes = {k: v for k, v in kwargs.items() if k.lower() not in outer["kwargs"]}
+                if relative_orbit and outer["relative_orbit"] is None:
+                    attributes["relativeorbitnumber"] = relative_orbit
+                res = results.select(superset, aoi, start, end, area_relation, **attributes)
+                if res is not None:
+                    yield res
+                    return
+
+        # Complex AoIs are replaced by a stand-in that covers them. Any product that intersects, contains or is within
+        # the AoI intersects its stand-in, so the exact relation can be checked locally afterwards
+        hub_aoi, hub_relation = aoi, area_relation
+        if aoi and self.aoi_max_vertices:
+            geometry = shapely.wkt.loads(aoi)
+            simplified = coverage.stand_in(geometry, self.aoi_max_vertices)
+            if simplified is not geometry:
+                hub_aoi, hub_relation = simplified.wkt, "Intersects"
 
         if relative_orbit:
-            return super().query(aoi, (start, end), order_by="+beginposition", area_relation=area_relation,
-                                 relativeorbitnumber=relative_orbit, platformname=platformname, producttype=producttype,
-                                 **kwargs)
-        else:
-            return super().query(aoi, (start, end), order_by="+beginposition", area_relation=area_relation,
-                                 platformname=platformname, producttype=producttype, **kwargs)
+            kwargs["relativeorbitnumber"] = relative_orbit
+        query = self.format_query(hub_aoi, (start, end), area_relation=hub_relation, platformname=platformname,
+                                  producttype=producttype, **kwargs)
+        self.logger.debug("Running query: %s", query)
+
+        received = set()  # Products that moved between pages while they were fetched are only yielded once
+        res = OrderedDict()
+        for entries, count in self._load_pages(query, _format_order_by("+beginposition")):
+            if not received:
+                self.logger.info(f"Found {count:,} products")
+
+            page = OrderedDict((uuid, properties) for uuid, properties in _parse_opensearch_response(entries).items()
+                               if uuid not in received)
+            received.update(page)
+            if hub_aoi != aoi:
+                page = results.select(page, aoi, area_relation=area_relation)
+
+            res.update(page)
+            if page:
+                yield page
+
+        if self.query_cache is not None and store:
+            self.query_cache.put(key, params, res, aoi)
+
+    def _load_query(self, query, order_by=None, limit=None, offset=0):
+        """
+        Reimplemented result paging of SentinelAPI, which puts together the pages of _load_pages.
+        :param query: str. Formatted query.
+        :param order_by: str, optional. Server side ordering.
+        :param limit: int, optional. Maximal number of products.
+        :param offset: int, optional. Number of products to skip.
+        :return: A tuple with the list of OpenSearch entries and the total count.
+        """
+        products, count = [], 0
+        for page, count in self._load_pages(query, order_by, limit, offset):
+            products += page
+        return products, count
+
+    def _load_pages(self, query, order_by=None, limit=None, offset=0):
+        """
+        Fetches the result pages of a query. The first page tells the total count, the remaining page offsets are then
+        fetched concurrently and yielded in offset order, so the server side ordering is kept. The first page is
+        yielded while the others are being fetched. Note that concurrent requests are also bounded by
+        concurrent_dl_limit.
+        :param query: str. Formatted query.
+        :param order_by: str, optional. Server side ordering.
+        :param limit: int, optional. Maximal number of products.
+        :param offset: int, optional. Number of products to skip.
+        :return: Generator of tuples with the list of OpenSearch entries of a page and the total count.
+        """
+        products, count = self._load_subquery(query, order_by, limit, offset)
+
+        max_offset = count if limit is None else min(count, offset + limit)
+        offsets = range(offset + self.page_size, max_offset, self.page_size)
+        if not offsets:
+            yield products, count
+            return
+
+        def load_page(page_offset):
+            page_limit = None if limit is None else limit - page_offset + offset
+            return self._load_subquery(query, order_by, page_limit, page_offset)[0]
+
+        progress = self._tqdm(desc="Querying products", initial=len(products), total=max_offset - offset,
+                              unit="product")
+        with ThreadPoolExecutor(max(1, self.query_workers)) as executor:
+            futures = [executor.submit(load_page, page_offset) for page_offset in offsets]
+            try:
+                yield products, count
+                for future in futures:
+                    page = future.result()
+                    progress.update(len(page))
+                    yield page, count
+            finally:  # Pages that have not started are dropped if the generator is closed or fails
+                for future in futures:
+                    future.cancel()
+                progress.close()
+
+    def query_new(self, watch: WatchedQuery) -> dict:
+        """
+        Runs a saved query again, only fetching the products ingested since its last run. The new products are merged
+        into the ones found so far and the watermark is moved forward.
+        :param watch: WatchedQuery. Saved query. Its results and watermark are updated on disk.
+        :return: dict with the format { uuid: properties } with the new products only, in ascending beginposition.
+        """
+        params = watch.query_params()
+        if watch.watermark:  # The range is inclusive, products at the watermark are dropped below
+            params["ingestiondate"] = (watch.watermark, "NOW")
+
+        # Every run has a watermark of its own, so its results are never looked up again
+        res = self.query(**params, refresh=True, store=False)
+
+        stored = watch.load_results()
+        delta = OrderedDict((uuid, properties) for uuid, properties in res.items() if uuid not in stored)
+        if not delta:
+            return delta
 
-    def filter_by_aoi_pct(self, res: dict, aoi: str, aoi_pct: int = 0, same_datatake: bool = True):
+        # Late ingestions may have been acquired before the latest stored products
+        stored.update(delta)
+        stored = OrderedDict(sorted(stored.items(), key=lambda item: item[1]["beginposition"]))
+
+        watermarks = [properties["ingestiondate"] for properties in delta.values()]
+        if watch.watermark:
+            watermarks.append(watch.watermark)
+        watch.watermark = max(watermarks)
+
+        watch.save(stored)
+
+        return delta
+
+    def filter_by_aoi_pct(self, res, aoi: str, aoi_pct: int = 0, same_datatake: bool = True):
         """
         Filtering the returned results by the aoi coverage pct.
-        :param res: Results dict.
+        :param res: Results dict, or a results GeoDataFrame created with results.to_frame. Neither is modified.
         :param aoi: AoI WKT string.
         :param aoi_pct: Percent of AoI coverage
         :param same_datatake: If set to True, aoi_pct will take into account the other products of the same datatake.
-        :return: Filtered dict.
+        :return: Filtered GeoDataFrame, in the same order as res, with the aoicoverage and access columns.
         """
 
-        results = copy.deepcopy(res)  # Copy so that source is not modified
+        frame = res if isinstance(res, gpd.GeoDataFrame) else results.to_frame(res)  # Converted once, column by column
+        if frame.empty:
+            return frame
 
-        # Filter by aoi_pcnt
         aoi = shapely.wkt.loads(aoi)  # Converts the WKT string
-        missiondatatakes = {}  # Dictionary where the aoi coverages per mission datatake are stored.
-        uuids = []  # List of uuids in iorder
-
-        # Iterate over the {uuid: properties}
-        for uuid, properties in results.items():
-            properties["satellite"] = properties["identifier"][:3]  # Extract the satellite who took the product
-            footprint = shapely.wkt.loads(properties["footprint"])  # Compile the footprint into WKT
-            properties["geometry"] = footprint  # Add it to the properties
-
-            # Remove info that is not needed
-            del properties["footprint"]
-            del properties["gmlfootprint"]
-
-
-            # Calculate the aoi coverage pct as an int
-            properties["aoicoverage"] = int(round(footprint.intersection(aoi).area / aoi.area * 100, 0))
-
-            # Check the access status
-            properties["access"] = "online" if self.is_online(uuid) else "offline"
-
-            if same_datatake:  # If same datatake should be taken into account
-                try:  # Add the uuids
-                    missiondatatakes[properties["missiondatatakeid"]]["uuids"].append(uuid)
-                    missiondatatakes[properties["missiondatatakeid"]]["pcts"].append(properties["aoicoverage"])
-                except KeyError:
-                    missiondatatakes[properties["missiondatatakeid"]] = {"uuids": [uuid],
-                                                                         "pcts": [properties["aoicoverage"]]}
-
-            else:  # If individual count
-                if properties["aoicoverage"] >= aoi_pct:
-                    uuids.append(uuid)
-
-        for uuid, properties in missiondatatakes.items():  # If not same_datatake, this dict will be empty
-            if sum(properties["pcts"]) >= aoi_pct:
-                uuids += properties["uuids"]
-
-        # Convert filtered results to dataframe manually
-        if len(uuids) > 0:
-            df = self.to_dataframe({k: results[k] for k in uuids})  # First to DataFrame
-            gdf = GeoDataFrame(df, crs="EPSG:4326", geometry="geometry")  # Convert to geodataframe
-        else:
-            gdf = GeoDataFrame(crs=crs, geometry=[])
 
-        return gdf
+        # Calculate the aoi coverage pct as an int
+        aoicoverage = pd.Series(coverage.aoi_coverage(frame.geometry, aoi).round().astype(int), index=frame.index)
+
+        mask = results.coverage_mask(aoicoverage, frame["missiondatatakeid"], aoi_pct, same_datatake)
+
+        filtered = frame[mask]  # Only the kept rows are materialized
+        filtered["aoicoverage"] = aoicoverage[mask]
+
+        # Check the access status of the kept products in a few batched requests
+        online = self.availability.resolve(filtered.index)
+        filtered["access"] = results.access_column(online.values())
+
+        return filtered
+
+    def filter_pages(self, pages, aoi: str, aoi_pct: int = 0, same_datatake: bool = True,
+                     resolve_access: bool = True):
+        """
+        Incremental version of filter_by_aoi_pct, for results that arrive page by page, e.g. from query_pages. Products
+        are yielded as soon as they are known to be kept: right away if they cover enough of the AoI, or once the
+        products of their datatake found so far cover enough together. Altogether, the yielded frames hold the same
+        products as filter_by_aoi_pct on the whole results, although products held back for their datatake come later
+        than in the results. The access status of each frame is resolved in the background while the next pages are
+        filtered, and frames are yielded in order once it is known.
+        :param pages: Iterable of results dicts, or of results GeoDataFrames created with results.to_frame.
+        :param aoi: AoI WKT string.
+        :param aoi_pct: Percent of AoI coverage
+        :param same_datatake: If set to True, aoi_pct will take into account the other products of the same datatake.
+        :param resolve_access: If not set, the access column is left missing, so that pages are not held up by the
+            requests to the hub, and is to be resolved by the caller, e.g. with availability in the background.
+        :return: Generator of GeoDataFrames with the aoicoverage and access columns. Empty ones are not yielded.
+        """
+        aoi = shapely.wkt.loads(aoi)
+
+        totals = {}  # Coverage of each datatake so far
+        held = None  # Products whose datatake does not cover enough yet
+        resolving = deque()  # Kept frames, along with the future access status of their products
+
+        executor = ThreadPoolExecutor(max(1, self.query_workers)) if resolve_access else None
+        try:
+            for page in pages:
+                frame = page if isinstance(page, gpd.GeoDataFrame) else results.to_frame(page)
+                if frame.empty:
+                    continue
+
+                frame = frame.assign(aoicoverage=coverage.aoi_coverage(frame.geometry, aoi).round().astype(int))
+
+                if same_datatake:
+                    sums = frame.groupby("missiondatatakeid", sort=False, observed=True)["aoicoverage"].sum()
+                    for datatake, total in sums.items():
+                        totals[datatake] = totals.get(datatake, 0) + total
+
+                    candidates = frame if held is None else pd.concat([held, frame])
+                    mask = candidates["missiondatatakeid"].astype(object).map(totals) >= aoi_pct
+                    held = candidates[~mask] if not mask.all() else None
+                else:
+                    candidates = frame
+                    mask = frame["aoicoverage"] >= aoi_pct
+
+                kept = candidates[mask]
+                if kept.empty:
+                    continue
+
+                if not resolve_access:
+                    kept["access"] = results.access_column(dict.fromkeys(kept.index).values())
+                    yield kept
+                    continue
+
+                # Check the access status of the kept products in a few batched requests
+                resolving.append((kept, executor.submit(self.availability.resolve, kept.index)))
+                while resolving and resolving[0][1].done():
+                    kept, online = resolving.popleft()
+                    kept["access"] = results.access_column(online.result().values())
+                    yield kept
+
+            while resolving:
+                kept, online = resolving.popleft()
+                kept["access"] = results.access_column(online.result().values())
+                yield kept
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def batch_search(self, aois: dict, start="", end="", aoi_pct: int = 0, same_datatake: bool = True, **kwargs):
+        """
+        Searches products for many AoIs at once. A single query is run for the union of the AoIs, so products that
+        cover several of them are only fetched once, and their coverage of every AoI is computed in one pass.
+        :param aois: dict with the format { name: AoI WKT string }.
+        :param start: str. Start date in format: YYYYMMDD
+        :param end: str. End date in format: YYYYMMDD
+        :param aoi_pct: int, optional. Percent of AoI coverage. Defaults to 0.
+        :param same_datatake: bool, optional. If set, aoi_pct takes into account the other products of the same
+            datatake. Defaults to True.
+        :param kwargs: Other keyword args accepted by Downloader.query, except for aoi and area_relation.
+        :return: A tuple with the coverage DataFrame, with the coverage percent of every product (rows, by uuid) and
+            AoI (columns, by name), and a dict with the format { name: filtered GeoDataFrame }, as returned by
+            filter_by_aoi_pct for each AoI.
+        """
+        aois = gpd.GeoSeries([shapely.wkt.loads(aoi) for aoi in aois.values()], index=list(aois), crs=results.CRS)
+
+        region = shapely.ops.unary_union(list(aois.values))
+        res = self.query(region.wkt, start, end, area_relation="Intersects", **kwargs)
+
+        frame = results.to_frame(res)
+        if frame.empty:
+            return pd.DataFrame(index=frame.index, columns=aois.index, dtype=int), {name: frame for name in aois.index}
+
+        matrix = coverage.coverage_matrix(frame.geometry, aois)
+        table = matrix.round().astype(int)
+
+        # Products returned for the union that do not intersect an AoI are not part of its results
+        masks = {name: results.coverage_mask(table[name], frame["missiondatatakeid"], aoi_pct, same_datatake)
+                 & (matrix[name] > 0) for name in aois.index}
+
+        # The access status of every kept product is resolved at once
+        kept = np.logical_or.reduce([mask.to_numpy() for mask in masks.values()])
+        online = self.availability.resolve(frame.index[kept])
+
+        views = {}
+        for name, mask in masks.items():
+            view = frame[mask]
+            view["aoicoverage"] = table.loc[mask, name]
+            view["access"] = results.access_column(online[uuid] for uuid in view.index)
+            views[name] = view
+
+        return table, views
+
+    def download_all(self, products, directory_path=".", max_attempts=10, checksum=True, n_concurrent_dl=None,
+                     lta_retry_delay=None, fail_fast=False, nodefilter=None, priority=None, progress=None,
+                     cancel=None):
+        """
+        Reimplemented download_all where online products are fetched with parallel range requests, resuming partially
+        downloaded files and verifying their MD5 checksum while they arrive. Products are queued in priority order and
+        those that fail are retried after a jittered backoff, without holding up the rest. The number of concurrent
+        requests adapts to the hub: it is halved when the hub answers 429 or 503 and grows back while requests succeed,
+        up to concurrent_dl_limit. Offline products are left to SentinelAPI.download_all, which triggers their
+        retrieval.
+        :param products: Iterable of product uuids, or results dict.
+        :param directory_path: str. Output directory. Defaults to current directory.
+        :param max_attempts: int. Attempts per product before it fails. Defaults to 10.
+        :param checksum: bool. If set, the MD5 checksum of the products is verified. Defaults to True.
+        :param n_concurrent_dl: int, optional. Products downloaded at the same time. Defaults to concurrent_dl_limit.
+        :param lta_retry_delay: float, optional. Seconds between retrieval requests of offline products.
+        :param fail_fast: bool. If set, the first failed download raises its exception. Defaults to False.
+        :param nodefilter: Callable, optional. If given, every product is downloaded by SentinelAPI.download_all.
+        :param priority: dict or Series, optional. Sort key of each uuid, lower first, e.g. the negated aoicoverage
+            column of the results, or their beginposition. Defaults to the order of products.
+        :param progress: Callable, optional. Called with the uuid, status, downloaded bytes and size of a product
+            whenever it changes. Statuses are downloading, retrying, downloaded, failed, cancelled, and triggered for
+            offline products whose retrieval was requested. It is called from the download threads.
+        :param cancel: threading.Event, optional. Once set, running downloads stop after their current chunk and can
+            be resumed later, and no more products are started. They are reported as failed with DownloadCancelled.
+        :return: Named tuple with the downloaded, retrieval_triggered and failed dicts of product information, as
+            SentinelAPI.download_all. Downloaded products also report their throughput in bytes per second.
+        """
+        if nodefilter is not None:
+            return super().download_all(products, directory_path, max_attempts, checksum, n_concurrent_dl,
+                                        lta_retry_delay, fail_fast, nodefilter)
+
+        uuids = list(products)
+        online = self.availability.resolve(uuids)
+
+        cancel = cancel if cancel is not None else threading.Event()
+        sizes = {uuid: [0, 0] for uuid in uuids}  # Downloaded bytes and size of each product
+
+        def notify(uuid, status):
+            if progress is not None:
+                progress(uuid, status, *sizes.get(uuid, (0, 0)))
+
+        transfer = RangeDownloader(self.session, max_segments=self.segments_per_product, max_attempts=max_attempts,
+                                   limiter=self.dl_limit_semaphore, timeout=self.session.timeout)
+
+        def fetch(uuid):
+            info = self.get_product_odata(uuid)
+            path = os.path.join(directory_path, info["title"] + ".zip")
+
+            # Downloaded before. Files are only put in place once verified, but they may have been modified since
+            if os.path.isfile(path) and os.path.getsize(path) == info["size"] and (
+                    not (checksum and info.get("md5")) or self._checksum_compare(path, info, 1024 ** 2)):
+                info.update({"path": path, "downloaded_bytes": 0})
+                sizes[uuid] = [info["size"], info["size"]]
+                return info
+
+            sizes[uuid] = [0, info["size"]]
+            notify(uuid, "downloading")
+            bar = self._tqdm(desc=info["title"], total=info["size"], unit="B", unit_scale=True, leave=False)
+
+            def update(n_bytes):
+                bar.update(n_bytes)
+                sizes[uuid][0] += n_bytes
+                notify(uuid, "downloading")
+
+            try:
+                info.update(transfer.download(info["url"], path, info["size"], info.get("md5") if checksum else None,
+                                              update, cancel))
+            finally:
+                bar.close()
+
+            self.logger.info("Downloaded %s (%.1f MB/s)", info["title"], info["throughput"] / 1024 ** 2)
+            return info
+
+        queue = DownloadQueue(fetch, self.dl_limit_semaphore, n_concurrent_dl or self.concurrent_dl_limit,
+                              max_attempts)
+        downloaded, errors = queue.run([uuid for uuid in uuids if online[uuid]], priority, fail_fast, cancel, notify)
+
+        failed = {}
+        for uuid, e in errors.items():
+            if isinstance(e, DownloadCancelled):
+                self.logger.info("Download of %s was cancelled", uuid)
+            else:
+                self.logger.error("Download of %s failed: %s", uuid, e)
+            failed[uuid] = {"exception": e}
+
+        retrieval_triggered = {}
+        offline = [uuid for uuid in uuids if not online[uuid]]
+        if offline and not cancel.is_set():
+            res = super().download_all(offline, directory_path, max_attempts, checksum, n_concurrent_dl,
+                                       lta_retry_delay, fail_fast)
+            downloaded.update(res.downloaded)
+            retrieval_triggered.update(res.retrieval_triggered)
+            failed.update(res.failed)
+            for uuid in res.retrieval_triggered:
+                notify(uuid, "triggered")
+        elif offline:
+            for uuid in offline:
+                failed[uuid] = {"exception": DownloadCancelled(f"Download of {uuid} was cancelled")}
+                notify(uuid, "cancelled")
+
+        return DownloadResult(downloaded, retrieval_triggered, failed)
+
+    def fetch_quicklooks(self, products: dict):
+        """
+        Makes sure the quicklooks of the products are in the quicklook store, downloading the missing ones
+        concurrently.
+        :param products: dict with the format { uuid: identifier }. Identifiers that are None are asked to the hub.
+        :return: A tuple with the dicts of stored quicklooks { uuid: path } and failed ones { uuid: error message }.
+        """
+        stored, failed = {}, {}
+        missing = {}
+        for uuid, identifier in products.items():
+            path = self.quicklook_store.get(identifier) if identifier else None
+            if path:
+                stored[uuid] = path
+            else:
+                missing[uuid] = identifier
+
+        def fetch(uuid):
+            identifier = missing[uuid] or self.get_product_odata(uuid)["title"]
+            path = self.quicklook_store.get(identifier)  # Known once the identifier has been asked for
+            if path:
+                return path
+
+            with self.dl_limit_semaphore:
+                response = self.session.get(self._get_odata_url(uuid, "/Products('Quicklook')/$value"))
+            self._check_scihub_response(response, test_json=False)
+            if response.headers.get("content-type") != "image/jpeg":
+                raise ValueError(f"Quicklook is not jpeg but {response.headers.get('content-type')}")
+            return self.quicklook_store.put(identifier, response.content)
+
+        if missing:
+            with ThreadPoolExecutor(self.concurrent_dl_limit) as executor:
+                futures = {uuid: executor.submit(fetch, uuid) for uuid in missing}
+            for uuid, future in futures.items():
+                try:
+                    stored[uuid] = future.result()
+                except Exception as e:
+                    failed[uuid] = str(e)
+
+            self.quicklook_store.evict()
+
+        return stored, failed
+
+    def download_all_quicklooks(self, products, directory_path="."):
+        """
+        Reimplemented download_all_quicklooks that goes through the quicklook store, so only the quicklooks that are
+        not stored are downloaded. They are then hardlinked, or copied, to the output directory.
+        :param products: Iterable of product uuids, or results dict.
+        :param directory_path: str. Output directory. Defaults to current directory.
+        :return: Named tuple with the downloaded dict { uuid: { path } } and the failed dict { uuid: error message },
+            as SentinelAPI.download_all_quicklooks.
+        """
+        identifiers = {}
+        for uuid in products:
+            properties = products[uuid] if isinstance(products, dict) else None
+            identifiers[uuid] = (properties or {}).get("identifier") or (properties or {}).get("title")
+
+        stored, failed = self.fetch_quicklooks(identifiers)
+
+        downloaded = {}
+        for uuid, path in stored.items():
+            out = QuicklookStore.link_or_copy(path, os.path.join(directory_path, os.path.basename(path)))
+            downloaded[uuid] = {"path": out}
+
+        return QuicklookResult(downloaded, failed)
 
     @classmethod
     def from_file(cls, config_file: str):
@@ -133,8 +602,8 @@ class Downloader(SentinelAPI):
         """
         try:
             # Since sentinelsat 1.0.0, empty queries will raise ValueError exception.
-            # That's why a small query needs to be generated.
-            self.query(None, "20200301", "20200301")
+            # That's why a small query needs to be generated. It must reach the hub, so the cache is bypassed.
+            self.query(None, "20200301", "20200301", refresh=True, store=False)
         except (sentinelsat.UnauthorizedError, AttributeError):
             return False
         else:
@@ -191,7 +660,10 @@ class Downloader(SentinelAPI):
         if quicklooks:
             self.download_all_quicklooks(uuids, out_dir)
 
-        return self.download_all(uuids, out_dir)
+        # Results saved after filtering are downloaded from the highest AoI coverage
+        priority = -df["aoicoverage"] if "aoicoverage" in df.columns else None
+
+        return self.download_all(uuids, out_dir, priority=priority)
 
     def download_from_json(self, file_path: str, out_dir=".", quicklooks: bool = False):
         """
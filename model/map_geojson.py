@@ -0,0 +1,163 @@
+"""Module for the compaction of product footprints before they are sent to the map."""
+import json
+import math
+
+import numpy as np
+
+TILE_SIZE = 256  # Pixels of a web map tile
+
+
+def zoom_tolerance(zoom: float, pixels: float = 0.5) -> float:
+    """
+    Computes the simplification tolerance below which changes are not visible at a zoom level.
+    :param zoom: float. Web map zoom level.
+    :param pixels: float, optional. Tolerance in pixels. Defaults to half a pixel.
+    :return: float. Tolerance in degrees of longitude.
+    """
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * pixels
+
+
+def fit_zoom(bounds, width: int, height: int, max_zoom: int = 18) -> int:
+    """
+    Computes the zoom level at which some bounds fit a map, as Leaflet's fitBounds does.
+    :param bounds: Sequence. (minx, miny, maxx, maxy), in degrees.
+    :param width: int. Width of the map, in pixels.
+    :param height: int. Height of the map, in pixels.
+    :param max_zoom: int, optional. Maximal zoom level. Defaults to 18.
+    :return: int. Zoom level.
+    """
+    min_x, min_y, max_x, max_y = bounds
+
+    def merc_y(lat):
+        lat = math.radians(max(min(lat, 85.0511), -85.0511))
+        return math.log(math.tan(math.pi / 4 + lat / 2)) / (2 * math.pi)  # In world widths
+
+    span_x = max(max_x - min_x, 1e-9) / 360
+    span_y = max(merc_y(max_y) - merc_y(min_y), 1e-9)
+    zoom = math.log2(min(max(width, 1) / span_x, max(height, 1) / span_y) / TILE_SIZE)
+    return int(max(0, min(max_zoom, math.floor(zoom))))
+
+
+def _decimals(tolerance: float) -> int:
+    """
+    :param tolerance: float. Tolerance in degrees.
+    :return: int. Number of decimals that keeps the rounding error below the tolerance.
+    """
+    return max(0, math.ceil(-math.log10(tolerance))) if tolerance > 0 else 15
+
+
+def _quantize_ring(ring, decimals: int) -> np.ndarray:
+    """
+    Rounds the coordinates of a ring and drops the consecutive vertices that become duplicates.
+    :param ring: np.ndarray. Coordinates of the ring.
+    :param decimals: int. Decimals to keep.
+    :return: np.ndarray. Rounded coordinates, of shape (n, 2).
+    """
+    coords = np.round(ring[:, :2], decimals)
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    return coords[keep]
+
+
+def _polygons(geometry) -> list:
+    """
+    :param geometry: Shapely Polygon or MultiPolygon.
+    :return: list. Rings of each polygon, as arrays of coordinates.
+    """
+    # Read from the rings directly, shapely.geometry.mapping is several times slower
+    if geometry.geom_type == "Polygon":
+        parts = [geometry]
+    elif geometry.geom_type == "MultiPolygon":
+        parts = geometry.geoms
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry.geom_type}")
+    return [[np.asarray(ring.coords) for ring in [part.exterior, *part.interiors]] for part in parts]
+
+
+def _properties(frame, properties) -> list:
+    """
+    :param frame: GeoDataFrame. Products.
+    :param properties: Sequence. Columns to keep.
+    :return: list. Properties of each product, as dicts of JSON serializable values.
+    """
+    properties = [x for x in properties if x in frame.columns]
+    if not properties:
+        return [{} for _ in range(len(frame.index))]
+    return json.loads(frame[properties].to_json(orient="records", date_format="iso"))
+
+
+def compact_geojson(frame, tolerance: float = 0.0, properties=("title",)) -> str:
+    """
+    Encodes footprints as a compact GeoJSON FeatureCollection. The geometries are simplified preserving their
+    topology, and their coordinates are rounded to the decimals the tolerance needs, so that nothing that could be
+    seen at the zoom level of the tolerance changes. Only the given properties are kept, and the index is the id of
+    each feature.
+    :param frame: GeoDataFrame. Products, with Polygon or MultiPolygon geometries in EPSG:4326.
+    :param tolerance: float, optional. Tolerance in degrees, e.g. from zoom_tolerance. 0 keeps the geometries as they
+        are. Defaults to 0.
+    :param properties: Sequence, optional. Columns to keep as properties. Defaults to the title.
+    :return: str. GeoJSON.
+    """
+    geometries = frame.geometry.simplify(tolerance, preserve_topology=True) if tolerance > 0 else frame.geometry
+    decimals = _decimals(tolerance)
+
+    features = []
+    for uuid, geometry, props in zip(frame.index, geometries, _properties(frame, properties)):
+        polygons = [[_quantize_ring(ring, decimals).tolist() for ring in rings] for rings in _polygons(geometry)]
+        if len(polygons) == 1:
+            geojson = {"type": "Polygon", "coordinates": polygons[0]}
+        else:
+            geojson = {"type": "MultiPolygon", "coordinates": polygons}
+        features.append({"type": "Feature", "id": str(uuid), "properties": props, "geometry": geojson})
+
+    return json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+
+
+def compact_topojson(frame, tolerance: float = 0.0, properties=("title",), name: str = "footprints") -> str:
+    """
+    Encodes footprints as a TopoJSON Topology, with the same simplification and properties as compact_geojson. The
+    coordinates are quantized to a grid of the tolerance and delta-encoded as integers, and rings that appear in several
+    footprints are stored once, as a shared arc.
+    :param frame: GeoDataFrame. Products, with Polygon or MultiPolygon geometries in EPSG:4326.
+    :param tolerance: float, optional. Tolerance in degrees, e.g. from zoom_tolerance. Defaults to 0, which quantizes
+        to 1e-7 degrees.
+    :param properties: Sequence, optional. Columns to keep as properties. Defaults to the title.
+    :param name: str, optional. Name of the GeometryCollection of the footprints. Defaults to "footprints".
+    :return: str. TopoJSON.
+    """
+    geometries = frame.geometry.simplify(tolerance, preserve_topology=True) if tolerance > 0 else frame.geometry
+    step = tolerance if tolerance > 0 else 1e-7
+    min_x, min_y = (frame.total_bounds[:2] if len(frame.index) else (0.0, 0.0))
+
+    arcs = []
+    arc_ids = {}  # Quantized ring: arc index
+    objects = []
+    for uuid, geometry, props in zip(frame.index, geometries, _properties(frame, properties)):
+        polygons = []
+        for rings in _polygons(geometry):
+            polygon = []
+            for ring in rings:
+                points = np.round((ring[:, :2] - (min_x, min_y)) / step).astype(np.int64)
+                keep = np.ones(len(points), dtype=bool)
+                keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+                points = points[keep]
+
+                key = points.tobytes()
+                if key not in arc_ids:
+                    arc_ids[key] = len(arcs)
+                    arcs.append(np.vstack([points[:1], np.diff(points, axis=0)]).tolist())
+                polygon.append([arc_ids[key]])
+            polygons.append(polygon)
+
+        if len(polygons) == 1:
+            objects.append({"type": "Polygon", "arcs": polygons[0], "id": str(uuid), "properties": props})
+        else:
+            objects.append({"type": "MultiPolygon", "arcs": polygons, "id": str(uuid), "properties": props})
+
+    topology = {
+        "type": "Topology",
+        "transform": {"scale": [step, step], "translate": [float(min_x), float(min_y)]},
+        "objects": {name: {"type": "GeometryCollection", "geometries": objects}},
+        "arcs": arcs
+    }
+    return json.dumps(topology, separators=(",", ":"))
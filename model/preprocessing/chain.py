@@ -0,0 +1,346 @@
+"""
+Module for operator chains, which apply operators of model.preprocessing.operators to a product either one by one with
+snappy, in this process, or as a single SNAP graph with gpt, in a subprocess.
+"""
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import xml.etree.ElementTree as ET
+
+import model.preprocessing.operators as op
+from model.product_cache import copy_product
+
+BACKENDS = ("snappy", "gpt")
+
+# Prefixes and suffixes of the names of the products of each chainable operator
+NAME_PREFIXES = {"create_subset": "Subset_"}
+NAME_SUFFIXES = {
+    "apply_orbit_file": "_Orb",
+    "thermal_noise_removal": "_NR",
+    "calibration": "_Cal",
+    "speckle_filtering": "_Spk",
+    "land_sea_mask": "_LSMask",
+    "adaptive_thresholding": "_THR",
+    "object_discrimination": "_SHP",
+    "terrain_correction": "_TC",
+}
+OPERATORS = (*NAME_PREFIXES, *NAME_SUFFIXES)
+
+SHIP_MASK_SUFFIX = "_ship_bit_msk"  # Suffix of the bands adaptive_thresholding adds to its source bands
+
+
+def _unique(items) -> list:
+    """
+    :param items: Iterable.
+    :return: list. The items without duplicates, in order.
+    """
+    return list(dict.fromkeys(items))
+
+
+def _polarisations(bands) -> list:
+    """
+    :param bands: Iterable. Band names ending in their polarisation, e.g. Sigma0_VH.
+    :return: list. Polarisations of the bands.
+    """
+    return _unique(x.rsplit("_", 1)[-1] for x in bands)
+
+
+def _same_bands(bands) -> tuple:
+    """Demand of the operators whose bands are named after their source bands, e.g. speckle_filtering."""
+    return {"source_bands": ",".join(bands)}, bands
+
+
+def _calibration_bands(bands) -> tuple:
+    """Demand of calibration, which outputs Sigma0_<pol> from the amplitude and intensity of each polarisation."""
+    pols = _polarisations(bands)
+    return {"polarisations": ",".join(pols)}, [f"{x}_{pol}" for pol in pols for x in ("Amplitude", "Intensity")]
+
+
+def _thermal_noise_bands(bands) -> tuple:
+    """Demand of thermal_noise_removal, which selects polarisations instead of bands."""
+    return {"polarisations": ",".join(_polarisations(bands))}, bands
+
+
+def _thresholding_bands(bands) -> tuple:
+    """Demand of adaptive_thresholding, which adds the ship mask of each of its source bands."""
+    bands = _unique(x[:-len(SHIP_MASK_SUFFIX)] if x.endswith(SHIP_MASK_SUFFIX) else x for x in bands)
+    return {"source_bands": ",".join(bands)}, bands
+
+
+# Given the bands needed from the product of an operator, the parameters that make it output only those bands, and the
+# bands it needs from its source product in turn
+BAND_DEMANDS = {
+    "apply_orbit_file": lambda bands: ({}, bands),
+    "create_subset": _same_bands,
+    "thermal_noise_removal": _thermal_noise_bands,
+    "calibration": _calibration_bands,
+    "speckle_filtering": _same_bands,
+    "land_sea_mask": _same_bands,
+    "adaptive_thresholding": _thresholding_bands,
+    "object_discrimination": lambda bands: ({}, bands),
+    "terrain_correction": _same_bands,
+}
+
+
+def _product_file(path: str, out_fmt: str) -> str:
+    """
+    :param path: str. Output path, without extension.
+    :param out_fmt: str. Output format.
+    :return: str. Path of the file SNAP writes.
+    """
+    return f"{path}.dim" if out_fmt == "BEAM-DIMAP" else path
+
+
+def _indent(element: ET.Element, level: int = 0) -> None:
+    """
+    Indents an XML tree in place with two spaces per level, as ElementTree.indent does from Python 3.9 on.
+    :param element: Element. Root of the tree.
+    :param level: int, optional. Depth of element. Defaults to 0.
+    :return: None.
+    """
+    if len(element):
+        if not (element.text or "").strip():
+            element.text = "\n" + "  " * (level + 1)
+        for child in element:
+            _indent(child, level + 1)
+            if not (child.tail or "").strip():
+                child.tail = "\n" + "  " * (level + 1)
+        element[-1].tail = "\n" + "  " * level
+
+
+class OperatorChain:
+    """
+    Linear chain of operators of model.preprocessing.operators, from a source product to a target product. It can be
+    run with the snappy backend, which creates the product of each operator with GPF in this process, or compiled to a
+    SNAP graph and run with the gpt backend, in a single gpt subprocess. Both write the same products to the same
+    paths, so the faster one can be picked for each chain.
+
+    If the bands needed from the target product are declared, the demand is propagated backwards through the chain, so
+    that each operator only processes and writes the bands the next ones need, e.g. a single polarisation.
+
+    If run with a ProductCache, the target product and those of the checkpoints are stored in it, and the chain goes on
+    from the longest prefix already stored.
+    """
+
+    def __init__(self, *operators, bands=()):
+        """
+        :param operators: (name, params) of each operator, in order, with name one of OPERATORS and params a dict of its
+            keyword arguments, or None.
+        :param bands: Iterable, optional. Bands needed from the target product, e.g. Sigma0_VH. Defaults to (), which
+            keeps every band.
+        """
+        self.operators = []
+        self.bands = []
+        self.checkpoints = set()  # Number of operators after which the product is cached
+        for name, params in operators:
+            self.add(name, **(params or {}))
+        self.demand(*bands)
+
+    def add(self, operator: str, **params):
+        """
+        Appends an operator to the chain.
+        :param operator: str. Function name in model.preprocessing.operators, one of OPERATORS.
+        :param params: Keyword arguments of the function, besides the product.
+        :return: OperatorChain. The chain itself.
+        """
+        if operator not in OPERATORS:
+            raise ValueError(f"Unknown operator: {operator}")
+        self.operators.append((operator, params))
+        return self
+
+    def checkpoint(self):
+        """
+        Marks the product of the last operator added so far to be cached, e.g. the last one before those whose
+        parameters are tuned between runs.
+        :return: OperatorChain. The chain itself.
+        """
+        if self.operators:
+            self.checkpoints.add(len(self.operators))
+        return self
+
+    def demand(self, *bands):
+        """
+        Declares bands needed from the target product, on top of those already declared.
+        :param bands: str. Band names, e.g. Sigma0_VH.
+        :return: OperatorChain. The chain itself.
+        """
+        self.bands = _unique([*self.bands, *bands])
+        return self
+
+    def pruned_operators(self) -> list:
+        """
+        Propagates the demanded bands backwards through the chain. The parameters given to add take precedence over
+        the band selections of the demand, but for empty ones, which mean every band.
+        :return: list. (name, params) of each operator, with the band selections of the demand added to its params.
+        """
+        if not self.bands:
+            return list(self.operators)
+
+        operators = []
+        bands = self.bands
+        for operator, params in reversed(self.operators):
+            selection, bands = BAND_DEMANDS[operator](bands)
+            operators.append((operator, {**selection, **{k: v for k, v in params.items() if v != ""}}))
+        return operators[::-1]
+
+    def __len__(self):
+        return len(self.operators)
+
+    def product_names(self, source: str) -> list:
+        """
+        Names the product after each operator, e.g. Subset_<source>_Orb_Cal. Prefixes are not repeated, e.g. a subset
+        of a subset is named Subset_<source> too.
+        :param source: str. Path to the source product.
+        :return: list. Names of the products of each operator.
+        """
+        name = os.path.splitext(os.path.basename(source.rstrip("/\\")))[0]
+        names = []
+        for operator, _ in self.operators:
+            prefix = NAME_PREFIXES.get(operator, "")
+            name = ("" if name.startswith(prefix) else prefix) + name + NAME_SUFFIXES.get(operator, "")
+            names.append(name)
+        return names
+
+    def product_name(self, source: str) -> str:
+        """
+        :param source: str. Path to the source product.
+        :return: str. Name of the target product.
+        """
+        names = self.product_names(source)
+        return names[-1] if names else os.path.splitext(os.path.basename(source.rstrip("/\\")))[0]
+
+    def graph(self, source: str, target: str, out_fmt: str = "BEAM-DIMAP", steps_dir: str = "") -> str:
+        """
+        Compiles the chain to a SNAP graph, as saved by SNAP's Graph Builder.
+        :param source: str. Path to the source product.
+        :param target: str. Output path of the target product, without extension.
+        :param out_fmt: str, optional. Output format. Defaults to BEAM-DIMAP.
+        :param steps_dir: str, optional. If given, the intermediary products are written to this directory too.
+            Defaults to "".
+        :return: str. Graph XML.
+        """
+        node = op.GraphNode("Read", {"file": source})
+        nodes = [node]
+        names = self.product_names(source)
+        for i, (operator, params) in enumerate(self.pruned_operators()):
+            node = getattr(op, operator)(node, **params)
+            nodes.append(node)
+            if steps_dir and i < len(self.operators) - 1:
+                path = _product_file(os.path.join(steps_dir, names[i]), out_fmt)
+                nodes.append(op.GraphNode("Write", {"file": path, "formatName": out_fmt}, node))
+        nodes.append(op.GraphNode("Write", {"file": _product_file(target, out_fmt), "formatName": out_fmt}, node))
+
+        # Nodes are identified by their operator, numbered from the second one on as SNAP does
+        ids = {}
+        counts = {}
+        for x in nodes:
+            counts[x.operator] = counts.get(x.operator, 0) + 1
+            ids[x] = x.operator if counts[x.operator] == 1 else f"{x.operator}({counts[x.operator]})"
+
+        graph = ET.Element("graph", id="Graph")
+        ET.SubElement(graph, "version").text = "1.0"
+        for x in nodes:
+            element = ET.SubElement(graph, "node", id=ids[x])
+            ET.SubElement(element, "operator").text = x.operator
+            sources = ET.SubElement(element, "sources")
+            if x.source is not None:
+                ET.SubElement(sources, "sourceProduct", refid=ids[x.source])
+            parameters = ET.SubElement(element, "parameters", {"class": "com.bc.ceres.binding.dom.XppDomElement"})
+            for key, value in x.parameters.items():
+                ET.SubElement(parameters, key).text = str(value).lower() if isinstance(value, bool) else str(value)
+        _indent(graph)
+
+        return ET.tostring(graph, encoding="unicode")
+
+    def run(self, source: str, target: str, backend: str = "snappy", out_fmt: str = "BEAM-DIMAP", steps_dir: str = "",
+            gpt: str = "gpt", gpt_threads: int = 0, gpt_cache: str = "", progress=None, cache=None) -> str:
+        """
+        Runs the chain on a product and writes the target product.
+        :param source: str. Path to the source product.
+        :param target: str. Output path of the target product, without extension.
+        :param backend: str, optional. snappy or gpt. Defaults to snappy.
+        :param out_fmt: str, optional. Output format. Defaults to BEAM-DIMAP.
+        :param steps_dir: str, optional. If given, the intermediary products are written to this directory too, and
+            the snappy backend goes on from the written products. Defaults to "".
+        :param gpt: str, optional. gpt executable, for the gpt backend. Defaults to gpt.
+        :param gpt_threads: int, optional. Parallelism of gpt, its -q option. Defaults to 0, gpt's default.
+        :param gpt_cache: str, optional. Tile cache size of gpt, its -c option, e.g. 4G. Defaults to gpt's default.
+        :param progress: Callable, optional. Called with the name of each step before it is run. Defaults to None.
+        :param cache: ProductCache, optional. If given, and the output format is BEAM-DIMAP, the products of the
+            checkpoints and the target product are read from the cache if stored, and stored otherwise. The target
+            product then shares the files of the stored one through hardlinks, if possible. Defaults to None.
+        :return: str. Path of the written target product.
+        """
+        report = progress or (lambda step: None)
+
+        if cache is not None and out_fmt == "BEAM-DIMAP":
+            options = {"backend": backend, "out_fmt": out_fmt, "steps_dir": steps_dir, "gpt": gpt,
+                       "gpt_threads": gpt_threads, "gpt_cache": gpt_cache, "progress": progress}
+            operators = self.pruned_operators()
+            names = self.product_names(source)
+            ends = sorted({x for x in self.checkpoints if x < len(operators)} | {len(operators)})
+            keys = {x: cache.key(source, operators[:x]) for x in ends}
+
+            # Products are read and written in a directory of this run, so that evicting them does not affect it
+            workspace = cache.workspace()
+            try:
+                # Longest stored prefix
+                start, path = 0, source
+                for end in reversed(ends):
+                    stored = cache.checkout(keys[end], workspace)
+                    if stored is not None:
+                        start, path = end, stored
+                        report("Cached")
+                        break
+
+                for end in [x for x in ends if x > start]:
+                    segment = OperatorChain(*operators[start:end])  # Already pruned
+                    name = names[end - 1] if end else self.product_name(source)
+                    path = segment.run(path, os.path.join(workspace, name), **options)
+                    cache.put(keys[end], path)
+                    start = end
+
+                path = copy_product(path, _product_file(target, out_fmt))
+            finally:
+                shutil.rmtree(workspace, ignore_errors=True)
+
+            cache.evict()
+            return os.path.abspath(path)
+
+        if backend == "snappy":
+            report("Read")
+            prod = op.read_product(source)
+            names = self.product_names(source)
+            for i, (operator, params) in enumerate(self.pruned_operators()):
+                report(operator.replace("_", " ").capitalize())
+                prod = getattr(op, operator)(prod, **params)
+                if steps_dir and i < len(self.operators) - 1:
+                    prod = op.write_product(prod, os.path.join(steps_dir, names[i]), out_fmt)
+
+            report("Write")
+            prod = op.write_product(prod, target, out_fmt)
+            return prod.getFileLocation().getAbsolutePath()
+
+        if backend == "gpt":
+            report("GPT graph")
+            fd, graph_path = tempfile.mkstemp(suffix=".xml")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(self.graph(source, target, out_fmt, steps_dir))
+
+                cmd = [gpt, graph_path]
+                if gpt_threads:
+                    cmd += ["-q", str(gpt_threads)]
+                if gpt_cache:
+                    cmd += ["-c", gpt_cache]
+                res = sp.run(cmd, stdout=sp.PIPE, stderr=sp.STDOUT)
+            finally:
+                os.remove(graph_path)
+
+            if res.returncode:
+                output = res.stdout.decode(errors="replace").strip()
+                raise RuntimeError(f"gpt exited with code {res.returncode}: {output[-2000:]}")
+            return os.path.abspath(_product_file(target, out_fmt))
+
+        raise ValueError(f"Unknown backend: {backend}")
@@ -1,13 +1,53 @@
 """
 This module maps the used SNAP operators with Python functions.
 """
+from __future__ import annotations
+
 from typing import Collection
 
-import snappy  # SNAP python interface
+from utils import LazyModule
+
+snappy = LazyModule("snappy")  # SNAP python interface. Imported upon first use, since it starts the JVM
 
 VERBOSE = False
 
 
+class GraphNode:
+    """
+    Node of a SNAP graph. When an operator function of this module is passed a node instead of a product, it returns
+    the node of the operator instead of creating its product, so that the same functions describe graphs. See
+    model.preprocessing.chain.
+    """
+
+    def __init__(self, operator: str, parameters: dict, source=None):
+        """
+        :param operator: str. SNAP operator name.
+        :param parameters: dict. Operator parameters.
+        :param source: GraphNode, optional. Source node. Defaults to None.
+        """
+        self.operator = operator
+        self.parameters = parameters
+        self.source = source
+
+
+def create_product(operator: str, parameters: dict, source):
+    """
+    Creates the product of a GPF operator.
+    :param operator: str. SNAP operator name.
+    :param parameters: dict. Operator parameters.
+    :param source: Opened product, list of products, or GraphNode.
+    :return: The target product, or its GraphNode if the source is a GraphNode.
+    """
+    if isinstance(source, GraphNode):
+        return GraphNode(operator, parameters, source)
+
+    hash_map = snappy.HashMap()
+    for key, value in parameters.items():
+        hash_map.put(key, value)
+
+    return snappy.GPF.createProduct(operator, hash_map, source)
+
+
 def read_product(prod_path: str) -> snappy.Product:
     """Reads a product from a given path.
 
@@ -27,96 +67,107 @@ def apply_orbit_file(prod, orbit_type: str = "Sentinel Precise (Auto Download)",
     :param poly_degree: int, optional.
     :return: Modified product.
     """
-    parameters = snappy.HashMap()
+    parameters = {}
 
-    parameters.put('orbitType', orbit_type)
-    parameters.put('polyDegree', poly_degree)
-    parameters.put('continueOnFail', on_fail)
+    parameters['orbitType'] = orbit_type
+    parameters['polyDegree'] = poly_degree
+    parameters['continueOnFail'] = on_fail
 
     if VERBOSE:
         print("Applying orbit file...")
-    return snappy.GPF.createProduct('Apply-Orbit-File', parameters, prod)
+    return create_product('Apply-Orbit-File', parameters, prod)
 
 
-def calibration(prod):
+def calibration(prod, source_bands: str = "", polarisations: str = ""):
     """
     Calibrates the passed product.
     :param prod: Opened product.
+    :param source_bands: str, optional. Source bands to use, e.g. Amplitude_VH,Intensity_VH. If empty string is passed,
+        all bands will be used. Defaults to "".
+    :param polarisations: str, optional. Polarisations to calibrate, e.g. VH,VV. If empty string is passed, all
+        polarisations will be used. Defaults to "".
     :return: Modified product.
     """
-    parameters = snappy.HashMap()
+    parameters = {}
 
-    # Leave commented so all source bands are used
-    # parameters.put('sourceBands', 'Amplitude_VH,Amplitude_VV,Intensity_VH,Intensity_VV')
+    if source_bands:
+        parameters['sourceBands'] = source_bands
 
-    parameters.put('auxFile', "Product Auxiliary File")
-    parameters.put('outputImageInComplex', False)
-    parameters.put('outputImageScaleInDb', False)
-    parameters.put('createGammaBand', False)
-    parameters.put('createBetaBand', False)
-    parameters.put('createBetaBand', False)
+    parameters['auxFile'] = "Product Auxiliary File"
+    parameters['outputImageInComplex'] = False
+    parameters['outputImageScaleInDb'] = False
+    parameters['createGammaBand'] = False
+    parameters['createBetaBand'] = False
+    parameters['createBetaBand'] = False
 
-    # Leave commented so all polarisations are used
-    # parameters.put('selectedPolarisations', 'VH,VV')
+    if polarisations:
+        parameters['selectedPolarisations'] = polarisations
 
-    parameters.put('outputSigmaBand', True)
-    parameters.put('outputGammaBand', False)
-    parameters.put('outputBetaBand', False)
+    parameters['outputSigmaBand'] = True
+    parameters['outputGammaBand'] = False
+    parameters['outputBetaBand'] = False
 
     if VERBOSE:
         print("Calibrating...")
-    return snappy.GPF.createProduct("Calibration", parameters, prod)
+    return create_product("Calibration", parameters, prod)
 
 
-def speckle_filtering(prod):
+def speckle_filtering(prod, source_bands: str = ""):
     """
     Applies speckle filtering on the passed product.
     :param prod: Opened product.
+    :param source_bands: str, optional. Source bands to use. If empty string is passed, all bands will be used.
+        Defaults to "".
     :return: Modified product.
     """
-    parameters = snappy.HashMap()
-    # parameters.put('sourceBands', '')
-    parameters.put('filter', 'Lee')
-    parameters.put('filterSizeX', 3)
-    parameters.put('filterSizeY', 3)
-    parameters.put('dampingFactor', 2)
-    parameters.put('estimateENL', True)
-    parameters.put('enl', 1.0)
-    parameters.put('numLooksStr', "1")
-    parameters.put('windowSize', '7x7')
-    parameters.put('targetWindowSizeStr', '3x3')
-    parameters.put('sigmaStr', "0.9")
-    parameters.put('anSize', 50)
+    parameters = {}
+    if source_bands:
+        parameters['sourceBands'] = source_bands
+    parameters['filter'] = 'Lee'
+    parameters['filterSizeX'] = 3
+    parameters['filterSizeY'] = 3
+    parameters['dampingFactor'] = 2
+    parameters['estimateENL'] = True
+    parameters['enl'] = 1.0
+    parameters['numLooksStr'] = "1"
+    parameters['windowSize'] = '7x7'
+    parameters['targetWindowSizeStr'] = '3x3'
+    parameters['sigmaStr'] = "0.9"
+    parameters['anSize'] = 50
 
     if VERBOSE:
         print("Speckle filtering...")
 
-    return snappy.GPF.createProduct('Speckle-Filter', parameters, prod)
+    return create_product('Speckle-Filter', parameters, prod)
 
 
-def create_subset(prod: snappy.Product, subset_polygon: str):
+def create_subset(prod: snappy.Product, subset_polygon: str, source_bands: str = ""):
     """Creates a subset of a product.
 
     If the specified polygon is not contained in the product, ValueError is raised.
 
     :param prod: Product to be cropped.
     :param subset_polygon: String. Polygon in WKT.
+    :param source_bands: String, optional. Bands to keep. If empty string is passed, all bands are kept. Defaults to "".
     :return: Subset product.
     """
-    parameters = snappy.HashMap()
+    parameters = {}
 
-    # parameters.put('referenceBand', "")
-    parameters.put('geoRegion', subset_polygon)
-    parameters.put('subSamplingX', 1)
-    parameters.put('subSamplingY', 1)
-    parameters.put('fullSwath', False)
-    # parameters.put('tiePointGrids', "")
-    parameters.put('copyMetadata', True)
+    if source_bands:
+        parameters['sourceBands'] = source_bands
+
+    # parameters['referenceBand'] = ""
+    parameters['geoRegion'] = subset_polygon
+    parameters['subSamplingX'] = 1
+    parameters['subSamplingY'] = 1
+    parameters['fullSwath'] = False
+    # parameters['tiePointGrids'] = ""
+    parameters['copyMetadata'] = True
 
     if VERBOSE:
         print("Creating subset...")
     # If the polygon was outside of the product's scope, None is returned.
-    subset = snappy.GPF.createProduct('Subset', parameters, prod)
+    subset = create_product('Subset', parameters, prod)
 
     if not subset:  # If subset is None, then polygon was invalid.
         raise ValueError("Given coordinates are out of input's scope.")
@@ -146,7 +197,7 @@ def write_product(prod, out_path, out_fmt: str = "BEAM-DIMAP", use_gpf: bool = T
 
 
 def terrain_correction(prod, source_bands: str = "", dem_name: str = "SRTM 3Sec", external_dem_file: str = "",
-                       external_aux_file: str = "", mask_out_sea: bool = False):
+                       external_aux_file: str = "", mask_out_sea: bool = False, standard_grid: bool = False):
     """
     Applies terrain correction to the passed product.
     :param prod: Opened product.
@@ -155,70 +206,76 @@ def terrain_correction(prod, source_bands: str = "", dem_name: str = "SRTM 3Sec"
     :param external_dem_file: str, optional. Defaults to "".
     :param external_aux_file: str, optional. Defaults to "".
     :param mask_out_sea: bool, optional. If set, sea will be masked out. Defaults to False.
+    :param standard_grid: bool, optional. If set, pixels are aligned to a grid with origin at 0, 0 instead of at the
+        corner of the product, so that products covering different extents share their pixels. Defaults to False.
     :return: Modified product.
     """
     # Terrain-Correction Operator - snappy
-    parameters = snappy.HashMap()
+    parameters = {}
 
     if source_bands:
-        parameters.put('sourceBands', source_bands)
+        parameters['sourceBands'] = source_bands
 
-    parameters.put('demName', dem_name)
+    parameters['demName'] = dem_name
 
     if external_dem_file:
-        parameters.put('externalDEMFile', '')
-
-    parameters.put("externalDEMNoDataValue", 0.0)
-    parameters.put("externalDEMApplyEGM", True)
-    parameters.put("demResamplingMethod", "BILINEAR_INTERPOLATION")
-    parameters.put("imgResamplingMethod", "BILINEAR_INTERPOLATION")
-    parameters.put("pixelSpacingInMeter", 10.0)
-    parameters.put("pixelSpacingInDegree", 8.983152841195215E-5)
-    parameters.put("mapProjection", "WGS84(DD)")
-    parameters.put("alignToStandardGrid", False)
-    parameters.put("standardGridOriginX", 0.0)
-    parameters.put("standardGridOriginY", 0.0)
-
-    parameters.put("nodataValueAtSea", mask_out_sea)  # do not mask out areas without elevation
-
-    parameters.put("saveDEM", False)
-    parameters.put("saveLatLon", False)
-    parameters.put("saveIncidenceAngleFromEllipsoid", False)
-    parameters.put("saveLocalIncidenceAngle", False)
-    parameters.put("saveProjectedLocalIncidenceAngle", False)
-    parameters.put("saveSelectedSourceBand", True)
-    parameters.put("saveLayoverShadowMask", False)
-    parameters.put("outputComplex", False)
-    parameters.put("applyRadiometricNormalization", False)
-    parameters.put("saveSigmaNought", False)
-    parameters.put("saveGammaNought", False)
-    parameters.put("saveBetaNought", False)
-    parameters.put("incidenceAngleForSigma0", "Use projected local incidence angle from DEM")
-    parameters.put("incidenceAngleForGamma0", "Use projected local incidence angle from DEM")
-    parameters.put("auxFile", "Latest Auxiliary File")
+        parameters['externalDEMFile'] = ''
+
+    parameters["externalDEMNoDataValue"] = 0.0
+    parameters["externalDEMApplyEGM"] = True
+    parameters["demResamplingMethod"] = "BILINEAR_INTERPOLATION"
+    parameters["imgResamplingMethod"] = "BILINEAR_INTERPOLATION"
+    parameters["pixelSpacingInMeter"] = 10.0
+    parameters["pixelSpacingInDegree"] = 8.983152841195215E-5
+    parameters["mapProjection"] = "WGS84(DD)"
+    parameters["alignToStandardGrid"] = standard_grid
+    parameters["standardGridOriginX"] = 0.0
+    parameters["standardGridOriginY"] = 0.0
+
+    parameters["nodataValueAtSea"] = mask_out_sea  # do not mask out areas without elevation
+
+    parameters["saveDEM"] = False
+    parameters["saveLatLon"] = False
+    parameters["saveIncidenceAngleFromEllipsoid"] = False
+    parameters["saveLocalIncidenceAngle"] = False
+    parameters["saveProjectedLocalIncidenceAngle"] = False
+    parameters["saveSelectedSourceBand"] = True
+    parameters["saveLayoverShadowMask"] = False
+    parameters["outputComplex"] = False
+    parameters["applyRadiometricNormalization"] = False
+    parameters["saveSigmaNought"] = False
+    parameters["saveGammaNought"] = False
+    parameters["saveBetaNought"] = False
+    parameters["incidenceAngleForSigma0"] = "Use projected local incidence angle from DEM"
+    parameters["incidenceAngleForGamma0"] = "Use projected local incidence angle from DEM"
+    parameters["auxFile"] = "Latest Auxiliary File"
 
     if external_aux_file:
-        parameters.put("externalAuxFile", external_aux_file)
+        parameters["externalAuxFile"] = external_aux_file
 
     if VERBOSE:
         print("Correcting terrain...")
 
-    return snappy.GPF.createProduct('Terrain-Correction', parameters, prod)
+    return create_product('Terrain-Correction', parameters, prod)
 
 
-def thermal_noise_removal(prod):
+def thermal_noise_removal(prod, polarisations: str = ""):
     """
     Removes thermal noise from the passed product.
     :param prod: Opened product.
+    :param polarisations: str, optional. Polarisations to use, e.g. VH,VV. If empty string is passed, all polarisations
+        will be used. Defaults to "".
     :return: Modified product.
     """
-    parameters = snappy.HashMap()
-    parameters.put('removeThermalNoise', True)
+    parameters = {}
+    if polarisations:
+        parameters['selectedPolarisations'] = polarisations
+    parameters['removeThermalNoise'] = True
 
     if VERBOSE:
         print("Removing thermal noise...")
 
-    return snappy.GPF.createProduct('ThermalNoiseRemoval', parameters, prod)
+    return create_product('ThermalNoiseRemoval', parameters, prod)
 
 
 def create_stack(*products: Collection[snappy.Product]) -> snappy.Product:
@@ -227,8 +284,8 @@ def create_stack(*products: Collection[snappy.Product]) -> snappy.Product:
     :param products: Products to stack.
     :return: The resulting stack product.
     """
-    params = snappy.HashMap()
-    params.put("initialOffsetMethod", "Product Geolocation")
+    params = {}
+    params["initialOffsetMethod"] = "Product Geolocation"
 
     if VERBOSE:
         print("Creating stack...")
@@ -236,11 +293,12 @@ def create_stack(*products: Collection[snappy.Product]) -> snappy.Product:
     # Product list needs to be reversed so that first product is taken as master and the second as slave
     product_set = list(products)[::-1]
 
-    return snappy.GPF.createProduct("CreateStack", params, product_set)
+    return create_product("CreateStack", params, product_set)
 
 
 def adaptive_thresholding(product: snappy.Product, bg_window: float = 800.0, estimate_bg: bool = False,
-                          guard_window: float = 500.0, pfa: float = 12.5, target_window: int = 30) -> snappy.Product:
+                          guard_window: float = 500.0, pfa: float = 12.5, target_window: int = 30,
+                          source_bands: str = "") -> snappy.Product:
     """
     Applies adaptive thresholding on the passed product.
     :param product: Opened product.
@@ -249,20 +307,25 @@ def adaptive_thresholding(product: snappy.Product, bg_window: float = 800.0, est
     :param guard_window: float, optional. Guard window. Defaults to 500.0.
     :param pfa: float, optional. Defaults to 12.5.
     :param target_window: int, optional. Target window. Defaults to 30.
+    :param source_bands: str, optional. Bands to threshold. If empty string is passed, all bands will be used.
+        Defaults to "".
     :return: Modified product.
     """
-    params = snappy.HashMap()
+    params = {}
+
+    if source_bands:
+        params["sourceBands"] = source_bands
 
-    params.put("targetWindowSizeInMeter", target_window)
-    params.put("guardWindowSizeInMeter", guard_window)
-    params.put("backgroundWindowSizeInMeter", bg_window)
-    params.put("pfa", pfa)
-    params.put("estimateBackground", estimate_bg)
+    params["targetWindowSizeInMeter"] = target_window
+    params["guardWindowSizeInMeter"] = guard_window
+    params["backgroundWindowSizeInMeter"] = bg_window
+    params["pfa"] = pfa
+    params["estimateBackground"] = estimate_bg
 
     if VERBOSE:
         print("Applying adaptive thresholding subset...")
 
-    return snappy.GPF.createProduct("AdaptiveThresholding", params, product)
+    return create_product("AdaptiveThresholding", params, product)
 
 
 def object_discrimination(product: snappy.Product, max_tgt: float = 600.0, min_tgt: float = 30.0) -> snappy.Product:
@@ -273,16 +336,16 @@ def object_discrimination(product: snappy.Product, max_tgt: float = 600.0, min_t
     :param min_tgt: float, optional. Min target size. Defaults to 30.
     :return: Modified product.
     """
-    params = snappy.HashMap()
+    params = {}
 
-    params.put("minTargetSizeInMeter", min_tgt)
+    params["minTargetSizeInMeter"] = min_tgt
 
-    params.put("maxTargetSizeInMeter", max_tgt)
+    params["maxTargetSizeInMeter"] = max_tgt
 
     if VERBOSE:
         print("Discriminating objects...")
 
-    return snappy.GPF.createProduct("Object-Discrimination", params, product)
+    return create_product("Object-Discrimination", params, product)
 
 
 def land_sea_mask(product: snappy.Product, source_bands: str = "", land_mask: bool = True,
@@ -297,23 +360,23 @@ def land_sea_mask(product: snappy.Product, source_bands: str = "", land_mask: bo
     :param geometry: str, optional. Custom land mask name to use. Defaults to "".
     :return: Modified product.
     """
-    params = snappy.HashMap()
+    params = {}
 
     if source_bands:
-        params.put("sourceBands", source_bands)
+        params["sourceBands"] = source_bands
 
-    params.put("landMask", land_mask)
+    params["landMask"] = land_mask
 
-    params.put("useSRTM", use_srtm)
+    params["useSRTM"] = use_srtm
 
     if geometry:
-        params.put("geometry", "")
+        params["geometry"] = ""
 
-    params.put("invertGeometry", False)
+    params["invertGeometry"] = False
 
-    params.put("shorelineExtension", shore_line_extension)
+    params["shorelineExtension"] = shore_line_extension
 
     if VERBOSE:
         print("Applying land-sea mask...")
 
-    return snappy.GPF.createProduct("Land-Sea-Mask", params, product)
+    return create_product("Land-Sea-Mask", params, product)
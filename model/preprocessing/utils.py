@@ -1,10 +1,14 @@
 """Module for utility functions for pixel processing."""
+from __future__ import annotations
 
 import numpy as np
-from snappy import Product
 
+from utils import LazyModule
 
-def get_band_pixels(band_name: str, prod: Product) -> np.array:
+snappy = LazyModule("snappy")
+
+
+def get_band_pixels(band_name: str, prod: snappy.Product) -> np.array:
     """
     Returns a numpy array containing the band pixels.
     :param band_name: str. Band name from which to extract the pixels.
@@ -25,7 +29,7 @@ def get_band_pixels(band_name: str, prod: Product) -> np.array:
     return band_data
 
 
-def get_bands_pixel_stats(product: Product):
+def get_bands_pixel_stats(product: snappy.Product):
     """
     Gets the stats for every band in the given product. A stat contains the minimal and maximal pixel value that exist
     in a source band.
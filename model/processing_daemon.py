@@ -0,0 +1,419 @@
+"""Module for the processing daemon, which keeps warm snappy JVMs to run processing jobs on."""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+import utils
+
+DEFAULT_ADDRESS = ("localhost", 6070)
+
+
+class DaemonJobError(Exception):
+    """Raised by DaemonClient when a job fails in the daemon. Its message holds the traceback of the worker."""
+
+
+def _authkey() -> bytes:
+    """
+    Returns the key with which the daemon and its clients authenticate each other. It is created upon first use in the
+    user's cache directory, whatever the working directory of the daemon and the client, readable by the current user
+    only, so that no other user can submit jobs.
+    :return: bytes. Key.
+    """
+    path = os.path.join(utils.cache_dir("daemon"), "authkey")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def warm_up() -> None:
+    """
+    Starts the JVM and loads SNAP's operators and product readers, the start-up cost every new process pays before
+    its first product is read.
+    :return: None.
+    """
+    import snappy
+
+    snappy.GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+    snappy.ProductIOPlugInManager.getInstance().getAllReaderPlugIns()
+
+
+def vessel_chain(prod_path: str, out_dir: str = "vessel_detections", progress=None, **params) -> dict:
+    """
+    Runs the vessel detection chain of a VesselDetector on a product and saves its detections.
+    :param prod_path: str. Path to the product.
+    :param out_dir: str, optional. Output directory of the detector. Defaults to vessel_detections.
+    :param progress: Callable, optional. Called with the name of each step. Defaults to None.
+    :param params: Keyword arguments of VesselDetector, e.g. subset, pfa or steps.
+    :return: dict. Output paths, the processed product and its detections if any, and the summary row of the
+        product, or None.
+    """
+    from model.detectors.vessel_detector import VesselDetector
+
+    detector = VesselDetector(out_dir=out_dir, verbose=False, **params)
+    prod, out_name, _, info = detector._process(prod_path, progress=progress)
+
+    outputs = [prod.getFileLocation().getAbsolutePath()]
+    if info is not None:
+        outputs.append(os.path.abspath(os.path.join(detector.detect_dir, f"{os.path.basename(out_name)}.csv")))
+
+    return {"outputs": outputs, "summary": info}
+
+
+def change_preprocessing(prod_path: str, out_dir: str = "processed", subset: str = "", steps: bool = False,
+                         progress=None, **options) -> dict:
+    """
+    Runs the preprocessing chain of the change detection on a product.
+    :param prod_path: str. Path to the product.
+    :param out_dir: str, optional. Output directory. Defaults to processed.
+    :param subset: str, optional. Subset WKT string. Defaults to no subset.
+    :param steps: bool, optional. If set, intermediary products are saved too. Defaults to False.
+    :param progress: Callable, optional. Called with the name of each step. Defaults to None.
+    :param options: Backend options of ChangeDetector.preprocess, e.g. backend.
+    :return: dict. Output path of the preprocessed product.
+    """
+    from model.detectors.change_detector import ChangeDetector
+
+    os.makedirs(out_dir, exist_ok=True)
+    prod = ChangeDetector.preprocess(prod_path, subset, out_dir, steps=steps, progress=progress, **options)
+    return {"outputs": [prod.getFileLocation().getAbsolutePath()]}
+
+
+def operator_chain(prod_path: str, operators, out_path: str, out_fmt: str = "BEAM-DIMAP", bands=(), progress=None,
+                   **options) -> dict:
+    """
+    Applies a list of operators to a product and writes the result, e.g. object_discrimination with new thresholds
+    on a product saved after adaptive_thresholding.
+    :param prod_path: str. Path to the product.
+    :param operators: Iterable. (name, params) of each operator, in order, as taken by OperatorChain.
+    :param out_path: str. Output path, without extension.
+    :param out_fmt: str, optional. Output format. Defaults to BEAM-DIMAP.
+    :param bands: Iterable, optional. Bands needed from the output product, see OperatorChain. Defaults to all.
+    :param progress: Callable, optional. Called with the name of each step. Defaults to None.
+    :param options: Other keyword arguments of OperatorChain.run, e.g. backend.
+    :return: dict. Output path of the product.
+    """
+    from model.preprocessing.chain import OperatorChain
+
+    chain = OperatorChain(*operators, bands=bands)
+    path = chain.run(prod_path, out_path, out_fmt=out_fmt, progress=progress, **options)
+    return {"outputs": [path]}
+
+
+JOBS = {
+    "vessel_chain": vessel_chain,
+    "change_preprocessing": change_preprocessing,
+    "operator_chain": operator_chain,
+}
+
+
+def _run_job(kind: str, kwargs: dict) -> tuple:
+    """
+    Runs a job and times its steps.
+    :param kind: str. Job, one of JOBS.
+    :param kwargs: dict. Keyword arguments of the job.
+    :return: tuple. ("done", result) or ("failed", message with the traceback). The result has the timings of the
+        steps as (step, seconds), and the elapsed seconds.
+    """
+    timings = []
+    current = ["", None]  # Step and its start
+
+    def progress(step):
+        now = time.perf_counter()
+        if current[0]:
+            timings.append((current[0], now - current[1]))
+        current[:] = step, now
+
+    start = time.perf_counter()
+    try:
+        result = JOBS[kind](progress=progress, **kwargs)
+    except BaseException as e:
+        return "failed", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+    progress("")
+    result["timings"] = timings
+    result["elapsed"] = time.perf_counter() - start
+    return "done", result
+
+
+def _serve_jobs(conn) -> None:
+    """
+    Entry point of the worker processes. Warms snappy up, reports it with ("ready", seconds) and then runs the jobs
+    received through the pipe as (kind, kwargs), answering each with the outcome of _run_job, until None is received.
+    :param conn: Connection. Worker end of the pipe.
+    :return: None.
+    """
+    start = time.perf_counter()
+    try:
+        warm_up()
+    except BaseException as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+        return
+    conn.send(("ready", time.perf_counter() - start))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        conn.send(_run_job(*request))
+    conn.close()
+
+
+class _Worker:
+    """Worker process of the daemon, with a warm JVM of its own."""
+
+    def __init__(self, ctx):
+        """
+        :param ctx: Multiprocessing context in which the process is started.
+        """
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve_jobs, args=(child,), name="SentiVessi processing worker",
+                                   daemon=True)
+        self.process.start()
+        child.close()
+
+        self.warmup = None  # Seconds it took to warm up, once it is ready
+        self.jobs = 0
+
+    def run(self, kind: str, kwargs: dict) -> tuple:
+        """
+        Runs a job, after waiting for the worker to warm up if it is not ready yet.
+        :param kind: str. Job, one of JOBS.
+        :param kwargs: dict. Keyword arguments of the job.
+        :return: tuple. ("done", result) or ("failed", message).
+        :raises EOFError: If the process exited.
+        """
+        if self.warmup is None:
+            status, payload = self.conn.recv()
+            if status != "ready":
+                return status, payload
+            self.warmup = payload
+
+        self.conn.send((kind, kwargs))
+        self.jobs += 1
+        return self.conn.recv()
+
+    def close(self) -> None:
+        """
+        Stops the process, waiting for the running job, if any, for a few seconds.
+        :return: None.
+        """
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class ProcessingDaemon:
+    """
+    Long-lived local daemon that keeps worker processes with warm snappy JVMs, so that jobs sent to it by a
+    DaemonClient are not slowed down by the start-up of the JVM and SNAP's operator registry. Each worker runs one job
+    at a time; further jobs wait for a free worker. Workers that crash are replaced, and workers can be recycled after
+    some jobs to release the memory the JVM does not give back. Jobs run with the daemon's working directory, so
+    clients should send absolute paths.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, workers: int = 1, max_jobs: int = 0):
+        """
+        :param address: optional. (host, port) or path of the socket to listen on. Defaults to DEFAULT_ADDRESS.
+        :param workers: int, optional. Worker processes. Bear in mind that each one starts a JVM of its own, with the
+            memory SNAP is configured to use. Defaults to 1.
+        :param max_jobs: int, optional. Jobs after which a worker is replaced by a new one. Defaults to 0, which means
+            never.
+        """
+        self.address = address
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.jobs = 0
+
+        self._ctx = multiprocessing.get_context("spawn")  # Forking a process with a running JVM is not safe
+        self._idle = queue.Queue()
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """
+        Starts the workers, which warm up at the same time, and answers clients until shutdown is called or a client
+        asks for it.
+        :return: None.
+        """
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self._ctx))
+
+        with Listener(self.address, authkey=_authkey()) as listener:
+            self.address = listener.address
+            while not self._stopped.is_set():
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+                if self._stopped.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+        for _ in range(self.workers):  # Waits for the running jobs
+            self._idle.get().close()
+
+    def shutdown(self) -> None:
+        """
+        Stops serving once the running jobs are finished.
+        :return: None.
+        """
+        self._stopped.set()
+        try:
+            Client(self.address, authkey=_authkey()).close()  # Wakes the listener up
+        except OSError:
+            pass
+
+    def status(self) -> dict:
+        """
+        :return: dict. Number of workers, of idle workers and of jobs run.
+        """
+        return {"workers": self.workers, "idle": self._idle.qsize(), "jobs": self.jobs}
+
+    def run(self, kind: str, kwargs: dict) -> tuple:
+        """
+        Runs a job on the next free worker.
+        :param kind: str. Job, one of JOBS.
+        :param kwargs: dict. Keyword arguments of the job.
+        :return: tuple. ("done", result) or ("failed", message).
+        """
+        if kind not in JOBS:
+            return "failed", f"Unknown job: {kind}"
+
+        worker = self._idle.get()
+        try:
+            reply = worker.run(kind, kwargs)
+        except (EOFError, OSError):  # The process exited, e.g. killed by the system
+            worker.process.join()
+            reply = "failed", f"Worker process exited with code {worker.process.exitcode}."
+            worker.close()
+            worker = _Worker(self._ctx)
+        else:
+            self.jobs += 1
+            if self.max_jobs and worker.jobs >= self.max_jobs:
+                worker.close()
+                worker = _Worker(self._ctx)
+        finally:
+            self._idle.put(worker)
+
+        return reply
+
+    def _handle(self, conn) -> None:
+        """
+        Answers the requests of a client, (kind, kwargs) tuples, until it disconnects. Besides JOBS, kind can be ping,
+        which is answered with the status, and shutdown.
+        :param conn: Connection. Client connection.
+        :return: None.
+        """
+        with conn:
+            while True:
+                try:
+                    kind, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                if kind == "ping":
+                    conn.send(("done", self.status()))
+                elif kind == "shutdown":
+                    conn.send(("done", None))
+                    self.shutdown()
+                    return
+                else:
+                    conn.send(self.run(kind, kwargs))
+
+
+class DaemonClient:
+    """
+    Client of a ProcessingDaemon. Each method blocks until the daemon answers, so use a client per thread to run jobs
+    at the same time.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        """
+        :param address: optional. Address of the daemon. Defaults to DEFAULT_ADDRESS.
+        """
+        self.conn = Client(address, authkey=_authkey())
+
+    def run(self, kind: str, **kwargs) -> dict:
+        """
+        Runs a job in the daemon.
+        :param kind: str. Job, one of JOBS.
+        :param kwargs: Keyword arguments of the job.
+        :return: dict. Result of the job, with its output paths, the timings of its steps as (step, seconds) and the
+            elapsed seconds.
+        :raises DaemonJobError: If the job failed.
+        """
+        self.conn.send((kind, kwargs))
+        status, payload = self.conn.recv()
+        if status != "done":
+            raise DaemonJobError(payload)
+        return payload
+
+    def vessel_chain(self, prod_path: str, **params) -> dict:
+        """
+        See vessel_chain.
+        """
+        if "out_dir" in params:
+            params["out_dir"] = os.path.abspath(params["out_dir"])
+        return self.run("vessel_chain", prod_path=os.path.abspath(prod_path), **params)
+
+    def change_preprocessing(self, prod_path: str, **params) -> dict:
+        """
+        See change_preprocessing.
+        """
+        if "out_dir" in params:
+            params["out_dir"] = os.path.abspath(params["out_dir"])
+        return self.run("change_preprocessing", prod_path=os.path.abspath(prod_path), **params)
+
+    def operator_chain(self, prod_path: str, operators, out_path: str, out_fmt: str = "BEAM-DIMAP", **options) -> dict:
+        """
+        See operator_chain.
+        """
+        return self.run("operator_chain", prod_path=os.path.abspath(prod_path), operators=list(operators),
+                        out_path=os.path.abspath(out_path), out_fmt=out_fmt, **options)
+
+    def ping(self) -> dict:
+        """
+        :return: dict. Status of the daemon.
+        """
+        return self.run("ping")
+
+    def shutdown(self) -> None:
+        """
+        Stops the daemon once its running jobs are finished.
+        :return: None.
+        """
+        self.run("shutdown")
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the connection.
+        :return: None.
+        """
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
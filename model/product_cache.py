@@ -0,0 +1,210 @@
+"""Module for the persistent store of intermediate products of the processing chains."""
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+import utils
+from .quicklooks import QuicklookStore
+
+VERSION = 1  # Bump to invalidate the stored products, e.g. when the parameters of an operator change meaning
+COMPLETE = ".complete"  # Marker written to an entry once its product is complete, before it is published
+STALE_SECONDS = 24 * 3600  # Age after which the working directories of crashed processes are removed
+
+
+def _tree_size(path: str) -> int:
+    """
+    :param path: str. Directory.
+    :return: int. Size of the files in it and its subdirectories, in bytes.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def copy_product(src: str, dst: str) -> str:
+    """
+    Copies a BEAM-DIMAP product, i.e. its .dim file and its .data directory, replacing the destination product. The
+    files of the .data directory, which hold the rasters, are hardlinked if possible, so that no bytes are copied.
+    :param src: str. Path of the source .dim file.
+    :param dst: str. Path of the destination .dim file.
+    :return: str. Path of the destination .dim file.
+    """
+    src_data = f"{os.path.splitext(src)[0]}.data"
+    dst_data = f"{os.path.splitext(dst)[0]}.data"
+
+    if os.path.isdir(dst_data):
+        shutil.rmtree(dst_data)
+    for root, _, files in os.walk(src_data):
+        directory = os.path.join(dst_data, os.path.relpath(root, src_data))
+        os.makedirs(directory, exist_ok=True)
+        for name in files:
+            QuicklookStore.link_or_copy(os.path.join(root, name), os.path.join(directory, name))
+    shutil.copy2(src, dst)  # Last, so that a product with its .dim file is complete
+    return dst
+
+
+class ProductCache:
+    """
+    Directory of BEAM-DIMAP products keyed by a hash of the source product and of the operators applied to it, with
+    their parameters, in order. Any prefix of a chain that was already computed is read from the cache instead, e.g. the
+    preprocessing of the reference product of a change detection or the calibration of a product on which vessels are
+    detected again with other thresholds. It is shared between runs and processes and evicts the least recently used
+    products once it exceeds its size limit. Reading a product through the cache refreshes the modification time of its
+    entry, which is used as its last access time.
+
+    Entries are only published, by renaming them, once their product is complete, and they are renamed away before
+    being removed, so readers never see partial products. Products are read from the cache through hardlinks in a
+    working directory of their own, see checkout, so that evicting them does not remove the files of a reader.
+    """
+
+    def __init__(self, directory: str = "", max_bytes: int = 20 * 1024 ** 3):
+        """
+        :param directory: str, optional. Directory of the cache. Defaults to products in the app's cache directory.
+        :param max_bytes: int, optional. Maximal size of the stored products, in bytes. Defaults to 20 GiB.
+        """
+        self._directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def directory(self) -> str:
+        """
+        Directory of the cache, created upon first use.
+        :return: str.
+        """
+        if not self._directory:
+            self._directory = utils.cache_dir("products")
+        else:
+            os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    @staticmethod
+    def key(source: str, operators) -> str:
+        """
+        Hashes a chain. The source product is identified by its name, size and modification time rather than by its
+        path, so that moved products share their entries, and rather than by its content, which would take as long as
+        reading it. Those of a SAFE directory are taken from its manifest.
+        :param source: str. Path to the source product.
+        :param operators: Iterable. (name, params) of each operator, in order.
+        :return: str. Hex digest.
+        """
+        source = source.rstrip("/\\")
+        identity = [os.path.basename(source)]
+        try:
+            stat = os.stat(os.path.join(source, "manifest.safe") if os.path.isdir(source) else source)
+            identity += [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            pass
+        chain = [[name, params or {}] for name, params in operators]
+        blob = json.dumps([VERSION, identity, chain], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def workspace(self) -> str:
+        """
+        Creates a working directory in the cache, on the same drive as the stored products so that they can be
+        hardlinked into it. Eviction leaves it alone. It must be removed by the caller.
+        :return: str. Path of the directory.
+        """
+        return tempfile.mkdtemp(dir=self.directory, suffix=".part")
+
+    def get(self, key: str):
+        """
+        Looks up a product, marking it as recently used.
+        :param key: str. Key of the chain.
+        :return: str. Path of the product's .dim file, or None if it is not stored.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            if not os.path.isfile(os.path.join(entry, COMPLETE)):
+                return None
+            os.utime(entry)
+            names = [x for x in os.listdir(entry) if x.endswith(".dim")]
+        except OSError:
+            return None
+        return os.path.join(entry, names[0]) if names else None
+
+    def checkout(self, key: str, directory: str):
+        """
+        Looks up a product and places it in a directory of the reader, so that it can be read even if it is evicted
+        meanwhile.
+        :param key: str. Key of the chain.
+        :param directory: str. Directory of the reader, e.g. from workspace.
+        :return: str. Path of the product's .dim file in directory, or None if it is not stored.
+        """
+        stored = self.get(key)
+        if stored is None:
+            return None
+        try:
+            return copy_product(stored, os.path.join(directory, os.path.basename(stored)))
+        except OSError:  # Evicted meanwhile
+            return None
+
+    def put(self, key: str, path: str) -> None:
+        """
+        Stores a product. It is placed in a temporary directory and then renamed, so readers never see it half-written.
+        If another process stored the same product meanwhile, that one is kept.
+        :param key: str. Key of the chain.
+        :param path: str. Path of the product's .dim file.
+        :return: None.
+        """
+        tmp = self.workspace()
+        try:
+            copy_product(path, os.path.join(tmp, os.path.basename(path)))
+            with open(os.path.join(tmp, COMPLETE), "w"):
+                pass
+            os.rename(tmp, os.path.join(self.directory, key))
+        except OSError:
+            if self.get(key) is None:
+                raise
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used products until the size limit is met, along with the leftovers of crashed
+        processes. Each entry is renamed before it is removed, so that a partial removal is never served. Entries that
+        cannot be renamed, e.g. those with open files on Windows, are left alone.
+        :return: None.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            if entry.name.endswith(".del") or (entry.name.endswith(".part") and
+                                               time.time() - entry.stat().st_mtime > STALE_SECONDS):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif not entry.name.endswith(".part"):
+                entries.append(entry)
+
+        stats = {entry.path: (entry.stat().st_mtime, _tree_size(entry.path)) for entry in entries}
+        total = sum(size for _, size in stats.values())
+        if total <= self.max_bytes:
+            return
+
+        for path, (_, size) in sorted(stats.items(), key=lambda item: item[1][0]):
+            tombstone = f"{path}.{os.getpid()}.del"
+            try:
+                os.rename(path, tombstone)
+            except OSError:  # In use, or removed by another process
+                continue
+            shutil.rmtree(tombstone, ignore_errors=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> None:
+        """
+        Removes every product.
+        :return: None.
+        """
+        for entry in os.scandir(self.directory):
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,234 @@
+"""Module for the persistent, on-disk cache of query results."""
+import contextlib
+import hashlib
+import json
+import os.path
+import pickle
+import sqlite3
+import time
+import zlib
+
+import shapely.wkt
+
+import utils
+from . import results
+
+
+class QueryCache:
+    """
+    SQLite-backed cache of query results. Entries are keyed by the normalized query parameters, expire after a
+    configurable TTL and are evicted in least recently used order once the cache exceeds its size limit.
+    """
+
+    def __init__(self, path: str = "", ttl: float = 24 * 3600.0, max_bytes: int = 512 * 1024 ** 2):
+        """
+        :param path: str, optional. Path to the SQLite file. Defaults to queries.sqlite in the app's cache directory.
+        :param ttl: float, optional. Seconds an entry is valid for. Defaults to one day.
+        :param max_bytes: int, optional. Maximal size of the stored results, in bytes. Defaults to 512 MiB.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    @staticmethod
+    def normalize(api_url: str, aoi: str = None, start: str = "", end: str = "", platformname: str = "",
+                  producttype: str = "", relative_orbit: int = None, area_relation: str = "Intersects",
+                  **kwargs) -> dict:
+        """
+        Normalizes the parameters of Downloader.query, so that equivalent queries share the same key.
+        :param api_url: str. Hub URL the query is sent to.
+        :param aoi: str, optional. AoI WKT string. It is stored as the hash of its normalized WKT.
+        :param start: str, optional. Start date.
+        :param end: str, optional. End date.
+        :param platformname: str, optional. Sentinel mission.
+        :param producttype: str, optional. Product type.
+        :param relative_orbit: int, optional. Relative orbit number.
+        :param area_relation: str, optional. Area relation.
+        :param kwargs: Other keyword args. Those that are None are ignored, since they are not sent to the hub.
+        :return: dict. JSON serializable normalized parameters.
+        """
+        if aoi:
+            aoi = hashlib.sha256(shapely.wkt.dumps(shapely.wkt.loads(aoi), rounding_precision=10).encode()).hexdigest()
+
+        def plain(value):
+            # Makes values JSON serializable and independent of their order when it does not matter
+            if isinstance(value, set):
+                return sorted(plain(v) for v in value)
+            if isinstance(value, (list, tuple)):
+                return [plain(v) for v in value]
+            if hasattr(value, "isoformat"):
+                return value.isoformat()
+            return value
+
+        return {
+            "api_url": api_url.rstrip("/"),
+            "aoi": aoi if aoi else None,
+            "start": str(start).strip(),
+            "end": str(end).strip(),
+            "platformname": platformname,
+            "producttype": producttype,
+            "relative_orbit": int(relative_orbit) if relative_orbit else None,
+            "area_relation": area_relation.lower(),
+            "kwargs": {k.lower(): plain(v) for k, v in sorted(kwargs.items()) if v is not None}
+        }
+
+    @staticmethod
+    def key(params: dict) -> str:
+        """
+        Hashes normalized parameters into a cache key.
+        :param params: dict. Parameters returned by QueryCache.normalize.
+        :return: str. Hexadecimal key.
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Retrieves a cached result.
+        :param key: str. Cache key.
+        :return: The results dict, or None if there is no valid entry.
+        """
+        now = time.time()
+        with self._connect() as con:
+            row = con.execute("SELECT created, results FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            created, blob = row
+            if created + self.ttl < now:  # Expired
+                con.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+
+            con.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+
+        return pickle.loads(zlib.decompress(blob))
+
+    def put(self, key: str, params: dict, results: dict, aoi: str = None) -> None:
+        """
+        Stores a result, evicting the least recently used entries if the size limit is exceeded.
+        :param key: str. Cache key.
+        :param params: dict. Normalized parameters.
+        :param results: dict. Results dict.
+        :param aoi: str, optional. AoI WKT string of the query, so that narrower queries can be answered from this
+            entry. Defaults to None.
+        :return: None.
+        """
+        blob = zlib.compress(pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(blob) > self.max_bytes:  # It would evict everything else and itself
+            return
+
+        now = time.time()
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO entries (key, params, aoi, created, accessed, size, results) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, json.dumps(params), aoi, now, now, len(blob), blob))
+            self._evict(con)
+
+    def supersets(self, params: dict, aoi: str = None):
+        """
+        Finds the valid entries whose query returned every product that the given query would return.
+        :param params: dict. Normalized parameters of the query.
+        :param aoi: str, optional. AoI WKT string of the query. Defaults to None.
+        :return: list of (key, normalized parameters) tuples, smallest entries first.
+        """
+        with self._connect() as con:
+            rows = con.execute("SELECT key, params, aoi FROM entries WHERE created >= ? ORDER BY size",
+                               (time.time() - self.ttl,)).fetchall()
+
+        supersets = []
+        for key, outer, outer_aoi in rows:
+            outer = json.loads(outer)
+            if QueryCache.covers(outer, params, outer_aoi, aoi):
+                supersets.append((key, outer))
+        return supersets
+
+    @staticmethod
+    def covers(outer: dict, inner: dict, outer_aoi: str = None, inner_aoi: str = None) -> bool:
+        """
+        Checks whether the results of the outer query contain every product returned by the inner query.
+        :param outer: dict. Normalized parameters of the broader query.
+        :param inner: dict. Normalized parameters of the narrower query.
+        :param outer_aoi: str, optional. AoI WKT string of the broader query.
+        :param inner_aoi: str, optional. AoI WKT string of the narrower query.
+        :return: bool.
+        """
+        for param in ("api_url", "platformname", "producttype"):
+            if outer[param] != inner[param]:
+                return False
+
+        # Every keyword of the outer query must be in the inner query, the inner query may add more
+        if any(inner["kwargs"].get(k) != v for k, v in outer["kwargs"].items()):
+            return False
+
+        if outer["relative_orbit"] is not None and outer["relative_orbit"] != inner["relative_orbit"]:
+            return False
+
+        # Date ranges. Relative dates, such as NOW-1DAY, change meaning over time
+        for bound, inside in (("start", lambda o, i: o <= i), ("end", lambda o, i: i <= o)):
+            if not outer[bound]:
+                continue
+            o = results.parse_date(outer[bound])
+            i = results.parse_date(inner[bound]) if inner[bound] else None
+            if o is None or i is None or not inside(o, i):
+                return False
+
+        # Area. Any product that intersects, contains or is within an AoI intersects every AoI that covers it
+        if outer["aoi"] is None:
+            return True
+        if outer["area_relation"] == inner["area_relation"] and outer["aoi"] == inner["aoi"]:
+            return True
+        if outer["area_relation"] != "intersects" or not outer_aoi or not inner_aoi:
+            return False
+        return shapely.wkt.loads(outer_aoi).covers(shapely.wkt.loads(inner_aoi))
+
+    def invalidate(self, key: str = None) -> None:
+        """
+        Removes cached entries.
+        :param key: str, optional. Key of the entry to remove. If not given, the whole cache is cleared.
+        :return: None.
+        """
+        with self._connect() as con:
+            if key is None:
+                con.execute("DELETE FROM entries")
+            else:
+                con.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, con: sqlite3.Connection) -> None:
+        """
+        Deletes expired entries and then the least recently used ones until the size limit is met.
+        :param con: Open connection.
+        :return: None.
+        """
+        con.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in con.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            con.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection to the cache, creating it if needed, and commits and closes it on exit. A connection is
+        opened per operation, so the cache can be shared between threads.
+        :return: Context manager yielding a sqlite3.Connection.
+        """
+        if not self.path:
+            self.path = os.path.join(utils.cache_dir(), "queries.sqlite")
+
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                con.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, params TEXT, aoi TEXT, "
+                            "created REAL, accessed REAL, size INTEGER, results BLOB)")
+                if "aoi" not in [row[1] for row in con.execute("PRAGMA table_info(entries)")]:  # Older caches
+                    con.execute("ALTER TABLE entries ADD COLUMN aoi TEXT")
+                self._initialized = True
+            yield con
+            con.commit()
+        finally:
+            con.close()
@@ -0,0 +1,151 @@
+"""Module for the persistent store of product quicklooks."""
+import os
+import os.path
+import shutil
+import tempfile
+
+import utils
+
+
+class QuicklookStore:
+    """
+    Directory of quicklooks named after their product identifier, which never changes for a given product. It is shared
+    between runs and evicts the least recently used quicklooks once it exceeds its size limit. Reading a quicklook
+    through the store refreshes the modification time of an empty .used file next to it, which is used as its last
+    access time. That of the quicklook itself is left alone, since it may be hardlinked into the user's directories.
+    """
+
+    def __init__(self, directory: str = "", max_bytes: int = 256 * 1024 ** 2):
+        """
+        :param directory: str, optional. Directory of the store. Defaults to quicklooks in the app's cache directory.
+        :param max_bytes: int, optional. Maximal size of the store, in bytes. Defaults to 256 MiB.
+        """
+        self._directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def directory(self) -> str:
+        """
+        Directory of the store, created upon first use.
+        :return: str.
+        """
+        if not self._directory:
+            self._directory = utils.cache_dir("quicklooks")
+        else:
+            os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def path(self, identifier: str) -> str:
+        """
+        :param identifier: str. Product identifier.
+        :return: str. Path of the product's quicklook, whether it is stored or not.
+        """
+        return os.path.join(self.directory, f"{identifier}.jpeg")
+
+    def get(self, identifier: str):
+        """
+        Looks up a quicklook, marking it as recently used.
+        :param identifier: str. Product identifier.
+        :return: str. Path of the quicklook, or None if it is not stored.
+        """
+        path = self.path(identifier)
+        if not os.path.isfile(path):
+            return None
+        try:
+            self._touch(path)
+        except OSError:  # Evicted meanwhile
+            return None
+        return path
+
+    def put(self, identifier: str, content: bytes) -> str:
+        """
+        Stores a quicklook. The file is written under a temporary name and then moved, so readers never see it
+        half-written.
+        :param identifier: str. Product identifier.
+        :param content: bytes. JPEG image.
+        :return: str. Path of the quicklook.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        path = self.path(identifier)
+        os.replace(tmp, path)
+        self._touch(path)
+        return path
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used quicklooks until the size limit is met.
+        :return: None.
+        """
+        entries = [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith(".jpeg")]
+        sizes = {entry.path: entry.stat().st_size for entry in entries}
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        for path in sorted(sizes, key=self._last_access):
+            try:
+                os.remove(path)
+            except OSError:  # In use, or removed by another process
+                continue
+            try:
+                os.remove(f"{path}.used")
+            except OSError:
+                pass
+            total -= sizes[path]
+            if total <= self.max_bytes:
+                break
+
+    def clear(self) -> None:
+        """
+        Removes every quicklook.
+        :return: None.
+        """
+        for entry in os.scandir(self.directory):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        """
+        Marks a quicklook as used now.
+        :param path: str. Path of the quicklook.
+        :return: None.
+        """
+        with open(f"{path}.used", "a"):
+            pass
+        os.utime(f"{path}.used")
+
+    @staticmethod
+    def _last_access(path: str) -> float:
+        """
+        :param path: str. Path of the quicklook.
+        :return: float. Time it was last used, or stored if its .used file is missing, 0 if it was removed.
+        """
+        for candidate in (f"{path}.used", path):
+            try:
+                return os.path.getmtime(candidate)
+            except OSError:
+                continue
+        return 0.0
+
+    @staticmethod
+    def link_or_copy(src: str, dst: str) -> str:
+        """
+        Places a file somewhere else, hardlinking it if possible and copying it otherwise, e.g. across drives.
+        :param src: str. Source path.
+        :param dst: str. Destination path. It is replaced if it exists.
+        :return: str. Destination path.
+        """
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return dst
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        return dst
@@ -0,0 +1,210 @@
+"""Module for the columnar representation of query results and their local filtering."""
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import shapely.wkt
+from sentinelsat import format_query_date
+
+import utils
+from . import coverage
+
+gpd = utils.LazyModule("geopandas")
+
+CRS = "EPSG:4326"
+
+# Product properties that are stored as categorical columns
+CATEGORICAL = ("satellite", "orbitdirection", "missiondatatakeid", "platformname", "producttype",
+               "sensoroperationalmode", "polarisationmode", "status")
+
+# Product properties that are stored as datetime columns
+DATETIMES = ("beginposition", "endposition", "ingestiondate")
+
+# Product properties that are not stored. The footprint is kept as the geometry column instead
+DROPPED = ("footprint", "gmlfootprint")
+
+
+def to_frame(res: dict) -> gpd.GeoDataFrame:
+    """
+    Converts the results of a query to a typed GeoDataFrame, column by column. The results dict is only read, neither
+    copied nor modified.
+    :param res: dict. Results dict with the format { uuid: properties }.
+    :return: GeoDataFrame indexed by uuid, in the same order as res. The footprint is the geometry column, and a
+        satellite column is derived from the identifier.
+    """
+    if not res:
+        return gpd.GeoDataFrame(crs=CRS, geometry=[])
+
+    products = list(res.values())
+    keys = dict.fromkeys(key for properties in products for key in properties)  # Every key, in order of appearance
+
+    columns = {key: [properties.get(key) for properties in products] for key in keys if key not in DROPPED}
+    df = pd.DataFrame(columns, index=pd.Index(list(res)))
+
+    df["satellite"] = df["identifier"].str[:3]  # Satellite who took the product
+
+    for col in DATETIMES:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col])
+
+    for col in CATEGORICAL:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    footprints = coverage.parse_footprints([properties["footprint"] for properties in products])
+
+    return gpd.GeoDataFrame(df, geometry=footprints.values, crs=CRS)
+
+
+def access_column(flags) -> pd.Categorical:
+    """
+    Converts Online flags to the categorical access column.
+    :param flags: Iterable of bools, or of None where the access status is not known yet.
+    :return: Categorical with online and offline values, and missing ones for unknown flags.
+    """
+    codes = np.fromiter((-1 if flag is None else 0 if flag else 1 for flag in flags), dtype=np.int8)
+    return pd.Categorical.from_codes(codes, categories=["online", "offline"])
+
+
+def coverage_mask(aoicoverage: pd.Series, datatakes: pd.Series, aoi_pct: int = 0,
+                  same_datatake: bool = True) -> pd.Series:
+    """
+    Selects the products that cover enough of the AoI.
+    :param aoicoverage: Series. Coverage percent of each product.
+    :param datatakes: Series. Datatake identifier of each product. Same index as aoicoverage.
+    :param aoi_pct: int, optional. Percent of AoI coverage. Defaults to 0.
+    :param same_datatake: bool, optional. If set, the coverages of the products of the same datatake are summed up.
+        Defaults to True.
+    :return: Boolean Series. Same index as aoicoverage.
+    """
+    if same_datatake:
+        return coverage.datatake_coverage(aoicoverage, datatakes) >= aoi_pct
+    return aoicoverage >= aoi_pct
+
+
+def parse_date(value):
+    """
+    Parses a query date.
+    :param value: str or datetime. Date in any of the formats accepted by Downloader.query, e.g. YYYYMMDD.
+    :return: datetime, or None if the date is relative (e.g. NOW-1DAY) or unbounded.
+    """
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(format_query_date(value), "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return None
+
+
+def select(res: dict, aoi: str = None, start="", end="", area_relation: str = "Intersects", **attributes):
+    """
+    Answers a query locally from the results of a broader one. The results dict is neither copied nor modified.
+    :param res: dict. Results of the broader query, with the format { uuid: properties }.
+    :param aoi: str, optional. AoI WKT string. If not given, products are not filtered spatially.
+    :param start: str or datetime, optional. Start of the beginposition range.
+    :param end: str or datetime, optional. End of the beginposition range.
+    :param area_relation: str, optional. Intersects, Contains or IsWithin. Defaults to Intersects.
+    :param attributes: Other query keywords. Scalars are matched for equality, sets as any of their elements, and
+        two-element tuples as (lower, upper) ranges, where None or "*" mean unbounded.
+    :return: dict with the selected products, in the same order as res, or None if some keyword cannot be evaluated
+        locally.
+    """
+    uuids = list(res)
+    keep = np.ones(len(uuids), dtype=bool)
+    if not uuids:
+        return OrderedDict()
+
+    # Date range on beginposition
+    bounds = []
+    for value in (start, end):
+        bound = parse_date(value) if value else None
+        if value and bound is None:  # Relative dates are not evaluated locally
+            return None
+        bounds.append(bound)
+
+    start, end = bounds
+    if start or end:
+        begin = pd.to_datetime([res[uuid]["beginposition"] for uuid in uuids])
+        if start:
+            keep &= begin >= start
+        if end:
+            keep &= begin <= end
+
+    # Attributes
+    for attr, wanted in attributes.items():
+        if wanted is None:
+            continue
+        attr = attr.lower()
+        values = [res[uuid].get(attr) for uuid in uuids]
+        if any(value is None for value in values):  # The property was not returned by the hub
+            return None
+
+        matched = _match_attribute(values, wanted)
+        if matched is None:
+            return None
+        keep &= matched
+
+    # Spatial predicate against the cached footprints
+    if aoi and keep.any():
+        aoi = shapely.wkt.loads(aoi)
+        idx = np.flatnonzero(keep)
+        footprints = coverage.parse_footprints([res[uuids[i]]["footprint"] for i in idx])
+
+        relation = area_relation.lower()
+        if relation == "intersects":
+            spatial = np.zeros(len(idx), dtype=bool)
+            spatial[coverage.candidates(footprints, aoi)] = True
+        elif relation == "contains":
+            spatial = footprints.contains(aoi).to_numpy()
+        elif relation == "iswithin":
+            spatial = footprints.within(aoi).to_numpy()
+        else:
+            raise ValueError(f"Incorrect AOI relation provided ({area_relation})")
+
+        keep[idx] = spatial
+
+    return OrderedDict((uuid, res[uuid]) for uuid, k in zip(uuids, keep) if k)
+
+
+def _match_attribute(values: list, wanted) -> np.ndarray:
+    """
+    Matches product property values against a query keyword value.
+    :param values: list. Property value of each product.
+    :param wanted: Keyword value, as accepted by Downloader.query.
+    :return: Boolean array, or None if the keyword value is not understood.
+    """
+    def same(value, other):
+        if isinstance(value, str) or isinstance(other, str):
+            return str(value).strip('"').lower() == str(other).strip('"').lower()
+        return value == other
+
+    if isinstance(wanted, set):
+        return np.array([any(same(value, w) for w in wanted) for value in values], dtype=bool)
+
+    if isinstance(wanted, (list, tuple)):
+        if len(wanted) != 2:
+            return None
+
+        bounds = []
+        for bound in wanted:
+            if bound in (None, "*"):
+                bounds.append(None)
+            elif isinstance(values[0], datetime):
+                bound = parse_date(bound)
+                if bound is None:
+                    return None
+                bounds.append(bound)
+            else:
+                bounds.append(bound)
+
+        lower, upper = bounds
+        return np.array([(lower is None or value >= lower) and (upper is None or value <= upper) for value in values],
+                        dtype=bool)
+
+    if isinstance(wanted, str) and any(c in wanted for c in "*?[]{}()"):  # Solr syntax is not evaluated locally
+        return None
+
+    return np.array([same(value, wanted) for value in values], dtype=bool)
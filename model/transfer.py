@@ -0,0 +1,376 @@
+"""Module for segmented, resumable downloads over parallel HTTP range requests."""
+import hashlib
+import json
+import os
+import os.path
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from sentinelsat.exceptions import InvalidChecksumError
+
+from .download_queue import DownloadCancelled
+
+
+class RangeDownloader:
+    """
+    Downloads files with several HTTP range requests in parallel. Partial files are kept as .incomplete files along
+    with a .parts sidecar recording the bytes written to each segment, so interrupted downloads are resumed. The MD5
+    checksum is computed while the bytes arrive, instead of reading the finished file again.
+    """
+
+    def __init__(self, session: requests.Session = None, segment_size: int = 32 * 1024 ** 2, max_segments: int = 4,
+                 chunk_size: int = 1024 ** 2, max_attempts: int = 10, limiter=None, timeout: float = 60.0):
+        """
+        :param session: requests.Session, optional. Session used for the requests. Defaults to a new one.
+        :param segment_size: int, optional. Size of each range request, in bytes. Defaults to 32 MiB.
+        :param max_segments: int, optional. Maximal number of range requests of a file at the same time. Defaults
+            to 4.
+        :param chunk_size: int, optional. Size of the chunks read from each response, in bytes. Defaults to 1 MiB.
+        :param max_attempts: int, optional. Attempts per segment before the download fails. Defaults to 10.
+        :param limiter: Semaphore, optional. Held during each request, to bound the connections to the server across
+            downloads. Defaults to None.
+        :param timeout: float, optional. Seconds to wait for the server. Defaults to 60.
+        """
+        self.session = session if session is not None else requests.Session()
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.limiter = limiter if limiter is not None else threading.BoundedSemaphore(max_segments)
+        self.timeout = timeout
+
+    def download(self, url: str, path: str, size: int = None, md5: str = None, progress=None,
+                 cancel: threading.Event = None) -> dict:
+        """
+        Downloads a file, resuming it if a previous download was interrupted.
+        :param url: str. URL of the file.
+        :param path: str. Output path.
+        :param size: int, optional. Size of the file, in bytes. If not given, it is asked to the server.
+        :param md5: str, optional. Expected MD5 checksum. If given, it is verified before the file is put in place.
+        :param progress: Callable, optional. Called with the number of bytes of each written chunk.
+        :param cancel: threading.Event, optional. Once set, the download stops after the chunks being written and
+            raises DownloadCancelled. It can be resumed later.
+        :return: dict with the path, size, downloaded_bytes (in this call), seconds, throughput (bytes per second)
+            and md5 of the download.
+        """
+        ranges = True
+        if size is None:
+            size, ranges = self._probe(url)
+
+        transfer = _Transfer(path, size, self.segment_size if ranges else max(size, 1))
+        start = time.perf_counter()
+
+        if progress is not None and transfer.done:
+            progress(transfer.done)
+
+        pending = [segment for segment in transfer.segments if not transfer.is_complete(segment)]
+        if pending:
+            try:
+                with ThreadPoolExecutor(min(self.max_segments, len(pending))) as executor:
+                    futures = [executor.submit(self._fetch, url, transfer, segment, ranges, progress, cancel)
+                               for segment in pending]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        transfer.cancelled = True  # The other segments stop at their next chunk
+                        for future in futures:
+                            future.cancel()
+                        raise
+            except BaseException:
+                transfer.checkpoint()  # So that the next attempt resumes from here
+                raise
+
+        seconds = time.perf_counter() - start
+        checksum = transfer.finish()
+
+        if md5 and checksum.lower() != md5.lower():
+            transfer.discard()
+            raise InvalidChecksumError(f"File corrupt: checksums do not match for {os.path.basename(path)}")
+
+        transfer.commit()
+
+        return {
+            "path": path,
+            "size": size,
+            "downloaded_bytes": transfer.received,
+            "seconds": seconds,
+            "throughput": transfer.received / seconds if seconds > 0 else 0.0,
+            "md5": checksum
+        }
+
+    def _probe(self, url: str):
+        """
+        Asks the server for the size of a file and whether it accepts range requests.
+        :param url: str. URL of the file.
+        :return: A tuple with the size in bytes and a bool.
+        """
+        with self.limiter:
+            with self.session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                total = re.search(r"/(\d+)$", response.headers.get("Content-Range", ""))
+                if response.status_code == 206 and total:
+                    return int(total.group(1)), True
+                return int(response.headers["Content-Length"]), False
+
+    def _fetch(self, url: str, transfer, segment: tuple, ranges: bool, progress=None,
+               cancel: threading.Event = None) -> None:
+        """
+        Downloads the rest of a segment, retrying from the last written byte upon connection errors.
+        :param url: str. URL of the file.
+        :param transfer: _Transfer. State of the download.
+        :param segment: tuple. (start, end) byte offsets of the segment, end excluded.
+        :param ranges: bool. Whether the server accepts range requests. If not, the whole file is a single segment.
+        :param progress: Callable, optional. Called with the number of bytes of each written chunk.
+        :param cancel: threading.Event, optional. Once set, DownloadCancelled is raised after the current chunk.
+        :return: None.
+        """
+        start, end = segment
+        for attempt in range(1, self.max_attempts + 1):
+            if transfer.cancelled:
+                return
+
+            offset = start + transfer.written[start]
+            if not ranges:  # The file is requested again from the beginning
+                transfer.restart(start)
+                offset = start
+            if offset >= end:
+                return
+
+            headers = {"Range": f"bytes={offset}-{end - 1}"} if ranges else {}
+            try:
+                with self.limiter, open(transfer.incomplete, "r+b") as f, \
+                        self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    if ranges and response.status_code != 206:
+                        raise requests.HTTPError(f"Range request not honoured ({response.status_code})",
+                                                 response=response)
+
+                    f.seek(offset)
+                    for chunk in response.iter_content(self.chunk_size):
+                        chunk = chunk[:end - offset]
+                        f.write(chunk)
+                        f.flush()
+                        transfer.wrote(start, offset, chunk)
+                        offset += len(chunk)
+                        if progress is not None:
+                            progress(len(chunk))
+                        if cancel is not None and cancel.is_set():
+                            raise DownloadCancelled(f"Download of {os.path.basename(transfer.path)} was cancelled")
+                        if offset >= end or transfer.cancelled:
+                            break
+
+                if offset >= end or transfer.cancelled:
+                    return
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                if attempt == self.max_attempts:
+                    raise
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status not in (429, 500, 502, 503, 504) or attempt == self.max_attempts:
+                    raise
+
+            time.sleep(min(2 ** attempt, 60) * random.uniform(0.05, 0.15))  # Jittered, so segments do not retry at once
+
+        raise IOError(f"Segment {start}-{end} of {url} could not be downloaded")
+
+
+class _Transfer:
+    """State of a download: the segments, the bytes written to each one and the running checksum."""
+
+    def __init__(self, path: str, size: int, segment_size: int):
+        """
+        :param path: str. Output path.
+        :param size: int. Size of the file, in bytes.
+        :param segment_size: int. Size of each segment, in bytes.
+        """
+        self.path = path
+        self.size = size
+        self.incomplete = path + ".incomplete"
+        self.sidecar = path + ".parts"
+        self.segment_size = segment_size
+        self.segments = [(start, min(start + segment_size, size)) for start in range(0, size, segment_size)]
+        self.written = {start: 0 for start, _ in self.segments}
+        self.received = 0
+        self.cancelled = False
+
+        self._lock = threading.Lock()
+        self._md5 = hashlib.md5()
+        self._frontier = 0  # Bytes fed to the checksum, which must be read in order
+        self._hashing = True  # Whether a thread is feeding the checksum, only one at a time does
+        self._saved = time.monotonic()
+
+        self._resume()
+        self._catch_up()
+
+    @property
+    def done(self) -> int:
+        """
+        :return: int. Bytes already written.
+        """
+        return sum(self.written.values())
+
+    def is_complete(self, segment: tuple) -> bool:
+        """
+        :param segment: tuple. (start, end) of the segment.
+        :return: bool. Whether every byte of the segment has been written.
+        """
+        start, end = segment
+        return start + self.written[start] >= end
+
+    def wrote(self, start: int, offset: int, chunk: bytes) -> None:
+        """
+        Records a chunk written to a segment and feeds the checksum. Chunks at the checksum frontier are hashed right
+        away. Those of later segments are read back once the frontier reaches them, by the thread that moves it. The
+        other segments keep writing meanwhile.
+        :param start: int. Start of the segment.
+        :param offset: int. Offset of the chunk.
+        :param chunk: bytes. The chunk.
+        :return: None.
+        """
+        with self._lock:
+            self.written[start] += len(chunk)
+            self.received += len(chunk)
+
+            if time.monotonic() - self._saved > 1.0:
+                self._save()
+
+            if self._hashing:  # The chunk is on disk already, the thread that is hashing will read it
+                return
+            self._hashing = True
+            at_frontier = offset == self._frontier
+
+        self._catch_up(chunk if at_frontier else b"")
+
+    def checkpoint(self) -> None:
+        """
+        Writes the progress to the sidecar.
+        :return: None.
+        """
+        with self._lock:
+            self._save()
+
+    def restart(self, start: int) -> None:
+        """
+        Forgets the bytes written to a segment.
+        :param start: int. Start of the segment.
+        :return: None.
+        """
+        with self._lock:
+            self.written[start] = 0
+            if self._frontier > start:
+                self._md5 = hashlib.md5()
+                self._frontier = 0
+
+    def finish(self) -> str:
+        """
+        Feeds the rest of the file to the checksum.
+        :return: str. Hexadecimal MD5 checksum.
+        """
+        with self._lock:
+            self._save()
+            self._hashing = True
+        self._catch_up()
+
+        with self._lock:
+            if self._frontier != self.size:
+                raise IOError(f"Download of {os.path.basename(self.path)} is incomplete")
+            return self._md5.hexdigest()
+
+    def commit(self) -> None:
+        """
+        Puts the finished file in place.
+        :return: None.
+        """
+        os.replace(self.incomplete, self.path)
+        if os.path.isfile(self.sidecar):
+            os.remove(self.sidecar)
+
+    def discard(self) -> None:
+        """
+        Removes the partial file and its sidecar, so the next attempt starts over.
+        :return: None.
+        """
+        for path in (self.incomplete, self.sidecar):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def _resume(self) -> None:
+        """
+        Loads the progress of a previous download of the same file, or creates the partial file.
+        :return: None.
+        """
+        if os.path.isfile(self.incomplete) and os.path.isfile(self.sidecar):
+            try:
+                with open(self.sidecar) as f:
+                    parts = json.load(f)
+                if parts["size"] == self.size and parts["segment_size"] == self.segment_size:
+                    self.written.update({int(start): written for start, written in parts["written"].items()})
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with open(self.incomplete, "wb") as f:
+            f.truncate(self.size)
+        self._save()
+
+    def _save(self) -> None:
+        """
+        Writes the progress to the sidecar. The lock must be held, or the transfer not yet shared.
+        :return: None.
+        """
+        with open(self.sidecar, "w") as f:
+            json.dump({"size": self.size, "segment_size": self.segment_size, "written": self.written}, f)
+        self._saved = time.monotonic()
+
+    def _available(self) -> int:
+        """
+        The lock must be held.
+        :return: int. End of the bytes written without gaps from the start of the file.
+        """
+        available = self._frontier
+        for start, end in self.segments:
+            if end <= available:
+                continue
+            available = max(available, start + self.written[start])
+            if available < end:
+                break
+        return available
+
+    def _catch_up(self, chunk: bytes = b"") -> None:
+        """
+        Feeds the checksum with a chunk at the frontier and then with the bytes already on disk that follow it, until
+        none are left. The caller must have set _hashing, which is cleared once done. The file is read without holding
+        the lock.
+        :param chunk: bytes, optional. Chunk that starts at the frontier.
+        :return: None.
+        """
+        try:
+            if chunk:
+                self._md5.update(chunk)
+                with self._lock:
+                    self._frontier += len(chunk)
+
+            with open(self.incomplete, "rb") as f:
+                while True:
+                    with self._lock:
+                        frontier, available = self._frontier, self._available()
+                        if available <= frontier:
+                            self._hashing = False
+                            return
+
+                    f.seek(frontier)
+                    data = f.read(min(1024 ** 2, available - frontier))
+                    if not data:
+                        raise IOError(f"{os.path.basename(self.incomplete)} is shorter than expected")
+                    self._md5.update(data)
+                    with self._lock:
+                        self._frontier += len(data)
+        except BaseException:
+            with self._lock:
+                self._hashing = False
+            raise
@@ -0,0 +1,87 @@
+"""Module for standing watch areas: saved queries that are re-run periodically and only fetch what is new."""
+import json
+import os.path
+import pickle
+from collections import OrderedDict
+from datetime import datetime
+
+
+class WatchedQuery:
+    """
+    A saved query JSON, as written by the download tab, plus an ingestion date watermark. The products found so far
+    are stored next to the JSON file.
+    """
+
+    def __init__(self, path: str, values: dict):
+        """
+        :param path: str. Path to the saved query JSON.
+        :param values: dict. Contents of the saved query JSON.
+        """
+        self.path = path
+        self.values = values
+        self.results_path = os.path.splitext(path)[0] + "_results.pkl"
+
+    @classmethod
+    def from_file(cls, path: str):
+        """
+        Loads a saved query.
+        :param path: str. Path to the saved query JSON.
+        :return: WatchedQuery.
+        """
+        with open(path) as f:
+            values = json.load(f)
+        return cls(path, values)
+
+    @property
+    def watermark(self):
+        """
+        Ingestion date of the most recent product found so far.
+        :return: datetime, or None if the query was never run.
+        """
+        watermark = self.values.get("watermark")
+        return datetime.strptime(watermark, "%Y-%m-%dT%H:%M:%S.%fZ") if watermark else None
+
+    @watermark.setter
+    def watermark(self, value: datetime):
+        self.values["watermark"] = value.strftime("%Y-%m-%dT%H:%M:%S.%fZ") if value else None
+
+    def query_params(self) -> dict:
+        """
+        Converts the saved values to Downloader.query keyword args, the same way the download tab does.
+        :return: dict.
+        """
+        rel_orbit = self.values.get("rel_orbit")
+        orb_dir = self.values.get("orb_dir")
+
+        return {
+            "aoi": self.values["aoi"],
+            "start": self.values["start"],
+            "end": self.values["end"],
+            "platformname": self.values["platform"],
+            "producttype": self.values["prod_type"],
+            "relative_orbit": int(rel_orbit) if rel_orbit else None,
+            "area_relation": "Contains" if self.values.get("aoi_pct") == 100 else "Intersects",
+            "orbitdirection": None if orb_dir in (None, "", "Both") else orb_dir
+        }
+
+    def load_results(self) -> dict:
+        """
+        Loads the products found so far.
+        :return: dict with the format { uuid: properties }. Empty if the query was never run.
+        """
+        if not os.path.isfile(self.results_path):
+            return OrderedDict()
+        with open(self.results_path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, res: dict) -> None:
+        """
+        Saves the products found so far and the watermark.
+        :param res: dict. Every product found so far.
+        :return: None.
+        """
+        with open(self.results_path, "wb") as f:
+            pickle.dump(res, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(self.path, "w") as f:
+            json.dump(self.values, f, indent=2)
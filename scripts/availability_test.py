@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from model.availability import AvailabilityResolver
+from model.download_queue import AdaptiveLimiter
+from mock_hub import generate_catalog, generate_products, serve
+
+
+def serial(url, uuids):
+    import requests
+
+    session = requests.Session()
+    return {u: session.get(f"{url}odata/v1/Products('{u}')/Online/$value").ok for u in uuids}
+
+
+def main():
+    catalog = generate_catalog(generate_products(400))
+    server, url = serve(catalog, latency=0.05)
+
+    resolver = AvailabilityResolver(url)
+
+    start = datetime.now()
+    flags = resolver.resolve(catalog.keys())
+    end = datetime.now()
+    print(f"Batched ({len(flags)} products): {end - start}")
+    assert all(flags[k] == v["Online"] for k, v in catalog.items())
+
+    start = datetime.now()
+    resolver.resolve(catalog.keys())
+    end = datetime.now()
+    print(f"Cached ({len(flags)} products): {end - start}")
+
+    start = datetime.now()
+    serial(url, catalog.keys())
+    end = datetime.now()
+    print(f"Serial ({len(flags)} products): {end - start}")
+
+    server.shutdown()
+
+    # Every other batch is throttled, and retried within a limiter shared with the rest of the hub's requests
+    server, url = serve(catalog, latency=0.05, throttle_every=2)
+    limiter = AdaptiveLimiter(4)
+    resolver = AvailabilityResolver(url, limiter=limiter)
+
+    start = datetime.now()
+    flags = resolver.resolve(catalog.keys())
+    end = datetime.now()
+    print(f"Throttled ({len(flags)} products): {end - start}, limit {limiter.limit:.1f} of {limiter.max_limit}")
+    assert all(flags[k] == v["Online"] for k, v in catalog.items())
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
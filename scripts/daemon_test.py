@@ -0,0 +1,53 @@
+import os
+import sys
+import threading
+import time
+
+from model.detection_queue import DetectionQueue
+from model.processing_daemon import DaemonClient, ProcessingDaemon, operator_chain
+
+ADDRESS = ("localhost", 6071)
+THRESHOLDS = [(30.0, 600.0), (50.0, 600.0), (30.0, 300.0), (80.0, 400.0)]
+
+
+def jobs(prod_path, out_dir):
+    """Object discrimination re-run with new thresholds on a product saved after the adaptive thresholding."""
+    for i, (min_tgt, max_tgt) in enumerate(THRESHOLDS):
+        yield prod_path, [("object_discrimination", {"min_tgt": min_tgt, "max_tgt": max_tgt})], \
+              os.path.join(out_dir, f"discrimination_{i}")
+
+
+def main(prod_path, out_dir):
+    # A new process per job, as DetectionQueue does
+    queue = DetectionQueue(max_workers=1)
+    for args in jobs(prod_path, out_dir):
+        queue.submit(operator_chain, *args)
+    start = time.perf_counter()
+    while not all(x.finished for x in queue.jobs.values()):
+        queue.poll()
+        time.sleep(0.05)
+    cold = time.perf_counter() - start
+    assert all(x.status == "done" for x in queue.jobs.values()), [x.error for x in queue.jobs.values()]
+    print(f"New process per job:  {cold:6.2f} s, {cold / len(THRESHOLDS):6.2f} s per job")
+
+    # Warm daemon, started beforehand
+    daemon = ProcessingDaemon(ADDRESS, workers=1)
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+    time.sleep(0.5)
+    with DaemonClient(ADDRESS) as client:
+        client.ping()
+        start = time.perf_counter()
+        client.operator_chain(*next(jobs(prod_path, out_dir)))  # Waits for the warm-up
+        print(f"Daemon warm-up:       {time.perf_counter() - start:6.2f} s")
+
+        start = time.perf_counter()
+        for args in jobs(prod_path, out_dir):
+            result = client.operator_chain(*args)
+        warm = time.perf_counter() - start
+        steps = ", ".join(f"{step} {secs:.2f} s" for step, secs in result["timings"])
+        print(f"Warm daemon:          {warm:6.2f} s, {warm / len(THRESHOLDS):6.2f} s per job ({steps})")
+        client.shutdown()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
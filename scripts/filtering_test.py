@@ -6,6 +6,8 @@ import pandas as pd
 import shapely.wkt
 from sentinelsat import SentinelAPI
 
+from model import Downloader
+
 
 def filter_json(aoi, res, api, minaoi=80, json_path="../gibstrait_april2020_full.json"):
     missiondatatakes = {}
@@ -67,14 +69,55 @@ def filter_dataframe(aoi, res, api, minaoi=80, json_path="../gibstrait_april2020
     return final_df
 
 
+def filter_vectorized(aoi, res, api, minaoi=80):
+    from model import coverage
+
+    df = api.to_dataframe(res)
+
+    df["aoicoverage"] = coverage.aoi_coverage(df["footprint"], aoi).round()
+    df["access"] = ["online" if v else "offline" for v in api.availability.resolve(df.index).values()]
+    df["sat"] = df["identifier"].str[:3]
+
+    mask = coverage.datatake_coverage(df["aoicoverage"], df["missiondatatakeid"]) >= minaoi
+
+    footprints = coverage.parse_footprints(df.loc[mask, "footprint"])
+    return gpd.GeoDataFrame(df[mask].drop(["footprint", "gmlfootprint"], axis=1), crs="EPSG:4326",
+                            geometry=footprints)
+
+
+def synthetic(n_products=50000):
+    # With shapely 1.8, WKT parsing and the intersections of the candidates still loop over the geometries one by one,
+    # and they take most of the time: about a second for 50k products, 2-3 times faster than the loop, not sub-second
+    from model import coverage
+    from mock_hub import generate_products
+
+    aoi = shapely.wkt.loads("POLYGON((-6.03 36.19, -5.25 36.19, -5.25 35.74, -6.03 35.74, -6.03 36.19))")
+    res = generate_products(n_products)
+    df = SentinelAPI.to_dataframe(res)
+
+    start = datetime.now()
+    loop = [round(shapely.wkt.loads(f).intersection(aoi).area / aoi.area * 100, 0) for f in df["footprint"]]
+    end = datetime.now()
+    print(f"Coverage loop ({n_products} products): {end - start}")
+
+    start = datetime.now()
+    vectorized = coverage.aoi_coverage(df["footprint"], aoi).round()
+    sums = coverage.datatake_coverage(pd.Series(vectorized, index=df.index), df["missiondatatakeid"])
+    end = datetime.now()
+    print(f"Coverage vectorized ({n_products} products, {(sums >= 80).sum()} kept): {end - start}")
+
+    assert (abs(vectorized - loop) < 1e-6).all()
+
+
 def main():
     aoi = "POLYGON((-6.0333718879122396 36.19765422366146, -5.8685769660372396 36.19100459398794, -5.7751931769747396 36.09563120236264, -5.6296243293184896 36.071214738040524, -5.5994119269747396 36.02680174350429, -5.4620828254122396 36.07565465918803, -5.4675759894747396 36.19765422366146, -5.3137673957247396 36.18657119381867, -5.2533425910372396 35.886737128238366, -5.3989114386934896 35.90008731402379, -5.5609597785372396 35.82217950335687, -5.7202615363497396 35.797678380278356, -5.7669534308809896 35.74419515250926, -5.9537210090059896 35.77094126240784, -6.0333718879122396 36.19765422366146))"
     aoi = shapely.wkt.loads(aoi)
 
-    api = SentinelAPI("fjavier.ruizs", "Pj9a2f2@v^mZ")
+    synthetic()
+
+    api = Downloader("fjavier.ruizs", "Pj9a2f2@v^mZ")
 
-    src = api.query(area=aoi, date=("20200301", "20200430"), order_by="+beginposition", platformname="Sentinel-1",
-                    producttype="GRD")
+    src = api.query(aoi.wkt, "20200301", "20200430", platformname="Sentinel-1", producttype="GRD")
 
     srccpy = copy.deepcopy(src)
     start = datetime.now()
@@ -87,6 +130,11 @@ def main():
     end = datetime.now()
     print(f"Filter by DataFrame ({len(src)} -> {len(res)}): {end - start}")
 
+    start = datetime.now()
+    res = filter_vectorized(aoi, src, api)
+    end = datetime.now()
+    print(f"Filter vectorized ({len(src)} -> {len(res)}): {end - start}")
+
 
 if __name__ == '__main__':
     main()
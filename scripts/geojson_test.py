@@ -0,0 +1,88 @@
+import json
+import random
+import time
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import MultiPolygon, Polygon
+
+from mock_hub import generate_products
+from model.coverage import num_vertices, parse_footprints
+from model.map_geojson import compact_geojson, compact_topojson, fit_zoom, zoom_tolerance
+
+N_PRODUCTS = 5000
+
+
+def results_frame(densify: int = 1) -> gpd.GeoDataFrame:
+    """Results of a search over the mock products, with every edge of the footprints split into densify segments."""
+    products = generate_products(N_PRODUCTS)
+    frame = gpd.GeoDataFrame.from_dict(products, orient="index")
+    frame["geometry"] = parse_footprints(frame["footprint"]).values
+    frame = gpd.GeoDataFrame(frame, geometry="geometry", crs="EPSG:4326")
+
+    if densify > 1:
+        rnd = random.Random(0)
+
+        def dense(geometry):
+            polygon = geometry.geoms[0]
+            coords = np.asarray(polygon.exterior.coords)
+            points = [a + (b - a) * i / densify + [rnd.gauss(0, 1e-4), rnd.gauss(0, 1e-4)]
+                      for a, b in zip(coords[:-1], coords[1:]) for i in range(densify)]
+            return MultiPolygon([Polygon(points)])
+
+        frame["geometry"] = [dense(x) for x in frame.geometry]
+
+    return frame
+
+
+def measure(name, encode, parse=json.loads):
+    start = time.perf_counter()
+    data = encode()
+    encoded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parse(data)
+    parsed = time.perf_counter() - start
+
+    print(f"  {name:<28} {len(data) / 1024:>9.0f} KiB  encode {encoded:6.2f} s  parse {parsed:6.3f} s")
+    return data
+
+
+def decode_topojson(data):
+    """Decodes the footprints of compact_topojson back to coordinates, to check the quantization error."""
+    topology = json.loads(data)
+    scale, translate = np.asarray(topology["transform"]["scale"]), np.asarray(topology["transform"]["translate"])
+    arcs = [np.cumsum(np.asarray(x), axis=0) * scale + translate for x in topology["arcs"]]
+    geometries = next(iter(topology["objects"].values()))["geometries"]
+    polygons = lambda x: [x["arcs"]] if x["type"] == "Polygon" else x["arcs"]
+    return {x["id"]: [arcs[ring[0]] for polygon in polygons(x) for ring in polygon] for x in geometries}
+
+
+def main():
+    aoi_bounds = (-7, 35, -4, 37)
+    zoom = fit_zoom(aoi_bounds, 800, 600)
+    tolerance = zoom_tolerance(zoom + 2)
+    print(f"AoI fitted at zoom {zoom} of an 800x600 map, tolerance {tolerance:.2e} degrees")
+
+    for densify in (1, 20):
+        frame = results_frame(densify)
+        vertices = sum(num_vertices(x) for x in frame.geometry)
+        simplified = frame.geometry.simplify(tolerance, preserve_topology=True)
+        exteriors = {k: Polygon(getattr(v, "geoms", [v])[0].exterior) for k, v in simplified.items()}
+        print(f"{N_PRODUCTS} footprints, {vertices} vertices, {sum(num_vertices(x) for x in simplified)} simplified:")
+
+        measure("All columns", lambda: frame.drop(columns=["footprint"]).to_json(default=str))
+        measure("Previous (title, link_icon)", lambda: frame[["geometry", "title", "link_icon"]].to_json())
+        geojson = measure("Compact GeoJSON", lambda: compact_geojson(frame, tolerance))
+        topojson = measure("Compact TopoJSON", lambda: compact_topojson(frame, tolerance))
+
+        # The compact encodings stay within the tolerance of the simplified footprints
+        for feature in json.loads(geojson)["features"]:
+            ring = np.asarray(feature["geometry"]["coordinates"][0])
+            assert Polygon(ring).hausdorff_distance(exteriors[feature["id"]]) <= tolerance
+        for uuid, rings in decode_topojson(topojson).items():
+            assert Polygon(rings[0]).hausdorff_distance(exteriors[uuid]) <= tolerance
+
+
+if __name__ == '__main__':
+    main()
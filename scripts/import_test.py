@@ -0,0 +1,53 @@
+import os.path
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ["--help"],
+    ["query", "--help"],
+    ["download", "--help"],
+    ["vessels", "--help"],
+    ["changes", "--help"],
+    ["daemon", "--help"],
+]
+HEAVY = ["PyQt5", "snappy", "geopandas", "pandas", "folium", "sentinelsat"]
+REPEATS = 5
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # So that it runs from any working directory
+
+# Runs the command in a fresh interpreter and reports which heavy modules it imported
+PROBE = """
+import sys, runpy
+sys.argv = ["sentivessi_batch.py"] + {args!r}
+try:
+    runpy.run_path({script!r}, run_name="__main__")
+except SystemExit:
+    pass
+print([x for x in {heavy!r} if x in sys.modules], file=sys.stderr)
+"""
+
+
+def main():
+    for args in [["-c", "pass"], ["-c", "import model"]]:
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], check=True, cwd=ROOT)
+            times.append(time.perf_counter() - start)
+        print(f"python {' '.join(args):<40} {min(times):6.3f} s")
+
+    for args in COMMANDS:
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            probe = PROBE.format(args=args, heavy=HEAVY, script=os.path.join(ROOT, "sentivessi_batch.py"))
+            proc = subprocess.run([sys.executable, "-c", probe], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  text=True, cwd=ROOT)
+            times.append(time.perf_counter() - start)
+        imported = proc.stderr.strip().splitlines()[-1]
+        print(f"sentivessi_batch.py {' '.join(args):<28} {min(times):6.3f} s  imported {imported}")
+        assert "PyQt5" not in imported
+
+
+if __name__ == '__main__':
+    main()
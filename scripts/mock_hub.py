@@ -0,0 +1,342 @@
+"""Local stand-in for the Open Access Hub, so that the downloader can be tested and benchmarked offline."""
+import hashlib
+import json
+import random
+import re
+import threading
+import uuid as uuidlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+def generate_products(n_products: int = 500, bounds: tuple = (-8.0, 34.0, -3.0, 38.0), seed: int = 0) -> dict:
+    """
+    Generates synthetic Sentinel-1 GRD products, shaped like the results of a query.
+    :param n_products: int, optional. Number of products. Defaults to 500.
+    :param bounds: tuple, optional. (minx, miny, maxx, maxy) where footprints are placed. Defaults to the Strait of
+        Gibraltar surroundings.
+    :param seed: int, optional. Random seed. Defaults to 0.
+    :return: dict with the format { uuid: properties }, in ascending beginposition.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    products = {}
+    datatake = rnd.randrange(0x10000, 0xFFFFF)
+    for i in range(n_products):
+        uuid = str(uuidlib.UUID(int=rnd.getrandbits(128)))
+        if i % 3 == 0:  # Products of the same datatake are consecutive slices
+            datatake += 1
+        sat = rnd.choice(["S1A", "S1B"])
+        begin = start + timedelta(minutes=i * 25, seconds=rnd.randrange(60))
+        x = rnd.uniform(bounds[0], bounds[2])
+        y = rnd.uniform(bounds[1], bounds[3])
+        w, h = rnd.uniform(1.5, 3.0), rnd.uniform(1.0, 2.0)
+        coords = [(x, y), (x + w, y + 0.2), (x + w - 0.1, y + h), (x - 0.1, y + h - 0.2), (x, y)]
+        footprint = "MULTIPOLYGON (((" + ", ".join(f"{cx} {cy}" for cx, cy in coords) + ")))"
+        stamp = begin.strftime("%Y%m%dT%H%M%S")
+        end = (begin + timedelta(seconds=25)).strftime("%Y%m%dT%H%M%S")
+        identifier = f"{sat}_IW_GRDH_1SDV_{stamp}_{end}_{30000 + i:06d}_{datatake:06X}_{i % 0xFFFF:04X}"
+        products[uuid] = {
+            "title": identifier,
+            "link": f"odata/v1/Products('{uuid}')/$value",
+            "link_alternative": f"odata/v1/Products('{uuid}')/",
+            "link_icon": f"odata/v1/Products('{uuid}')/Products('Quicklook')/$value",
+            "summary": identifier,
+            "ingestiondate": begin + timedelta(hours=3),
+            "beginposition": begin,
+            "endposition": begin + timedelta(seconds=25),
+            "missiondatatakeid": datatake,
+            "orbitnumber": 30000 + i,
+            "lastorbitnumber": 30000 + i,
+            "relativeorbitnumber": rnd.randrange(1, 176),
+            "lastrelativeorbitnumber": rnd.randrange(1, 176),
+            "sensoroperationalmode": "IW",
+            "swathidentifier": "IW",
+            "orbitdirection": rnd.choice(["ASCENDING", "DESCENDING"]),
+            "producttype": "GRD",
+            "timeliness": "Fast-24h",
+            "platformname": "Sentinel-1",
+            "platformidentifier": "2014-016A" if sat == "S1A" else "2016-025A",
+            "instrumentname": "Synthetic Aperture Radar (C-band)",
+            "instrumentshortname": "SAR-C SAR",
+            "filename": f"{identifier}.SAFE",
+            "format": "SAFE",
+            "productclass": "S",
+            "polarisationmode": "VV VH",
+            "acquisitiontype": "NOMINAL",
+            "status": "ARCHIVED",
+            "size": "1.63 GB",
+            "gmlfootprint": "",
+            "footprint": footprint,
+            "identifier": identifier,
+            "uuid": uuid,
+        }
+    return products
+
+
+def generate_catalog(products: dict, online_ratio: float = 0.5, seed: int = 0,
+                     content_length: int = 1024 ** 2) -> dict:
+    """
+    Generates the OData side of the given products.
+    :param products: dict. Products, as returned by generate_products.
+    :param online_ratio: float, optional. Ratio of products that are online. Defaults to 0.5.
+    :param seed: int, optional. Random seed. Defaults to 0.
+    :param content_length: int, optional. Size of the products' zip files, in bytes. Defaults to 1 MiB.
+    :return: dict with the format { uuid: odata_entry }.
+    """
+    rnd = random.Random(seed)
+    return {uuid: {"Id": uuid, "Name": p["identifier"], "Online": rnd.random() < online_ratio,
+                   "ContentLength": str(content_length)}
+            for uuid, p in products.items()}
+
+
+def payload(uuid: str, size: int) -> bytes:
+    """
+    Generates the contents of a product's zip file.
+    :param uuid: str. Product uuid, used as random seed.
+    :param size: int. Size in bytes.
+    :return: bytes.
+    """
+    return random.Random(uuid).getrandbits(8 * size).to_bytes(size, "little") if size else b""
+
+
+class MockHubHandler(BaseHTTPRequestHandler):
+    """Request handler that mimics the subset of the DHuS API used by the Downloader."""
+
+    catalog = {}
+    products = {}
+    latency = 0.0  # Seconds to wait before answering, to mimic the hub's response time
+    hits = None  # Counter of the requests received per path
+    bandwidth = 0  # Bytes per second sent per connection, to mimic the hub's throttling. 0 means unlimited
+    payloads = None  # Contents of the products' zip files, generated upon first request
+    max_connections = 0  # Products served at the same time before answering 503, to mimic the per-user limit
+    connections = None  # Products being served and their lock
+    throttle_every = 0  # Every nth metadata request is answered with 429, to mimic the hub's rate limit. 0 means never
+    matches = None  # Products matching each query string, since every page of a query matches the same products
+
+    def log_message(self, fmt, *args):
+        """Silences the request logging."""
+        pass
+
+    def do_GET(self):
+        """Dispatches GET requests."""
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.hits[url.path] += 1
+
+        product = re.search(r"odata/v1/Products\('([\w-]+)'\)(/\$value|/Products\('Quicklook'\)/\$value)?/?$",
+                            unquote(url.path))
+        if product and product.group(1) not in self.catalog:
+            self.send_error(404)
+        elif product and product.group(2) and "Quicklook" in product.group(2):
+            self.quicklook(product.group(1))
+        elif product and product.group(2):
+            self.value(product.group(1))
+        elif (product or url.path.rstrip("/").endswith("odata/v1/Products")) and self.throttled():
+            self.send_error(429)
+        elif product:
+            self.odata_product(product.group(1))
+        elif url.path.rstrip("/").endswith("odata/v1/Products"):
+            self.odata_products(params)
+        elif url.path.rstrip("/").endswith("search"):
+            self.search(params)
+        else:
+            self.send_error(404)
+
+    def throttled(self) -> bool:
+        """Counts a metadata request and tells whether it has to be answered with 429."""
+        with self.connections["lock"]:
+            self.connections["metadata"] += 1
+            return bool(self.throttle_every) and self.connections["metadata"] % self.throttle_every == 0
+
+    def odata_products(self, params: dict):
+        """Answers OData queries that filter products by Id."""
+        ids = re.findall(r"Id eq '([\w-]+)'", params.get("$filter", [""])[0])
+        results = [self.catalog[i] for i in ids if i in self.catalog]
+        self.send_json({"d": {"results": results}})
+
+    def odata_product(self, uuid: str):
+        """Answers OData queries of a single product's metadata."""
+        entry = self.catalog[uuid]
+        date = "/Date(1577836800000)/"
+        self.send_json({"d": {**entry, "ContentLength": entry.get("ContentLength", "0"),
+                              "Checksum": {"Algorithm": "MD5", "Value": hashlib.md5(self.payload(uuid)).hexdigest()},
+                              "ContentDate": {"Start": date, "End": date}, "CreationDate": date,
+                              "IngestionDate": date, "ContentGeometry": None, "Attributes": {},
+                              "__metadata": {"media_src": f"http://{self.headers['Host']}/odata/v1/Products('{uuid}')"
+                                                         f"/$value"}}})
+
+    def quicklook(self, uuid: str):
+        """Sends a product's quicklook, a few KiB of bytes standing in for a JPEG image."""
+        body = b"\xff\xd8\xff" + payload(uuid, 16 * 1024)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def value(self, uuid: str):
+        """Sends a product's zip file, honouring range requests."""
+        if not self.catalog[uuid].get("Online", True):
+            self.send_error(503)
+            return
+
+        with self.connections["lock"]:
+            if self.max_connections and self.connections["active"] >= self.max_connections:
+                self.send_error(503)
+                return
+            self.connections["active"] += 1
+        try:
+            self.send_value(uuid)
+        finally:
+            with self.connections["lock"]:
+                self.connections["active"] -= 1
+
+    def send_value(self, uuid: str):
+        """Sends the requested range of a product's zip file."""
+        body = self.payload(uuid)
+        start, end = 0, len(body) - 1
+        byte_range = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if byte_range:
+            start = int(byte_range.group(1))
+            end = min(int(byte_range.group(2)), end) if byte_range.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        block = 64 * 1024
+        try:
+            for offset in range(start, end + 1, block):
+                self.wfile.write(body[offset:min(offset + block, end + 1)])
+                if self.bandwidth:
+                    threading.Event().wait(block / self.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):  # The client closed the connection
+            pass
+
+    def payload(self, uuid: str) -> bytes:
+        """Returns the contents of a product's zip file."""
+        if uuid not in self.payloads:
+            self.payloads[uuid] = payload(uuid, int(self.catalog[uuid].get("ContentLength", "0")))
+        return self.payloads[uuid]
+
+    def search(self, params: dict):
+        """Answers OpenSearch queries. Only the keywords sent by the Downloader are understood."""
+        query = params.get("q", [""])[0]
+        rows = int(params.get("rows", ["100"])[0])
+        start = int(params.get("start", ["0"])[0])
+
+        key = (query, len(self.products))  # Products may be added while serving, to mimic new ingestions
+        if key not in self.matches:
+            self.matches[key] = [p for p in self.products.values() if matches_query(p, query)]
+        matches = self.matches[key]
+        if params.get("orderby", [""])[0].startswith("beginposition desc"):
+            matches = matches[::-1]
+
+        entries = [to_opensearch_entry(p) for p in matches[start:start + rows]]
+        self.send_json({"feed": {"opensearch:totalResults": str(len(matches)), "entry": entries}})
+
+    def send_json(self, obj):
+        """Sends a JSON response."""
+        body = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def matches_query(product: dict, query: str) -> bool:
+    """
+    Checks whether a product matches an OpenSearch query.
+    :param product: dict. Product properties.
+    :param query: str. Query string, as formatted by SentinelAPI.format_query.
+    :return: bool.
+    """
+    import shapely.wkt
+
+    for attr, lower, upper in re.findall(r'(\w+):\[(\S+) TO (\S+)\]', query):
+        value = product[attr.lower()]
+        value = value.strftime("%Y-%m-%dT%H:%M:%SZ") if isinstance(value, datetime) else value
+        lower, upper = lower.strip('"'), upper.strip('"')
+        if (lower != "*" and str(value) < lower) or (upper not in ("*", "NOW") and str(value) > upper):
+            return False
+
+    for attr, value in re.findall(r'(\w+):"([^"(]+)"', query):
+        if str(product[attr.lower()]) != value:
+            return False
+
+    for attr, value in re.findall(r'(\w+):(\d+)(?:\s|$)', query):
+        if str(product[attr.lower()]) != value:
+            return False
+
+    area = re.search(r'footprint:"(\w+)\((.*)\)"', query)
+    if area:
+        relation, aoi = area.group(1).lower(), shapely.wkt.loads(area.group(2))
+        footprint = shapely.wkt.loads(product["footprint"])
+        if relation == "intersects" and not footprint.intersects(aoi):
+            return False
+        if relation == "contains" and not footprint.contains(aoi):
+            return False
+        if relation == "iswithin" and not footprint.within(aoi):
+            return False
+
+    return True
+
+
+def to_opensearch_entry(product: dict) -> dict:
+    """
+    Formats a product as an entry of an OpenSearch JSON response.
+    :param product: dict. Product properties.
+    :return: dict.
+    """
+    entry = {"id": product["uuid"], "title": product["title"], "summary": product["summary"],
+             "link": [{"href": product["link"]}, {"rel": "alternative", "href": product["link_alternative"]},
+                      {"rel": "icon", "href": product["link_icon"]}],
+             "date": [], "int": [], "str": []}
+    for key, value in product.items():
+        if key in entry or key.startswith("link"):
+            continue
+        if isinstance(value, datetime):
+            entry["date"].append({"name": key, "content": value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")})
+        elif isinstance(value, int):
+            entry["int"].append({"name": key, "content": str(value)})
+        else:
+            entry["str"].append({"name": key, "content": value})
+    return entry
+
+
+def serve(catalog: dict, products: dict = None, port: int = 0, latency: float = 0.0, bandwidth: int = 0,
+          max_connections: int = 0, throttle_every: int = 0):
+    """
+    Launches the stand-in hub on a background thread.
+    :param catalog: dict. Product catalog, as returned by generate_catalog.
+    :param products: dict, optional. Products to search in, as returned by generate_products. Defaults to None.
+    :param port: int, optional. Port to listen on. Defaults to 0, which picks a free one.
+    :param latency: float, optional. Seconds to wait before each response. Defaults to 0.
+    :param bandwidth: int, optional. Bytes per second sent per connection when serving products. Defaults to 0, which
+        means unlimited.
+    :param max_connections: int, optional. Products served at the same time, further requests are answered with 503.
+        Defaults to 0, which means unlimited.
+    :param throttle_every: int, optional. Every nth OData metadata request, either of a single product or of a batch,
+        is answered with 429. Defaults to 0, which means never.
+    :return: The running server and its base URL. The requests received are counted in server.RequestHandlerClass.hits.
+    """
+    handler = type("Handler", (MockHubHandler,), {"catalog": catalog, "products": products or {}, "latency": latency,
+                                                  "hits": Counter(), "matches": {}, "bandwidth": bandwidth,
+                                                  "payloads": {}, "max_connections": max_connections,
+                                                  "throttle_every": throttle_every,
+                                                  "connections": {"active": 0, "metadata": 0,
+                                                                  "lock": threading.Lock()}})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
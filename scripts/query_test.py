@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from model import Downloader
+from mock_hub import generate_products, serve
+
+
+def main():
+    products = generate_products(2000)
+    server, url = serve({}, products, latency=0.2)
+
+    api = Downloader("user", "password", url)
+    api.query_cache = None
+    api.show_progressbars = False
+
+    times = {}
+    res = {}
+    for workers in (1, 2, 4, 8):
+        api.query_workers = workers
+        api.concurrent_dl_limit = workers  # Hub requests are also bounded by the download limit
+
+        start = datetime.now()
+        res[workers] = api.query(None, "20200101", "20201231")  # No AoI, so the stand-in hub answers quickly
+        end = datetime.now()
+        times[workers] = end - start
+        print(f"{workers} workers ({len(res[workers])} products): {times[workers]} "
+              f"(x{times[1] / times[workers]:.1f})")
+
+        assert list(res[workers]) == list(res[1])  # Same products in the same order
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
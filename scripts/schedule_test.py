@@ -0,0 +1,51 @@
+import tempfile
+from datetime import datetime
+
+from model import Downloader
+from mock_hub import generate_catalog, generate_products, serve
+
+
+def main():
+    products = generate_products(12)
+    catalog = generate_catalog(products, online_ratio=1.0, content_length=4 * 1024 ** 2)
+    # The hub allows 3 connections per user, but the client is told 8
+    server, url = serve(catalog, bandwidth=2 * 1024 ** 2, max_connections=3)
+
+    api = Downloader("user", "password", url, show_progressbars=False)
+    api.concurrent_dl_limit = 8
+
+    # Latest acquisitions first
+    priority = {uuid: -p["beginposition"].timestamp() for uuid, p in products.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = datetime.now()
+        res = api.download_all(catalog.keys(), tmp, priority=priority)
+        end = datetime.now()
+
+    print(f"Downloaded {len(res.downloaded)} products, {len(res.failed)} failed: {end - start}")
+    print(f"Final concurrency: {api.dl_limit_semaphore.limit:.1f} of {api.concurrent_dl_limit}")
+    print(f"Requests: {sum(server.RequestHandlerClass.hits.values())}")
+
+    assert not res.failed
+    server.shutdown()
+
+    # Every third metadata request is throttled, so products are retried before their download starts
+    server, url = serve(catalog, throttle_every=3)
+    api = Downloader("user", "password", url, show_progressbars=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = datetime.now()
+        res = api.download_all(catalog.keys(), tmp)
+        end = datetime.now()
+
+    hits = server.RequestHandlerClass.hits
+    print(f"Throttled metadata: downloaded {len(res.downloaded)} products, {len(res.failed)} failed: {end - start}")
+    print(f"Metadata requests: {sum(n for path, n in hits.items() if not path.endswith('$value'))}")
+    print(f"Final concurrency: {api.dl_limit_semaphore.limit:.1f} of {api.concurrent_dl_limit}")
+
+    assert not res.failed
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
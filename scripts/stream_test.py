@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pandas as pd
+
+from model import Downloader
+from mock_hub import generate_catalog, generate_products, serve
+
+AOI = "POLYGON ((-7 35, -4 35, -4 37, -7 37, -7 35))"
+
+
+def main():
+    products = generate_products(3000)
+    server, url = serve(generate_catalog(products), products, latency=0.2)
+
+    api = Downloader("user", "password", url)
+    api.query_cache = None
+    api.show_progressbars = False
+
+    for same_datatake in (False, True):
+        api.availability.invalidate()
+        start = datetime.now()
+        res = api.query(AOI, "20200101", "20201231")
+        blocking = api.filter_by_aoi_pct(res, AOI, 30, same_datatake=same_datatake)
+        end = datetime.now()
+        print(f"Blocking ({len(blocking)} products): {end - start}")
+
+        api.availability.invalidate()
+        start = datetime.now()
+        first = None
+        frames = []
+        for frame in api.filter_pages(api.query_pages(AOI, "20200101", "20201231"), AOI, 30,
+                                      same_datatake=same_datatake):
+            if first is None:
+                first = datetime.now() - start
+            frames.append(frame)
+        end = datetime.now()
+        streamed = pd.concat(frames)
+        print(f"Streamed ({len(streamed)} products): first page after {first}, all after {end - start}")
+
+        # Same products, with the same coverage and access
+        streamed = streamed.loc[blocking.index]
+        assert streamed.index.is_unique and len(streamed) == len(blocking)
+        assert (streamed["aoicoverage"] == blocking["aoicoverage"]).all()
+        assert (streamed["access"].astype(str) == blocking["access"].astype(str)).all()
+
+    # Closing the stream early drops the pages that were not requested yet
+    pages = api.query_pages(AOI, "20200101", "20201231")
+    next(pages)
+    pages.close()
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
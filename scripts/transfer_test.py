@@ -0,0 +1,68 @@
+import hashlib
+import os.path
+import tempfile
+from datetime import datetime
+
+from model import Downloader
+from model.transfer import RangeDownloader
+from mock_hub import generate_catalog, generate_products, payload, serve
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(n_bytes):
+    received = [0]
+
+    def progress(n):
+        received[0] += n
+        if received[0] >= n_bytes:
+            raise Interrupted()
+
+    return progress
+
+
+def main():
+    size = 16 * 1024 ** 2
+    catalog = generate_catalog(generate_products(6), online_ratio=1.0, content_length=size)
+    server, url = serve(catalog, bandwidth=4 * 1024 ** 2)  # 4 MiB/s per connection
+
+    uuid = next(iter(catalog))
+    product_url = f"{url}odata/v1/Products('{uuid}')/$value"
+    md5 = hashlib.md5(payload(uuid, size)).hexdigest()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Single product, one stream against several range requests
+        for segments in (1, 4):
+            path = os.path.join(tmp, f"{segments}.zip")
+            stats = RangeDownloader(segment_size=4 * 1024 ** 2, max_segments=segments).download(product_url, path,
+                                                                                                md5=md5)
+            print(f"{segments} segments: {stats['seconds']:.2f} s, {stats['throughput'] / 1024 ** 2:.1f} MiB/s")
+
+        # Interrupted download, resumed afterwards
+        path = os.path.join(tmp, "resumed.zip")
+        transfer = RangeDownloader(segment_size=1024 ** 2, max_segments=4)
+        try:
+            transfer.download(product_url, path, size, md5, progress=interrupt_after(size // 2))
+        except Interrupted:
+            pass
+        stats = transfer.download(product_url, path, size, md5)
+        print(f"Resumed: {stats['downloaded_bytes'] / 1024 ** 2:.1f} of {size / 1024 ** 2:.0f} MiB downloaded again")
+        assert hashlib.md5(open(path, "rb").read()).hexdigest() == md5
+        assert not os.path.exists(path + ".incomplete") and not os.path.exists(path + ".parts")
+
+        # Whole batch through Downloader.download_all
+        api = Downloader("user", "password", url, show_progressbars=False)
+        start = datetime.now()
+        res = api.download_all(catalog.keys(), tmp)
+        end = datetime.now()
+        print(f"Batch ({len(res.downloaded)} products, {len(res.failed)} failed): {end - start}")
+        for info in res.downloaded.values():
+            print(f"  {info['title']}: {info['throughput'] / 1024 ** 2:.1f} MiB/s")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
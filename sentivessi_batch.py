@@ -0,0 +1,377 @@
+"""Headless command line interface to search, download and process products without the GUI."""
+import argparse as ap
+import json
+import os.path
+import sys
+
+# Nothing heavy is imported here: each command imports what it needs, so that the help and the commands that do not
+# process products start quickly, and Qt is never imported.
+
+
+def add_login_args(parser: ap.ArgumentParser) -> None:
+    """
+    Adds the login arguments, the same as OAHretriever.py.
+    :param parser: ArgumentParser. Parser of the command.
+    :return: None.
+    """
+    parser.add_argument("-u", "--username", type=str, default="", help="Username to login to Open Access Hub.")
+    parser.add_argument("-p", "--password", type=str, default="", help="Password to login to Open Access Hub.")
+    parser.add_argument("--url", type=str, default="", help="API URL to use. Defaults to SentinelAPI's.")
+    parser.add_argument("-f", "--file", type=str, default="",
+                        help="Config .ini file with the credentials, mutually exclusive to -u, -p and --url.")
+
+
+def login(parser: ap.ArgumentParser, args):
+    """
+    Creates a Downloader from the login arguments and checks its credentials.
+    :param parser: ArgumentParser. Parser of the command, to report errors.
+    :param args: Namespace. Parsed arguments.
+    :return: Downloader.
+    """
+    from model.downloader import Downloader
+
+    if not (bool(args.username and args.password and not args.file) != bool(
+            args.file and not (args.username or args.password or args.url))):
+        parser.error("Args -u, -p and --url are mutually exclusive to -f. The correct usage is: "
+                     "( -u username -p password [ --url url ] | -f file )")
+
+    if args.file:
+        api = Downloader.from_file(args.file)
+    elif args.url:
+        api = Downloader(args.username, args.password, args.url)
+    else:
+        api = Downloader(args.username, args.password)
+
+    if not api.check_creds():
+        parser.error("The credentials or the url you have passed are incorrect. Please check again.")
+
+    return api
+
+
+def query(parser: ap.ArgumentParser, args) -> int:
+    """
+    Searches products and saves those that cover enough of the AoI to a CSV file, as the GUI does.
+    :param parser: ArgumentParser. Parser of the command.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code.
+    """
+    import utils
+
+    params = {
+        "start": args.start, "end": args.end, "platform": args.platform, "prod_type": args.product_type,
+        "orb_dir": args.orbit_direction, "rel_orbit": args.relative_orbit, "aoi": args.aoi, "aoi_pct": args.aoi_pct,
+        "same_datatake": args.same_datatake
+    }
+    overridden = []
+    if args.query:  # Saved from the GUI. Arguments given explicitly take precedence
+        with open(args.query) as f:
+            saved = json.load(f)
+        defaults = {k: parser.get_default(k) for k in vars(args)}
+        names = {"prod_type": "product_type", "orb_dir": "orbit_direction", "rel_orbit": "relative_orbit"}
+        for key, value in saved.items():
+            if key not in params:
+                continue
+            if getattr(args, names.get(key, key)) == defaults.get(names.get(key, key)):
+                params[key] = value
+            elif params[key] != value:
+                overridden.append("--" + names.get(key, key).replace("_", "-"))
+
+    if not params["aoi"] or not utils.test_wkt(params["aoi"]):
+        parser.error("A valid AoI WKT string must be given, with --aoi or --query.")
+    if not params["start"] or not params["end"]:
+        parser.error("The start and end dates must be given, with --start and --end or --query.")
+
+    if args.watch and not args.query:
+        parser.error("--watch needs the query JSON file given with --query.")
+    if args.watch and overridden:  # The watermark and the products found so far belong to the saved query
+        parser.error(f"--watch runs the saved query as it is, so it cannot be combined with {', '.join(overridden)}.")
+
+    api = login(parser, args)
+
+    if args.watch:
+        return watch(api, args)
+
+    res = api.query(params["aoi"], params["start"], params["end"], platformname=params["platform"],
+                    producttype=params["prod_type"],
+                    relative_orbit=int(params["rel_orbit"]) if params["rel_orbit"] else None,
+                    area_relation="Contains" if params["aoi_pct"] == 100 else "Intersects",
+                    orbitdirection=None if params["orb_dir"] == "Both" else params["orb_dir"])
+    results = api.filter_by_aoi_pct(res, params["aoi"], params["aoi_pct"], same_datatake=params["same_datatake"])
+
+    path = args.output or f"query_{utils.formatted_ts()}.csv"
+    results.to_csv(path, sep=";", decimal=",")
+    print(f"{len(results)} of {len(res)} products cover {params['aoi_pct']}% of the AoI. Saved to {path}.")
+    return 0
+
+
+def watch(api, args) -> int:
+    """
+    Runs a saved query again, only fetching the products ingested since its last run, and saves the new ones that
+    cover enough of the AoI to a CSV file. The AoI and its coverage settings are those of the saved query, the same
+    that are sent to the hub. It is repeated every --interval minutes, if given.
+    :param api: Downloader. Logged in downloader.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code.
+    """
+    import time
+
+    import utils
+    from model.watch import WatchedQuery
+
+    watched = WatchedQuery.from_file(args.query)
+    aoi_pct = watched.values.get("aoi_pct", 0)
+    while True:
+        res = api.query_new(watched)
+        if res:
+            results = api.filter_by_aoi_pct(res, watched.values["aoi"], aoi_pct,
+                                            same_datatake=watched.values.get("same_datatake", False))
+            path = args.output or f"query_{utils.formatted_ts()}.csv"
+            results.to_csv(path, sep=";", decimal=",")
+            print(f"{len(results)} of {len(res)} new products cover {aoi_pct}% of the AoI. Saved to {path}.")
+        else:
+            print(f"No new products since {watched.watermark}.")
+
+        if not args.interval:
+            return 0
+        time.sleep(args.interval * 60)
+
+
+def download(parser: ap.ArgumentParser, args) -> int:
+    """
+    Downloads the products listed in a file, as OAHretriever.py does.
+    :param parser: ArgumentParser. Parser of the command.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code, 1 if any product failed.
+    """
+    _, ext = os.path.splitext(args.input_file)
+    methods = {".csv": "download_from_csv", ".json": "download_from_json", ".meta4": "download_from_meta4"}
+    if ext.lower() not in methods:
+        parser.error(f"Unrecognized input file format: '{ext}'.")
+
+    api = login(parser, args)
+    os.makedirs(args.output_dirpath, exist_ok=True)
+    res = getattr(api, methods[ext.lower()])(args.input_file, args.output_dirpath, args.quicklooks)
+
+    print(f"{len(res.downloaded)} products downloaded, {len(res.retrieval_triggered)} offline products requested and "
+          f"{len(res.failed)} failed.")
+    return 1 if res.failed else 0
+
+
+def print_job(job, total: int) -> None:
+    """
+    Prints the progress of a job.
+    :param job: DetectionJob.
+    :param total: int. Number of jobs.
+    :return: None.
+    """
+    step = f" ({job.step})" if job.step else ""
+    print(f"[{job.id}/{total}] {job.description}: {job.status}{step} {job.elapsed:.0f} s")
+    if job.error:
+        print(job.error, file=sys.stderr)
+
+
+def product_cache(args):
+    """
+    :param args: Namespace. Parsed arguments of a processing command.
+    :return: ProductCache of the intermediate products, or None if disabled.
+    """
+    if args.no_cache:
+        return None
+
+    from model.product_cache import ProductCache
+    return ProductCache(max_bytes=int(args.cache_size * 1024 ** 3))
+
+
+def vessels(parser: ap.ArgumentParser, args) -> int:
+    """
+    Detects vessels in the given products, each in a worker process of its own.
+    :param parser: ArgumentParser. Parser of the command.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code, 1 if any product failed.
+    """
+    from model.detection_queue import DONE
+    from model.detectors.vessel_detector import VesselDetector
+
+    detector = VesselDetector(subset=args.subset, out_dir=args.output_dir, steps=args.steps, verbose=False,
+                              backend=args.backend, gpt_threads=args.gpt_threads, gpt_cache=args.gpt_cache,
+                              tgt_window=args.tgt_window, guard_wd_size=args.guard_window, bg_wd_size=args.bg_window,
+                              pfa=args.pfa, min_tgt=args.min_tgt, max_tgt=args.max_tgt,
+                              polarisations=args.polarizations, cache=product_cache(args))
+
+    queue = detector.batch_queue(args.jobs, args.jvm_memory, args.gpf_threads)
+    for path in args.products:
+        queue.submit(detector.detect_product, path, description=os.path.basename(path))
+
+    ok = queue.join(callback=lambda job: print_job(job, len(queue.jobs)))
+    done = [x.result for x in queue.jobs.values() if x.status == DONE and x.result is not None]
+    summary = detector.save_summary(done)
+    print(f"{int(summary['n_detects'].sum())} vessels detected in {len(done)} products.")
+    return 0 if ok else 1
+
+
+def changes(parser: ap.ArgumentParser, args) -> int:
+    """
+    Creates the RGB change compositions of the given products against a reference product, and between consecutive
+    products if sequential, as the GUI does.
+    :param parser: ArgumentParser. Parser of the command.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code, 1 if any composition failed.
+    """
+    from model.detectors.change_detector import ChangeDetector, RGBChannel
+
+    detector = ChangeDetector(subset=args.subset, ref_prod=args.reference, rgb_pol=args.polarization,
+                              ref_chnl=RGBChannel[args.channel.upper()], sequential=args.sequential,
+                              out_dir=args.output_dir, steps=args.steps, verbose=False, backend=args.backend,
+                              gpt_threads=args.gpt_threads, gpt_cache=args.gpt_cache, cache=product_cache(args))
+    products = ChangeDetector.order_by_name(*args.products)["abspath"].tolist()
+
+    queue = detector.batch_queue(args.jobs, args.jvm_memory, args.gpf_threads)
+    detector.submit_jobs(queue, *products)
+
+    return 0 if queue.join(callback=lambda job: print_job(job, len(queue.jobs))) else 1
+
+
+def daemon(parser: ap.ArgumentParser, args) -> int:
+    """
+    Runs the processing daemon, or asks a running one for its status or to stop.
+    :param parser: ArgumentParser. Parser of the command.
+    :param args: Namespace. Parsed arguments.
+    :return: int. Exit code.
+    """
+    from model.processing_daemon import DaemonClient, ProcessingDaemon
+
+    address = (args.host, args.port)
+    if args.status or args.stop:
+        try:
+            client = DaemonClient(address)
+        except OSError:
+            print(f"No daemon is listening on {args.host}:{args.port}.", file=sys.stderr)
+            return 1
+        with client:
+            print(client.ping())
+            if args.stop:
+                client.shutdown()
+        return 0
+
+    print(f"Listening on {args.host}:{args.port} with {args.workers} workers.")
+    try:
+        ProcessingDaemon(address, workers=args.workers, max_jobs=args.max_jobs).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser() -> ap.ArgumentParser:
+    """
+    :return: ArgumentParser. Parser of the command line interface.
+    """
+    parser = ap.ArgumentParser(description="Searches, downloads and processes Sentinel-1 products without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Query
+    cmd = commands.add_parser("query", help="Search products and save them to a CSV file.")
+    add_login_args(cmd)
+    cmd.add_argument("-q", "--query", type=str, default="",
+                     help="Query JSON file saved from the GUI. Other arguments given take precedence.")
+    cmd.add_argument("--aoi", type=str, default="", help="AoI WKT string.")
+    cmd.add_argument("--start", type=str, default="", help="Start date, YYYYMMDD.")
+    cmd.add_argument("--end", type=str, default="", help="End date, YYYYMMDD.")
+    cmd.add_argument("--platform", type=str, default="Sentinel-1", help="Platform name. Defaults to Sentinel-1.")
+    cmd.add_argument("--product-type", type=str, default="GRD", help="Product type. Defaults to GRD.")
+    cmd.add_argument("--orbit-direction", type=str, default="Both", choices=["Both", "Ascending", "Descending"],
+                     help="Orbit direction. Defaults to both.")
+    cmd.add_argument("--relative-orbit", type=str, default="", help="Relative orbit number.")
+    cmd.add_argument("--aoi-pct", type=int, default=0, help="Minimal AoI coverage, in percent. Defaults to 0.")
+    cmd.add_argument("--same-datatake", action="store_true",
+                     help="If specified, the AoI coverage of products of the same datatake is added up.")
+    cmd.add_argument("-o", "--output", type=str, default="", help="Output CSV path. Defaults to query_<timestamp>.csv.")
+    cmd.add_argument("--watch", action="store_true",
+                     help="If specified, only the products ingested since the last watch of the --query file are "
+                          "fetched. The file keeps track of the products found so far, and its values cannot be "
+                          "overridden.")
+    cmd.add_argument("--interval", type=float, default=0,
+                     help="Minutes between watches, with --watch. Defaults to 0, watch once.")
+    cmd.set_defaults(func=query, parser=cmd)
+
+    # Download
+    cmd = commands.add_parser("download", help="Download the products listed in a CSV, JSON or .meta4 file.")
+    add_login_args(cmd)
+    cmd.add_argument("-i", "--input_file", type=str, required=True,
+                     help="Product list. CSV files must use ';' and ',' as separator and decimal symbol.")
+    cmd.add_argument("-o", "--output_dirpath", type=str, default=".", help="Output directory.")
+    cmd.add_argument("--quicklooks", action="store_true", help="If specified, quicklooks will be downloaded too.")
+    cmd.set_defaults(func=download, parser=cmd)
+
+    # Processing options shared by both detectors
+    processing = ap.ArgumentParser(add_help=False)
+    processing.add_argument("-o", "--output-dir", type=str, required=True, help="Output directory.")
+    processing.add_argument("--subset", type=str, default="", help="Subset WKT string. Defaults to no subset.")
+    processing.add_argument("--steps", action="store_true", help="If specified, intermediary products are saved.")
+    processing.add_argument("-j", "--jobs", type=int, default=1,
+                            help="Products processed at the same time, each with a JVM of its own. Defaults to 1.")
+    processing.add_argument("--jvm-memory", type=str, default="",
+                            help="Maximal heap of each JVM, e.g. 8G. Defaults to snappy's configuration.")
+    processing.add_argument("--gpf-threads", type=int, default=0,
+                            help="GPF parallelism of each JVM. Defaults to the cores split among the jobs.")
+    processing.add_argument("--backend", type=str, default="snappy", choices=["snappy", "gpt"],
+                            help="Run the processing chains with snappy, in the worker processes, or as SNAP graphs "
+                                 "with gpt. Defaults to snappy.")
+    processing.add_argument("--gpt-threads", type=int, default=0, help="gpt parallelism (-q). Defaults to gpt's.")
+    processing.add_argument("--gpt-cache", type=str, default="", help="gpt tile cache size (-c), e.g. 4G. Defaults "
+                                                                      "to gpt's.")
+    processing.add_argument("--no-cache", action="store_true",
+                            help="If specified, intermediate products are neither read from nor stored in the cache.")
+    processing.add_argument("--cache-size", type=float, default=20.0,
+                            help="Maximal size of the intermediate product cache, in GiB. Defaults to 20.")
+
+    # Vessel detection
+    cmd = commands.add_parser("vessels", parents=[processing], help="Detect vessels in products.")
+    cmd.add_argument("products", nargs="+", help="Paths to the products.")
+    cmd.add_argument("--tgt-window", type=float, default=30.0, help="Target window size, in m. Defaults to 30.")
+    cmd.add_argument("--guard-window", type=float, default=500.0, help="Guard window size, in m. Defaults to 500.")
+    cmd.add_argument("--bg-window", type=float, default=800.0, help="Background window size, in m. Defaults to 800.")
+    cmd.add_argument("--pfa", type=float, default=12.5, help="Probability of false alarm. Defaults to 12.5.")
+    cmd.add_argument("--min-tgt", type=float, default=30.0, help="Minimal target size, in m. Defaults to 30.")
+    cmd.add_argument("--max-tgt", type=float, default=50.0, help="Maximal target size, in m. Defaults to 50.")
+    cmd.add_argument("--polarizations", type=str, default="",
+                     help="Comma separated polarizations to detect on, e.g. VH. Defaults to all of them.")
+    cmd.set_defaults(func=vessels, parser=cmd)
+
+    # Change detection
+    cmd = commands.add_parser("changes", parents=[processing], help="Create RGB change detection compositions.")
+    cmd.add_argument("reference", help="Path to the reference product.")
+    cmd.add_argument("products", nargs="+", help="Paths to the products to compare with the reference.")
+    cmd.add_argument("--sequential", action="store_true",
+                     help="If specified, consecutive products are compared with each other too.")
+    cmd.add_argument("--polarization", type=str, default="VH", choices=["VV", "VH"], help="Defaults to VH.")
+    cmd.add_argument("--channel", type=str, default="red", choices=["red", "green", "blue"],
+                     help="RGB channel of the reference product. Defaults to red.")
+    cmd.set_defaults(func=changes, parser=cmd)
+
+    # Processing daemon
+    cmd = commands.add_parser("daemon", help="Run a daemon that keeps warm SNAP JVMs to process jobs on.")
+    cmd.add_argument("--host", type=str, default="localhost", help="Host to listen on. Defaults to localhost.")
+    cmd.add_argument("--port", type=int, default=6070, help="Port to listen on. Defaults to 6070.")
+    cmd.add_argument("-w", "--workers", type=int, default=1, help="Worker processes, each with a JVM. Defaults to 1.")
+    cmd.add_argument("--max-jobs", type=int, default=0,
+                     help="Jobs after which a worker is replaced, to release memory. Defaults to 0, never.")
+    cmd.add_argument("--status", action="store_true", help="If specified, prints the status of the running daemon.")
+    cmd.add_argument("--stop", action="store_true", help="If specified, stops the running daemon.")
+    cmd.set_defaults(func=daemon, parser=cmd)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    """
+    Runs the command given in the command line.
+    :param argv: list, optional. Arguments. Defaults to sys.argv.
+    :return: int. Exit code.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    return args.func(args.parser, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
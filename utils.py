@@ -1,5 +1,6 @@
 """Module for generic utility functions."""
 import datetime as dt
+import math
 import os
 import os.path
 
@@ -107,3 +108,62 @@ def test_wkt(aoi: str):
         return None
     else:
         return aoi
+
+
+def pad_wkt(aoi: str, meters: float) -> str:
+    """
+    Pads the bounding box of a WKT geometry in EPSG:4326.
+    :param aoi: str. The WKT string.
+    :param meters: float. Padding on each side, in meters.
+    :return: str. WKT polygon of the padded bounding box.
+    """
+    min_x, min_y, max_x, max_y = wkt.loads(aoi).bounds
+    pad_y = meters / 111320.0  # Meters per degree of latitude
+    pad_x = pad_y / max(math.cos(math.radians(max(abs(min_y), abs(max_y)))), 1e-6)
+
+    min_x, min_y, max_x, max_y = min_x - pad_x, max(min_y - pad_y, -90.0), max_x + pad_x, min(max_y + pad_y, 90.0)
+    return f"POLYGON(({min_x} {min_y}, {max_x} {min_y}, {max_x} {max_y}, {min_x} {max_y}, {min_x} {min_y}))"
+
+
+def cache_dir(*subdirs: str) -> str:
+    """
+    Returns the path to the app's persistent cache directory, creating it if needed. It belongs to the current user,
+    whatever the working directory, so that every process of the user shares it: %LOCALAPPDATA%\\SentiVessi on Windows,
+    $XDG_CACHE_HOME/sentivessi or ~/.cache/sentivessi elsewhere. The SENTIVESSI_CACHE environment variable overrides it.
+    :param subdirs: str. Optional subdirectories inside the cache directory.
+    :return: str. Path to the directory.
+    """
+    root = os.environ.get("SENTIVESSI_CACHE")
+    if not root and os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        root = os.path.join(os.environ["LOCALAPPDATA"], "SentiVessi")
+    elif not root:
+        root = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache"), "sentivessi")
+
+    path = os.path.join(os.path.abspath(os.path.expanduser(root)), *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported upon first attribute access, so that heavy modules, e.g. geopandas, or
+    those with side effects, e.g. snappy, which starts the JVM, are not imported by code paths that do not use them.
+    Annotations that refer to it must not be evaluated at definition time, e.g. by importing annotations from
+    __future__.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: str. Absolute name of the module.
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            import importlib
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (loaded)' if self._module is not None else ''}>"
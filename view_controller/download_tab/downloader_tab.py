@@ -1,42 +1,50 @@
 """Module dedicated to the download tab."""
-import io
 import json
 import os.path
-import shutil
-from itertools import compress
 
-import folium
+import numpy as np
 import pandas as pd
 from PyQt5 import QtWidgets, Qt
 from PyQt5.QtCore import QDate
 from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtWidgets import QSizePolicy, QTableView
-from folium import Map, GeoJson, LayerControl
+from PyQt5.QtWidgets import QProgressBar, QSizePolicy, QTableView
+from shapely.geometry import mapping
 
 import utils
 from model import Downloader
-from .results_table import ResultsModel
+from .jobs import DownloadJob, SearchJob
+from .map_bridge import MapBridge
+from .results_table import ResultsModel, ResultsProxyModel
 from ..utils import warning_dialog, information_dialog, save_json_path, open_json_path, yes_no_dialog, save_csv_path, \
     set_dir
+from ..workers import JobPool
 
 
 class DownloaderTab:
     """Class that manages the download UI and model."""
 
+    # Map styles
+    AOI_STYLE = {'fillOpacity': 0.3, 'weight': 2, 'fillColor': '#00FF00'}
+    RESULTS_STYLE = {'fillOpacity': 0.1, 'weight': 1, 'fillColor': '#ff0000', 'color': '#3388ff'}
+    SELECTED_STYLE = {'fillOpacity': 0.4, 'weight': 2, 'fillColor': '#ff0000', 'color': '#ff0000'}
+
     def __init__(self, main_window):
         self.main_window = main_window
         self.downloader: Downloader = None
         self.results = None
         self.model: ResultsModel = None
-        self.tmp_dir = ".tmp"
+        self.proxy: ResultsProxyModel = None
+        self.searches = JobPool()  # Searches and downloads are queued and run one after another
+        self.downloads = JobPool()
+        self.results_bounds = None  # (minx, miny, maxx, maxy) of the products shown in the map
 
-        # Initialize the map
-        self.map = None
-        self.clear_map()
+        # Initialize the map. Its page is loaded once and then changed through the bridge
         self.map_view = QWebEngineView()
         main_window.map_gb.layout().addWidget(self.map_view)
         self.map_view.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.MinimumExpanding)
-        self.update_map()
+        self.map = MapBridge(self.map_view)
+        self.selected_ids = []  # Products highlighted in the map
+        self.map_tolerance = 0.0  # Simplification tolerance of the footprints, in degrees, for the AoI's zoom level
 
         # Buttons
         main_window.dlr_aoi_load_btn.clicked.connect(self.load_aoi)
@@ -46,6 +54,13 @@ class DownloaderTab:
         main_window.clear_results_btn.clicked.connect(self.clear_table)
         main_window.load_q_btn.clicked.connect(self.load_query)
         main_window.save_q_btn.clicked.connect(self.save_query)
+        main_window.dlr_cancel_btn.clicked.connect(self.cancel)
+
+        # Progress of the running download
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        main_window.statusbar.addPermanentWidget(self.progress_bar)
 
     def load_query(self):
         """Loads query to the GUI.
@@ -123,13 +138,6 @@ class DownloaderTab:
         :return: WKT object or none.
         """
 
-        # AoI drawing style
-        aoi_style = lambda feature: {
-            'fillOpacity': 0.3,
-            'weight': 2,
-            'fillColor': '#00FF00'
-        }
-
         aoi = self.get_aoi()
         if not aoi:  # If aoi == "", then return.
             return
@@ -139,19 +147,27 @@ class DownloaderTab:
             warning_dialog("The Given AoI has an iinvalid format.")
             return
 
-        self.clear_map()  # Clears map
+        self.show_aoi(aoi)
 
-        gjson = folium.GeoJson(aoi, style_function=aoi_style, name="AOI")  # Creates AoI layer with the given style
-        gjson.add_to(self.map)  # Adds it to the map
+        return aoi
+
+    def show_aoi(self, aoi):
+        """
+        Clears the map and shows an AoI in it.
+        :param aoi: Shapely geometry. AoI.
+        :return: None.
+        """
+        self.map.clear()  # Clears map
+        self.selected_ids = []
 
-        self.map.location = list(aoi.centroid.coords)[0][::-1]  # Centers the map with the AoI centroid
-        self.map.fit_bounds(gjson.get_bounds())  # Sets the bounds so it's zoomed out and the whole figure appears.
-        self.update_map()  # Updates map
+        feature = {"type": "Feature", "properties": {"title": "AoI"}, "geometry": mapping(aoi)}
+        self.map.add_layer("aoi", json.dumps(feature), self.AOI_STYLE)
 
-        return aoi
+        self.map.fit_bounds(aoi.bounds)  # Sets the bounds so it's zoomed out and the whole figure appears.
+        self.map_tolerance = self.map.tolerance_for(aoi.bounds)
 
     def search(self):
-        """Launches the search with the given parameters
+        """Queues a search with the given parameters. Searches run one after another, off the GUI thread.
 
         :return: None.
         """
@@ -172,7 +188,8 @@ class DownloaderTab:
         same_datatake = self.get_same_datatake()
 
         # Parameters conversion
-        if not self.load_aoi():
+        if not aoi or not utils.test_wkt(aoi):
+            warning_dialog("The Given AoI has an iinvalid format.")
             return
 
         if rel_orbit:  # If there was an input
@@ -188,41 +205,81 @@ class DownloaderTab:
         else:
             area_relation = "Intersects"
 
-        results = self.downloader.query(aoi, start, end, relative_orbit=rel_orbit, platformname=platform,
-                                        area_relation=area_relation, producttype=prod_type, orbitdirection=orb_dir)
+        job = SearchJob(self.downloader, aoi, start, end, aoi_pct, same_datatake, relative_orbit=rel_orbit,
+                        platformname=platform, area_relation=area_relation, producttype=prod_type,
+                        orbitdirection=orb_dir)
+        job.signals.started.connect(lambda: self.search_started(job))
+        job.signals.result.connect(self.add_page)
+        job.signals.status.connect(self.search_status)
+        job.signals.failed.connect(lambda message: warning_dialog(f"Search failed: {message}"))
+        job.signals.finished.connect(lambda found: self.search_finished(job, found))
+        self.searches.submit(job)
 
-        results = self.downloader.filter_by_aoi_pct(results, aoi, aoi_pct, same_datatake=same_datatake)
-
-        self.results = results
-
-        if results.empty:
-            information_dialog("No results matched your query.")
-            return
+        if len(self.searches) > 1:
+            self.show_status(f"{job.description} queued after {len(self.searches) - 1} other searches.")
 
+    def search_started(self, job):
         """
-        Download quicklook temporarily
+        Clears the previous results when a search starts.
+        :param job: SearchJob. Search that has started.
+        :return: None.
         """
-        if not os.path.isdir(self.tmp_dir):
-            os.mkdir(self.tmp_dir)
+        self.clear_table()
+        self.results = None
+        self.results_bounds = None
+        self.show_aoi(utils.test_wkt(job.aoi))
+        self.show_status(f"{job.description}...")
 
-        quicklooks = [os.path.join(self.tmp_dir, x + '.jpeg') for x in results["identifier"]]
-        results["quicklooks"] = quicklooks
+    def add_page(self, page):
+        """
+        Shows a page of search results in the table and the map.
+        :param page: GeoDataFrame. Filtered products of the page.
+        :return: None.
+        """
+        self.results = page if self.results is None else pd.concat([self.results, page])
+        self.add_prods_to_table(page)
+        self.add_prods_to_map(page)
+        self.show_status(f"{len(self.results)} products found so far...")
 
-        exist = [not os.path.isfile(f) for f in quicklooks]
+    def search_status(self, item, status):
+        """
+        Shows a quicklook that has just been stored, or the access status of a product once it is known.
+        :param item: str. Path of the quicklook, or uuid of the product.
+        :param status: str. Status: quicklook, online or offline.
+        :return: None.
+        """
+        if status == "quicklook":
+            if self.model is not None:
+                self.model.reload_thumbnails([item])
+            return
 
-        to_download = list(compress(quicklooks, exist))
+        if self.results is not None and item in self.results.index:
+            self.results.at[item, "access"] = status
+        if self.model is not None:
+            self.model.set_values("access", {item: status})
 
-        if to_download:
-            prod_dict = Downloader.to_dict(results[results["quicklooks"].isin(to_download)], True)
-            self.downloader.download_all_quicklooks(prod_dict, self.tmp_dir)
+    def search_finished(self, job, found):
+        """
+        Frames the products in the map once a search is over.
+        :param job: SearchJob. Search that is over.
+        :param found: int. Number of products found, None if the search failed or was cancelled.
+        :return: None.
+        """
+        if job.cancelled:
+            self.show_status(f"{job.description} cancelled.")
+            return
 
-        self.add_prods_to_map(results)
+        if self.results_bounds is not None:
+            self.map.fit_bounds(self.results_bounds)
 
-        self.add_prods_to_table(results)
+        if found == 0:
+            information_dialog("No results matched your query.")
+        if found is not None:
+            self.show_status(f"{found} products found.")
 
     def add_prods_to_table(self, results):
         """
-        Adds the products obtained after a query to the result table.
+        Adds the products obtained after a query to the result table, after the ones already shown.
         :param results: Result dataframe.
         """
         results = results[["beginposition", "satellite", "orbitdirection", "missiondatatakeid", "relativeorbitnumber",
@@ -238,42 +295,60 @@ class DownloaderTab:
             "quicklooks": "Preview"
         }, inplace=True)
 
+        if self.model is not None and self.model.rowCount():
+            self.model.append_data(results)
+            return
+
+        if self.model is not None:
+            self.model.close()
         self.model = ResultsModel(results)
-        self.main_window.rslts_tbl.setModel(self.model)
+        self.proxy = ResultsProxyModel(self.model)
+        self.main_window.rslts_tbl.setModel(self.proxy)
         self.main_window.rslts_tbl.setSelectionBehavior(QtWidgets.QTableView.SelectRows)
+        self.main_window.rslts_tbl.setSortingEnabled(True)
+        self.main_window.rslts_tbl.selectionModel().selectionChanged.connect(self.highlight_selection)
 
         # Hide columns
         # for i, col in enumerate(results.columns):
         #     if col not in display_cols:
         #         self.main_window.rslts_tbl.setColumnHidden(i, True)
 
-        self.main_window.rslts_tbl.resizeRowsToContents()
+        # Rows are as high as the thumbnails, measuring them would decode every quicklook
+        self.main_window.rslts_tbl.verticalHeader().setDefaultSectionSize(54)
         self.main_window.rslts_tbl.resizeColumnsToContents()
 
         self.main_window.rslts_tbl.show()
 
     def add_prods_to_map(self, results):
         """
-        Adds the given results to the map.
+        Adds the given results to the map, without reloading it.
         :param results: Result dataframe.
         """
-        style_me = lambda feature: {
-            'fillOpacity': 0.1,
-            'weight': 1,
-            'fillColor': '#ff0000'
-        }
-
-        layer = GeoJson(
-            data=results[['geometry', 'title', 'link_icon']],
-            style_function=style_me,
-            name='Products',
-        ).add_to(self.map)
+        self.map.add_footprints("results", results, self.RESULTS_STYLE, tolerance=self.map_tolerance)
 
-        LayerControl().add_to(self.map)
+        bounds = results.total_bounds
+        if self.results_bounds is not None:
+            bounds = [*np.minimum(bounds[:2], self.results_bounds[:2]),
+                      *np.maximum(bounds[2:], self.results_bounds[2:])]
+        self.results_bounds = bounds
 
-        self.map.fit_bounds(layer.get_bounds())
+    def highlight_selection(self, *args):
+        """
+        Highlights the products selected in the table in the map. Only the features whose selection changed are
+        restyled.
+        :param args: Ignored. Arguments of the selectionChanged signal.
+        :return: None.
+        """
+        rows = [self.proxy.mapToSource(i).row() for i in self.main_window.rslts_tbl.selectionModel().selectedRows()]
+        selected = list(self.results.index[rows]) if self.results is not None else []
 
-        self.update_map()
+        deselected = set(self.selected_ids).difference(selected)
+        newly_selected = set(selected).difference(self.selected_ids)
+        if deselected:
+            self.map.set_style("results", self.RESULTS_STYLE, deselected)
+        if newly_selected:
+            self.map.set_style("results", self.SELECTED_STYLE, newly_selected)
+        self.selected_ids = selected
 
     def save_results(self):
         """
@@ -292,20 +367,22 @@ class DownloaderTab:
         """
 
         if self.model is not None:
-            self.model.beginResetModel()
-            self.model._data = pd.DataFrame()
-            self.model.endResetModel()
+            self.model.set_data(pd.DataFrame())
             self.results = None
 
     def download(self):
         """
-        Downloads the selected products.
+        Queues the download of the selected products. Downloads run one after another, off the GUI thread.
         :return: None.
         """
+        if self.model is None or not self.model.rowCount():
+            warning_dialog("There are no products to download.")
+            return
+
         table_view: QTableView = self.main_window.rslts_tbl
         selmodel = table_view.selectionModel()
         if selmodel.hasSelection():
-            selection = [i.row() for i in selmodel.selectedRows()]
+            selection = [self.proxy.mapToSource(i).row() for i in selmodel.selectedRows()]
         elif yes_no_dialog("No rows where selected. Would you like to download all products?"):
             selection = list(range(self.model.rowCount()))
         else:
@@ -313,6 +390,16 @@ class DownloaderTab:
 
         sel_df = self.get_selected_rows(selection)
 
+        unknown = sel_df.index[sel_df["access"].isna()]  # Still being resolved by the search
+        if len(unknown):
+            try:
+                for uuid, online in self.downloader.availability.resolve(unknown).items():
+                    self.search_status(uuid, "online" if online else "offline")
+                sel_df = self.get_selected_rows(selection)
+            except Exception as e:
+                warning_dialog(f"The availability of {len(unknown)} products is still unknown, so they will be "
+                               f"skipped: {e}")
+
         if "offline" in sel_df["access"].unique():
             file = f"offline_{utils.formatted_ts()}.csv"
             information_dialog("Only online products can be downloaded with this program. To download offline products,"
@@ -328,31 +415,79 @@ class DownloaderTab:
         if not path:
             return
 
-        for f in sel_df[sel_df.access == "online"]["quicklooks"]:
-            basename = os.path.split(f)[1]
-            new_path = os.path.join(path, basename)
-            shutil.copy2(f, new_path)
+        online = sel_df[sel_df.access == "online"]
+        titles = dict(zip(online.index, online["title"]))
+
+        job = DownloadJob(self.downloader, Downloader.to_dict(online, True), path, online["quicklooks"],
+                          priority=-online["aoicoverage"])  # Highest AoI coverage first
+        job.signals.started.connect(lambda: self.show_status(f"{job.description}..."))
+        job.signals.progress.connect(self.show_progress)
+        job.signals.status.connect(lambda uuid, status: self.show_status(f"{titles.get(uuid, uuid)}: {status}"))
+        job.signals.failed.connect(lambda message: warning_dialog(f"Download failed: {message}"))
+        job.signals.finished.connect(lambda res: self.download_finished(job, res))
+        self.downloads.submit(job)
 
-        self.downloader.download_all(Downloader.to_dict(sel_df[sel_df.access == "online"], True), directory_path=path)
+        if len(self.downloads) > 1:
+            self.show_status(f"{job.description} queued after {len(self.downloads) - 1} other downloads.")
 
-        information_dialog("Download complete.")
+    def download_finished(self, job, res):
+        """
+        Reports the outcome of a download.
+        :param job: DownloadJob. Download that is over.
+        :param res: Named tuple with the downloaded, retrieval_triggered and failed dicts, None if the download failed
+            or was cancelled.
+        :return: None.
+        """
+        if len(self.downloads) <= 1:  # The pool forgets this job after this slot
+            self.progress_bar.hide()
 
-    def clear_map(self):
+        if job.cancelled:
+            self.show_status(f"{job.description} cancelled. It will be resumed if downloaded again.")
+            return
+
+        if res is not None:
+            self.show_status(f"{job.description} complete.")
+            if res.failed:
+                warning_dialog(f"Download complete. {len(res.downloaded)} products were downloaded and "
+                               f"{len(res.failed)} failed.")
+            else:
+                information_dialog("Download complete.")
+
+    def cancel(self):
         """
-        Clears the map.
+        Cancels every queued and running search and download.
+        :return: None.
         """
+        self.searches.cancel_all()
+        self.downloads.cancel_all()
 
-        self.map = Map(tiles="Stamen Terrain")
+    def shutdown(self, msecs: int = 10000):
+        """
+        Cancels every job and waits for them to stop, e.g. before the app is closed.
+        :param msecs: int, optional. Maximal time to wait, in milliseconds. Defaults to 10 s.
+        :return: None.
+        """
+        self.cancel()
+        self.searches.wait(msecs)
+        self.downloads.wait(msecs)
 
-    def update_map(self):
+    def show_status(self, message):
         """
-        Updates the map.
+        Shows a message in the status bar.
+        :param message: str. Message.
+        :return: None.
         """
+        self.main_window.statusbar.showMessage(message)
 
-        data = io.BytesIO()
-        self.map.save(data, close_file=False)
-        self.map_view.setHtml(data.getvalue().decode())
-        data.close()
+    def show_progress(self, done, total):
+        """
+        Shows the progress of the running download.
+        :param done: int. Downloaded bytes.
+        :param total: int. Total bytes.
+        :return: None.
+        """
+        self.progress_bar.show()
+        self.progress_bar.setValue(int(100 * done / total) if total else 0)
 
     def get_selected_rows(self, indices):
         """
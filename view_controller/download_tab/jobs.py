@@ -0,0 +1,157 @@
+"""Module for the searches and downloads of the download tab, which run off the GUI thread."""
+import os.path
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from model import Downloader
+from model.quicklooks import QuicklookStore
+from ..workers import Job
+
+
+class SearchJob(Job):
+    """
+    Runs a search page by page: each page of results is filtered by AoI coverage as soon as it arrives and handed to
+    the GUI through the result signal. The access status and the quicklooks of its products are then resolved in the
+    background, reported through the status signal, while the next pages are fetched. The search stops between pages
+    when cancelled, and pages that have not been requested yet are dropped.
+    """
+
+    def __init__(self, downloader: Downloader, aoi: str, start: str, end: str, aoi_pct: int = 0,
+                 same_datatake: bool = True, **kwargs):
+        """
+        :param downloader: Downloader. Logged in downloader.
+        :param aoi: str. AoI WKT string.
+        :param start: str. Start date in format: YYYYMMDD
+        :param end: str. End date in format: YYYYMMDD
+        :param aoi_pct: int, optional. Percent of AoI coverage. Defaults to 0.
+        :param same_datatake: bool, optional. If set, aoi_pct takes into account the other products of the same
+            datatake. Defaults to True.
+        :param kwargs: Other keyword args of Downloader.query.
+        """
+        super().__init__(f"Search from {start} to {end}")
+        self.downloader = downloader
+        self.aoi = aoi
+        self.start = start
+        self.end = end
+        self.aoi_pct = aoi_pct
+        self.same_datatake = same_datatake
+        self.kwargs = kwargs
+
+    def work(self) -> int:
+        """
+        Runs the search. Each page is emitted as a GeoDataFrame of filtered products with the quicklooks column and a
+        missing access column. Then the access of each product is emitted as its uuid with the status "online" or
+        "offline", and each stored quicklook as its path with the status "quicklook".
+        :return: int. Number of products found.
+        """
+        found = 0
+        pages = self.downloader.query_pages(self.aoi, self.start, self.end, **self.kwargs)
+        frames = self.downloader.filter_pages(pages, self.aoi, self.aoi_pct, same_datatake=self.same_datatake,
+                                              resolve_access=False)
+        store = self.downloader.quicklook_store
+        futures = []
+        with ThreadPoolExecutor(2) as executor:  # So that pages are never held up by the hub's other answers
+            try:
+                for frame in frames:
+                    if self.cancelled:
+                        break
+
+                    frame["quicklooks"] = [store.path(x) for x in frame["identifier"]]
+                    found += len(frame.index)
+                    self.signals.result.emit(frame)
+
+                    futures.append(executor.submit(self._resolve_access, list(frame.index)))
+                    futures.append(executor.submit(self._fetch_quicklooks, dict(zip(frame.index, frame["identifier"]))))
+            finally:
+                frames.close()
+                pages.close()  # Drops the pages that have not been requested yet
+
+        for future in futures:
+            future.result()  # Raises the errors of the background tasks
+
+        return found
+
+    def _resolve_access(self, uuids: list) -> None:
+        """
+        Checks the access status of some products in a few batched requests.
+        :param uuids: list. Product uuids.
+        :return: None.
+        """
+        if self.cancelled:
+            return
+        for uuid, online in self.downloader.availability.resolve(uuids).items():
+            self.signals.status.emit(uuid, "online" if online else "offline")
+
+    def _fetch_quicklooks(self, identifiers: dict) -> None:
+        """
+        Makes sure the quicklooks of some products are stored. Only those that are missing are downloaded.
+        :param identifiers: dict with the format { uuid: identifier }.
+        :return: None.
+        """
+        if self.cancelled:
+            return
+        stored, _ = self.downloader.fetch_quicklooks(identifiers)
+        for path in stored.values():
+            self.signals.status.emit(path, "quicklook")
+
+
+class DownloadJob(Job):
+    """
+    Downloads products with Downloader.download_all, along with their quicklooks. The overall progress is reported in
+    bytes through the progress signal, and the status of each product through the status signal. When cancelled, the
+    running downloads stop after their current chunk and are resumed by the next download of the same products.
+    """
+
+    def __init__(self, downloader: Downloader, products, directory_path: str, quicklooks=(), priority=None,
+                 interval: float = 0.25):
+        """
+        :param downloader: Downloader. Logged in downloader.
+        :param products: dict. Products to download, with the format { uuid: properties }.
+        :param directory_path: str. Output directory.
+        :param quicklooks: Iterable, optional. Paths of stored quicklooks to place in the output directory.
+        :param priority: dict or Series, optional. Sort key of each uuid, lower first. Defaults to None.
+        :param interval: float, optional. Minimal seconds between progress signals. Defaults to 0.25.
+        """
+        super().__init__(f"Download of {len(products)} products")
+        self.downloader = downloader
+        self.products = products
+        self.directory_path = directory_path
+        self.quicklooks = list(quicklooks)
+        self.priority = priority
+        self.interval = interval
+
+        self._sizes = {}
+        self._statuses = {}
+        self._reported = 0.0
+
+    def work(self):
+        """
+        Downloads the products.
+        :return: Named tuple with the downloaded, retrieval_triggered and failed dicts, as Downloader.download_all.
+        """
+        for path in self.quicklooks:
+            if os.path.isfile(path):  # Evicted or never downloaded otherwise
+                QuicklookStore.link_or_copy(path, os.path.join(self.directory_path, os.path.basename(path)))
+
+        return self.downloader.download_all(self.products, directory_path=self.directory_path, priority=self.priority,
+                                            progress=self._progress, cancel=self.cancel_event)
+
+    def _progress(self, uuid: str, status: str, done: int, total: int) -> None:
+        """
+        Forwards the progress of a product. Status changes are always signaled, the byte count at most every interval.
+        :param uuid: str. Product uuid.
+        :param status: str. Status of the product.
+        :param done: int. Downloaded bytes.
+        :param total: int. Size of the product.
+        :return: None.
+        """
+        self._sizes[uuid] = (done, total)
+        if self._statuses.get(uuid) != status:
+            self._statuses[uuid] = status
+            self.signals.status.emit(uuid, status)
+
+        now = time.monotonic()
+        if now - self._reported >= self.interval or status != "downloading":
+            self._reported = now
+            sizes = list(self._sizes.values())  # Copied, the dict is updated by other download threads
+            self.signals.progress.emit(sum(d for d, _ in sizes), sum(t for _, t in sizes))
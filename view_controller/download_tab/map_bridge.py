@@ -0,0 +1,143 @@
+"""Module for the bridge between the download tab and its map page."""
+import json
+import os.path
+
+from PyQt5.QtCore import QObject, QUrl, pyqtSignal, pyqtSlot
+from PyQt5.QtWebChannel import QWebChannel
+
+from model.map_geojson import TILE_SIZE, compact_geojson, compact_topojson, fit_zoom, zoom_tolerance
+
+MAP_PAGE = os.path.join("views", "map.html")
+
+
+class MapBridge(QObject):
+    """
+    Object shared with the map page (views/map.html) through a QWebChannel. The page is loaded once, and its layers are
+    changed by the signals of the bridge, to which the page connects, so that each change sends only its own data
+    instead of re-rendering the whole map. Changes requested before the page is ready wait for it.
+    """
+
+    layerAdded = pyqtSignal(str, str, str)  # Layer name, GeoJSON and style
+    topologyAdded = pyqtSignal(str, str, str)  # Layer name, TopoJSON and style
+    layerRemoved = pyqtSignal(str)  # Layer name
+    layerStyled = pyqtSignal(str, str, str)  # Layer name, style and JSON list of feature ids, or null for all of them
+    layersCleared = pyqtSignal()
+    boundsFitted = pyqtSignal(float, float, float, float)  # minx, miny, maxx, maxy
+
+    def __init__(self, view, topojson: bool = False, parent=None):
+        """
+        :param view: QWebEngineView. View in which the map page is loaded.
+        :param topojson: bool, optional. If set, footprints are sent as TopoJSON instead of GeoJSON. Defaults to False.
+        :param parent: optional. Parent. Defaults to None.
+        """
+        super().__init__(parent)
+        self.view = view
+        self.topojson = topojson
+        self.is_ready = False
+        self._pending = []  # Changes waiting for the page, as (signal, args)
+
+        self.channel = QWebChannel(self)
+        self.channel.registerObject("bridge", self)
+        view.page().setWebChannel(self.channel)
+        view.setUrl(QUrl.fromLocalFile(os.path.abspath(MAP_PAGE)))
+
+    @pyqtSlot()
+    def ready(self) -> None:
+        """
+        Called by the page once it is connected to the bridge. Sends the changes that were waiting for it.
+        :return: None.
+        """
+        self.is_ready = True
+        pending, self._pending = self._pending, []
+        for signal, args in pending:
+            signal.emit(*args)
+
+    def add_layer(self, name: str, geojson: str, style: dict) -> None:
+        """
+        Adds features to a layer of the map, which is created if it does not exist. The style of an existing layer is
+        kept.
+        :param name: str. Layer name.
+        :param geojson: str. GeoJSON of the features, e.g. from GeoDataFrame.to_json. Their title property, if any, is
+            shown as a tooltip.
+        :param style: dict. Leaflet path style of a new layer.
+        :return: None.
+        """
+        self._send(self.layerAdded, name, geojson, json.dumps(style))
+
+    def add_footprints(self, name: str, frame, style: dict, tolerance: float = 0.0, properties=("title",)) -> None:
+        """
+        Adds product footprints to a layer of the map, compacted for the given tolerance. See
+        model.map_geojson.compact_geojson.
+        :param name: str. Layer name.
+        :param frame: GeoDataFrame. Products, indexed by uuid.
+        :param style: dict. Leaflet path style of a new layer.
+        :param tolerance: float, optional. Tolerance in degrees, e.g. from tolerance_for. Defaults to 0, which keeps
+            the footprints as they are.
+        :param properties: Sequence, optional. Columns sent along, those shown by the map. Defaults to the title.
+        :return: None.
+        """
+        if self.topojson:
+            self._send(self.topologyAdded, name, compact_topojson(frame, tolerance, properties), json.dumps(style))
+        else:
+            self._send(self.layerAdded, name, compact_geojson(frame, tolerance, properties), json.dumps(style))
+
+    def tolerance_for(self, bounds, headroom: int = 2) -> float:
+        """
+        Computes the tolerance of the footprints shown while the map is fitted to some bounds, below which changes
+        are not visible.
+        :param bounds: Sequence. (minx, miny, maxx, maxy), in degrees.
+        :param headroom: int, optional. Zoom levels beyond the fitted one at which changes must still be invisible, so
+            that the user can zoom in. Defaults to 2.
+        :return: float. Tolerance in degrees.
+        """
+        # A map that is not laid out yet is given the size of a tile, rather than zoomed out to the whole world
+        width = max(self.view.width(), TILE_SIZE)
+        height = max(self.view.height(), TILE_SIZE)
+        return zoom_tolerance(fit_zoom(bounds, width, height) + headroom)
+
+    def remove_layer(self, name: str) -> None:
+        """
+        Removes a layer from the map.
+        :param name: str. Layer name.
+        :return: None.
+        """
+        self._send(self.layerRemoved, name)
+
+    def set_style(self, name: str, style: dict, ids=None) -> None:
+        """
+        Changes the style of the features of a layer.
+        :param name: str. Layer name.
+        :param style: dict. Leaflet path style options to change.
+        :param ids: Iterable, optional. Ids of the features to change. Defaults to all of them.
+        :return: None.
+        """
+        self._send(self.layerStyled, name, json.dumps(style), json.dumps(None if ids is None else list(ids)))
+
+    def clear(self) -> None:
+        """
+        Removes every layer from the map.
+        :return: None.
+        """
+        # Changes that have not been sent yet would be cleared anyway
+        self._pending = []
+        self._send(self.layersCleared)
+
+    def fit_bounds(self, bounds) -> None:
+        """
+        Fits the view of the map to some bounds.
+        :param bounds: Sequence. (minx, miny, maxx, maxy), in degrees.
+        :return: None.
+        """
+        self._send(self.boundsFitted, *(float(x) for x in bounds))
+
+    def _send(self, signal, *args) -> None:
+        """
+        Emits a signal to the page, or keeps it until the page is ready.
+        :param signal: Bound signal.
+        :param args: Signal arguments.
+        :return: None.
+        """
+        if self.is_ready:
+            signal.emit(*args)
+        else:
+            self._pending.append((signal, args))
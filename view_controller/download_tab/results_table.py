@@ -1,19 +1,158 @@
 """Module in charge of the results table of the GUI."""
+import queue
+import threading
+from collections import OrderedDict
 
+import numpy as np
 import pandas
-from PyQt5.QtCore import QAbstractTableModel, Qt, QVariant
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import QAbstractTableModel, QAbstractProxyModel, QModelIndex, QObject, Qt, QVariant, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPixmap
+
+
+class ThumbnailLoader(QObject):
+    """
+    Background thread that decodes and scales quicklooks. Images are decoded as QImage, which can be done outside of
+    the GUI thread, and handed back through the decoded signal. The most recent requests are served first, so the
+    rows being looked at come before those that were scrolled past.
+    """
+
+    decoded = pyqtSignal(str, QImage)
+
+    def __init__(self, height: int = 50, parent=None):
+        """
+        :param height: int, optional. Height of the thumbnails, in pixels. Defaults to 50.
+        :param parent: optional. Parent. Defaults to None.
+        """
+        super().__init__(parent)
+        self.height = height
+        self._requests = queue.LifoQueue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, path: str) -> None:
+        """
+        Asks for a thumbnail. Repeated requests of a pending thumbnail are ignored.
+        :param path: str. Path to the image.
+        :return: None.
+        """
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._requests.put(path)
+
+    def stop(self) -> None:
+        """
+        Stops the thread once the current thumbnail is done.
+        :return: None.
+        """
+        self._requests.put(None)
+
+    def _run(self):
+        """Decodes the requested thumbnails until stopped."""
+        while True:
+            path = self._requests.get()
+            if path is None:
+                return
+            image = QImage(path)
+            if not image.isNull():
+                image = image.scaledToHeight(self.height, Qt.SmoothTransformation)
+            with self._lock:
+                self._pending.discard(path)
+            self.decoded.emit(path, image)
 
 
 class ResultsModel(QAbstractTableModel):
     """
     Custom implementation of a PyQt table, so it fulfills with our purpose.
-    Encapsulates a dataframe as a data container.
+    Encapsulates a dataframe as a data container. The display strings are computed column-wise as rows are added, the
+    sort keys when a column is first sorted, and the thumbnails of the "Preview" column are decoded in the background
+    and kept in an LRU cache.
     """
 
-    def __init__(self, data: pandas.DataFrame, parent=None):
+    def __init__(self, data: pandas.DataFrame, parent=None, thumbnail_height: int = 50, cache_size: int = 512):
+        """
+        :param data: DataFrame. Results to display.
+        :param parent: optional. Parent. Defaults to None.
+        :param thumbnail_height: int, optional. Height of the thumbnails, in pixels. Defaults to 50.
+        :param cache_size: int, optional. Number of thumbnails kept in memory. Defaults to 512.
+        """
         super().__init__(parent)
+        self.cache_size = cache_size
+        self._thumbnails = OrderedDict()  # path: QPixmap, least recently used first
+        self._placeholder = QPixmap(thumbnail_height, thumbnail_height)
+        self._placeholder.fill(QColor("lightgray"))
+
+        self._loader = ThumbnailLoader(thumbnail_height)
+        self._loader.decoded.connect(self._thumbnail_ready)
+
+        self._data = None
+        self._display = []
+        self._sort_keys = []
+        self._rows = {}
+        self._set_data(data)
+
+    def set_data(self, data: pandas.DataFrame) -> None:
+        """
+        Replaces the displayed results.
+        :param data: DataFrame. New results.
+        :return: None.
+        """
+        self.beginResetModel()
+        self._set_data(data)
+        self.endResetModel()
+
+    def append_data(self, data: pandas.DataFrame) -> None:
+        """
+        Adds rows after the displayed results, e.g. as the pages of a search arrive.
+        :param data: DataFrame. New results, with the same columns.
+        :return: None.
+        """
+        if data.empty:
+            return
+        if self._data.columns.empty:  # Nothing is displayed yet, so there are no columns to insert rows into
+            self.set_data(data)
+            return
+
+        first = self.rowCount()
+        self.beginInsertRows(QModelIndex(), first, first + len(data.index) - 1)
+        self._data = pandas.concat([self._data, data])
+        for col, display in enumerate(self._display_columns(data, first)):
+            self._display[col] = np.concatenate([self._display[col], display])
+        self._sort_keys = [None] * len(self._display)  # Ranks change with the new values
+        self.endInsertRows()
+
+    def _set_data(self, data: pandas.DataFrame) -> None:
+        """
+        Stores the results along with their display strings and the rows of each quicklook.
+        :param data: DataFrame. Results.
+        :return: None.
+        """
         self._data = data
+        self._rows = {}
+        self._display = self._display_columns(data)
+        self._sort_keys = [None] * len(self._display)
+
+    def _display_columns(self, data: pandas.DataFrame, first: int = 0) -> list:
+        """
+        Computes the display strings of some results, column by column, and records the rows of their quicklooks.
+        :param data: DataFrame. Results.
+        :param first: int, optional. Row of the first result. Defaults to 0.
+        :return: list with a NumPy array per column. Quicklook paths are kept as they are.
+        """
+        display = []
+        for col in data.columns:
+            values = data[col]
+            if col == "Preview":
+                display.append(values.to_numpy(dtype=object))
+                for row, path in enumerate(display[-1], first):
+                    self._rows.setdefault(path, []).append(row)
+                continue
+
+            display.append(values.map(str).to_numpy(dtype=object))
+        return display
 
     def rowCount(self, parent=None):
         """
@@ -21,7 +160,7 @@ class ResultsModel(QAbstractTableModel):
         :param parent: optional. Parent. Defaults to None.
         :return: int. Number of rows.
         """
-        return len(self._data.values)
+        return len(self._data.index)
 
     def columnCount(self, parent=None):
         """
@@ -40,11 +179,14 @@ class ResultsModel(QAbstractTableModel):
         """
         if index.isValid():
             if role == Qt.DisplayRole and self._data.columns[index.column()] != "Preview":
-                return QVariant(str(self._data.iloc[index.row()][index.column()]))
+                return QVariant(self._display[index.column()][index.row()])
             elif role == Qt.DecorationRole and self._data.columns[index.column()] == "Preview":
-                # https://stackoverflow.com/questions/24201822/show-image-in-a-column-of-qtableview-from-qsqltablemodel
-                image = QPixmap(self._data.iloc[index.row()][index.column()]).scaledToHeight(50)
-                return image
+                path = self._display[index.column()][index.row()]
+                if path in self._thumbnails:
+                    self._thumbnails.move_to_end(path)
+                    return self._thumbnails[path]
+                self._loader.request(path)
+                return self._placeholder
 
         return QVariant()
 
@@ -60,6 +202,19 @@ class ResultsModel(QAbstractTableModel):
             return self._data.columns[col]
         return None
 
+    def sort_key(self, col: int) -> np.ndarray:
+        """
+        :param col: int. Column index.
+        :return: np.ndarray. Key of every row, whose order is that of the column's values. It is computed upon first
+            use and kept until rows are added.
+        """
+        if self._sort_keys[col] is None:
+            if self._data.columns[col] == "Preview":
+                self._sort_keys[col] = np.arange(self.rowCount())
+            else:
+                self._sort_keys[col] = sort_key(self._data.iloc[:, col])
+        return self._sort_keys[col]
+
     def get_sel_uuids(self, indices):
         """
         Returns the selected row uuids.
@@ -67,3 +222,252 @@ class ResultsModel(QAbstractTableModel):
         :return: list of UUIDs.
         """
         return self._data.iloc[indices].index
+
+    def set_values(self, column: str, values: dict) -> None:
+        """
+        Changes the values of a column for some results, e.g. once their access status is known.
+        :param column: str. Column name.
+        :param values: dict with the format { uuid: value }. Results that are not displayed are skipped.
+        :return: None.
+        """
+        if column not in self._data.columns:
+            return
+        col = list(self._data.columns).index(column)
+        for uuid, value in values.items():
+            if uuid not in self._data.index:
+                continue
+            row = self._data.index.get_loc(uuid)
+            self._data.iat[row, col] = value
+            self._display[col][row] = str(self._data.iat[row, col])
+            index = self.index(row, col)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+        self._sort_keys[col] = None
+
+    def reload_thumbnails(self, paths) -> None:
+        """
+        Decodes some thumbnails again, e.g. once their quicklooks have been downloaded.
+        :param paths: Iterable of quicklook paths.
+        :return: None.
+        """
+        if "Preview" not in self._data.columns:
+            return
+        col = list(self._data.columns).index("Preview")
+        for path in paths:
+            self._thumbnails.pop(path, None)
+            for row in self._rows.get(path, ()):
+                index = self.index(row, col)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def close(self) -> None:
+        """
+        Stops the thumbnail decoder.
+        :return: None.
+        """
+        self._loader.stop()
+
+    def _thumbnail_ready(self, path: str, image: QImage) -> None:
+        """
+        Caches a decoded thumbnail and repaints the cells that show it.
+        :param path: str. Path to the quicklook.
+        :param image: QImage. Scaled quicklook.
+        :return: None.
+        """
+        rows = self._rows.get(path)
+        if not rows:  # The results were replaced meanwhile
+            return
+
+        self._thumbnails[path] = QPixmap.fromImage(image) if not image.isNull() else self._placeholder
+        while len(self._thumbnails) > self.cache_size:
+            self._thumbnails.popitem(last=False)
+
+        col = list(self._data.columns).index("Preview")
+        for row in rows:
+            index = self.index(row, col)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+def sort_key(values: pandas.Series) -> np.ndarray:
+    """
+    Computes the rank of each value, so that any column can be sorted with a single NumPy argsort.
+    :param values: Series. Column values.
+    :return: np.ndarray of ints.
+    """
+    if isinstance(values.dtype, pandas.CategoricalDtype):
+        values = values.astype(str)
+    if pandas.api.types.is_numeric_dtype(values) or pandas.api.types.is_datetime64_any_dtype(values):
+        keys = values.to_numpy()
+    else:
+        keys = values.map(str).to_numpy(dtype=str)
+    return np.argsort(np.argsort(keys, kind="stable"), kind="stable")
+
+
+class ResultsProxyModel(QAbstractProxyModel):
+    """
+    Sorting and filtering proxy of a ResultsModel. Rows are reordered with a NumPy argsort of the model's precomputed
+    sort keys, instead of the comparisons of QSortFilterProxyModel, and filtered with boolean masks.
+    """
+
+    def __init__(self, source: ResultsModel, parent=None):
+        """
+        :param source: ResultsModel. Source model.
+        :param parent: optional. Parent. Defaults to None.
+        """
+        super().__init__(parent)
+        self._order = np.arange(0)  # Source row of each proxy row
+        self._position = np.arange(0)  # Proxy row of each source row, -1 if filtered out
+        self._mask = None
+        self._sort = None
+        self.setSourceModel(source)
+
+    def setSourceModel(self, source: ResultsModel) -> None:
+        """
+        Sets the source model and follows its changes.
+        :param source: ResultsModel. Source model.
+        :return: None.
+        """
+        self.beginResetModel()
+        super().setSourceModel(source)
+        source.modelReset.connect(self._source_reset)
+        source.rowsInserted.connect(self._source_rows_inserted)
+        source.dataChanged.connect(self._source_data_changed)
+        self._mask = None
+        self._update()
+        self.endResetModel()
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.AscendingOrder) -> None:
+        """
+        Sorts the rows by a column.
+        :param column: int. Column index. A negative one restores the source order.
+        :param order: Qt.SortOrder, optional. Defaults to ascending.
+        :return: None.
+        """
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        sources = [self.mapToSource(index) for index in persistent]
+
+        self._sort = (column, order) if column >= 0 else None
+        self._update()
+
+        self.changePersistentIndexList(persistent, [self.mapFromSource(index) for index in sources])
+        self.layoutChanged.emit()
+
+    def set_filter(self, mask=None) -> None:
+        """
+        Only shows some of the source rows.
+        :param mask: Boolean array or Series, optional. One value per source row. If not given, every row is shown.
+        :return: None.
+        """
+        self.beginResetModel()
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self._update()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        """
+        :param parent: optional. Parent. Defaults to the root.
+        :return: int. Number of visible rows.
+        """
+        return 0 if parent.isValid() else len(self._order)
+
+    def columnCount(self, parent=QModelIndex()):
+        """
+        :param parent: optional. Parent. Defaults to the root.
+        :return: int. Number of columns.
+        """
+        return 0 if parent.isValid() or self.sourceModel() is None else self.sourceModel().columnCount()
+
+    def index(self, row: int, column: int, parent=QModelIndex()):
+        """
+        :param row: int. Proxy row.
+        :param column: int. Column.
+        :param parent: optional. Parent. Defaults to the root.
+        :return: QModelIndex.
+        """
+        if parent.isValid() or not (0 <= row < self.rowCount() and 0 <= column < self.columnCount()):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        """
+        :param index: optional. Ignored, the table has no hierarchy.
+        :return: QModelIndex. The root.
+        """
+        return QModelIndex()
+
+    def mapToSource(self, index):
+        """
+        :param index: QModelIndex. Proxy index.
+        :return: QModelIndex. Source index.
+        """
+        if not index.isValid() or index.row() >= len(self._order):
+            return QModelIndex()
+        return self.sourceModel().index(int(self._order[index.row()]), index.column())
+
+    def mapFromSource(self, index):
+        """
+        :param index: QModelIndex. Source index.
+        :return: QModelIndex. Proxy index, invalid if the row is filtered out.
+        """
+        if not index.isValid() or index.row() >= len(self._position) or self._position[index.row()] < 0:
+            return QModelIndex()
+        return self.index(int(self._position[index.row()]), index.column())
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        """
+        Returns the headers of the source model.
+        :param section: int. Column or row.
+        :param orientation: Orientation.
+        :param role: int. Role.
+        :return: The header.
+        """
+        if orientation == Qt.Horizontal:
+            return self.sourceModel().headerData(section, orientation, role)
+        return super().headerData(section, orientation, role)
+
+    def _update(self) -> None:
+        """
+        Recomputes the row mapping from the current sorting and filter.
+        :return: None.
+        """
+        n_rows = self.sourceModel().rowCount()
+        order = np.arange(n_rows)
+        if self._sort is not None and n_rows:
+            column, sort_order = self._sort
+            order = np.argsort(self.sourceModel().sort_key(column), kind="stable")
+            if sort_order == Qt.DescendingOrder:
+                order = order[::-1]
+        if self._mask is not None and len(self._mask) == n_rows:
+            order = order[self._mask[order]]
+
+        self._order = order
+        self._position = np.full(n_rows, -1)
+        self._position[order] = np.arange(len(order))
+
+    def _source_reset(self) -> None:
+        """Follows a reset of the source model, which drops the filter."""
+        self.beginResetModel()
+        self._mask = None
+        self._update()
+        self.endResetModel()
+
+    def _source_rows_inserted(self, parent, first: int, last: int) -> None:
+        """Shows the rows appended to the source after the others, and sorts them in if the rows are sorted."""
+        if self._mask is not None:
+            self._mask = np.concatenate([self._mask, np.ones(last - first + 1, dtype=bool)])
+
+        self.beginInsertRows(QModelIndex(), len(self._order), len(self._order) + last - first)
+        self._order = np.concatenate([self._order, np.arange(first, last + 1)])
+        self._position = np.concatenate([self._position, np.arange(len(self._order) - (last - first + 1),
+                                                                   len(self._order))])
+        self.endInsertRows()
+
+        if self._sort is not None:
+            self.sort(*self._sort)
+
+    def _source_data_changed(self, top_left, bottom_right, roles=()) -> None:
+        """Forwards changes of the source cells."""
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            proxy_row = self._position[row] if row < len(self._position) else -1
+            if proxy_row >= 0:
+                self.dataChanged.emit(self.index(int(proxy_row), top_left.column()),
+                                      self.index(int(proxy_row), bottom_right.column()), roles)
@@ -1,13 +1,11 @@
 """Module for main window implementation."""
-import os
-import shutil
-
 from PyQt5 import QtWidgets, uic, QtGui
 
 import view_controller.utils
 from .download_tab import DownloaderTab
 from .login_dialog import LoginDialog
 from .manual_tab import ChangeDetectorPanel
+from .manual_tab import JobsPanel
 from .manual_tab import VesselDetectorPanel
 
 
@@ -22,6 +20,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setWindowIcon(QtGui.QIcon('icons/icon.png'))
 
         # Tabs and dialogs
+        self.jobs_panel = JobsPanel(self)  # Before the detector panels, which submit their jobs to it
         self.vd_panel = VesselDetectorPanel(self)
         self.cd_panel = ChangeDetectorPanel(self)
         self.dl_panel = DownloaderTab(self)
@@ -40,6 +39,16 @@ class MainWindow(QtWidgets.QMainWindow):
         self.modes_tabs.setCurrentIndex(0)  # Make sure first tab is always the selected one
 
 
+    def closeEvent(self, event):
+        """
+        Stops the running searches, downloads and detections before the window is closed.
+        :param event: QCloseEvent. Close event.
+        :return: None.
+        """
+        self.dl_panel.shutdown()
+        self.jobs_panel.shutdown()
+        super().closeEvent(event)
+
     def bind_login_actions(self):
         """
         Binds the login button to its function.
@@ -124,13 +133,3 @@ class MainWindow(QtWidgets.QMainWindow):
         self.downloader.setEnabled(value)
         self.rslts_tbl.setEnabled(value)
         # self.scheduled.setEnabled(value)  # Not implemented
-
-    def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
-        """
-        Method called upon window closing.
-        :param a0: Action. Ignored.
-        :return: None.
-        """
-        # Removes temporary dir where quicklooks are downloaded.
-        if os.path.isdir(self.dl_panel.tmp_dir):
-            shutil.rmtree(self.dl_panel.tmp_dir)
@@ -1,4 +1,5 @@
 """Package where the detector panels are implemented"""
 
 from .change_detector_panel import ChangeDetectorPanel
+from .jobs_panel import JobsPanel
 from .vessel_detector_panel import VesselDetectorPanel
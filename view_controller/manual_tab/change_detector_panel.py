@@ -1,13 +1,14 @@
 """This module includes everything related to the change detector groupbox."""
 import os.path
-from datetime import datetime
 
 import shapely.errors
 import shapely.wkt
 from PyQt5.QtWidgets import QLineEdit, QComboBox, QLabel, QMainWindow
 
 from model import ChangeDetector
+from model.detection_queue import DONE
 from model.detectors import RGBChannel
+from model.product_cache import ProductCache
 from view_controller.utils import load_product, load_products, set_dir, warning_dialog
 
 
@@ -73,17 +74,43 @@ class ChangeDetectorPanel:
             return
 
         self.detector = ChangeDetector(subset=self.subset, ref_prod=self.ref_prod_path, sequential=self.sequential,
-                                       ref_chnl=self.ref_color, out_dir=self.out_dir, steps=self.tmp_files)
+                                       ref_chnl=self.ref_color, out_dir=self.out_dir, steps=self.tmp_files,
+                                       cache=ProductCache())
 
         if not self.prod_paths:
             warning_dialog("You must select products to compare first.")
             return
 
-        self.display_status("Processing...")
-        start = datetime.now()
-        self.detector.detect(*self.prod_paths)
-        end = datetime.now()
-        self.display_status(f"Complete. {end - start}")
+        # The products are preprocessed by jobs of their own, on which the comparisons depend
+        detector = self.detector
+        jobs = self.main_window.jobs_panel
+        name = lambda path: os.path.splitext(os.path.basename(path))[0]
+        comparisons = []
+        finished = []
+
+        def comparison_done(job):
+            finished.append(job)
+            if len(finished) == len(comparisons):
+                done = sum(x.status == DONE for x in finished)
+                self.display_status(f"Complete. {done} of {len(finished)} compositions created.")
+
+        def submit_comparison(path_a, job_a, path_b, job_b):
+            comparisons.append(jobs.submit(detector.compare, description=f"{name(path_a)} / {name(path_b)}",
+                                           detector="Change detection", depends=(job_a, job_b),
+                                           done=comparison_done))
+
+        ref = jobs.submit(detector.preprocess_product, self.ref_prod_path, description=name(self.ref_prod_path),
+                          detector="Change detection")
+        prev = None
+        for path in self.prod_paths:
+            proc = jobs.submit(detector.preprocess_product, path, description=name(path), detector="Change detection")
+            submit_comparison(self.ref_prod_path, ref, path, proc)
+
+            if self.sequential and prev is not None:
+                submit_comparison(prev[0], prev[1], path, proc)
+            prev = path, proc
+
+        self.display_status(f"{len(comparisons)} compositions queued.")
 
     def sel_output_dir(self):
         """
@@ -0,0 +1,248 @@
+"""This module includes everything related to the jobs groupbox, where the manual detections are run and followed."""
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtWidgets import QMainWindow, QTableView
+
+from model.detection_queue import DetectionJob, DetectionQueue
+
+
+class JobsModel(QAbstractTableModel):
+    """
+    Table model of the jobs of a DetectionQueue, one row per job.
+    """
+
+    COLUMNS = ("Job", "Detector", "Status", "Step", "Elapsed")
+    ELAPSED = COLUMNS.index("Elapsed")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._jobs = []  # DetectionJob of each row
+        self._detectors = {}  # Job id: detector name
+        self._rows = {}  # Job id: row
+
+    def add_job(self, job: DetectionJob, detector: str) -> None:
+        """
+        Appends a job to the table.
+        :param job: DetectionJob. Job.
+        :param detector: str. Name of the detector running it.
+        :return: None.
+        """
+        row = len(self._jobs)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._jobs.append(job)
+        self._detectors[job.id] = detector
+        self._rows[job.id] = row
+        self.endInsertRows()
+
+    def set_jobs(self, jobs) -> None:
+        """
+        Keeps only the given jobs in the table.
+        :param jobs: Iterable. Jobs to keep, which must have been added before.
+        :return: None.
+        """
+        self.beginResetModel()
+        self._jobs = list(jobs)
+        self._detectors = {x.id: self._detectors[x.id] for x in self._jobs}
+        self._rows = {x.id: i for i, x in enumerate(self._jobs)}
+        self.endResetModel()
+
+    def job(self, row: int) -> DetectionJob:
+        """
+        :param row: int. Row index.
+        :return: DetectionJob. Job of the row.
+        """
+        return self._jobs[row]
+
+    def update_jobs(self, jobs) -> None:
+        """
+        Refreshes the rows of the given jobs.
+        :param jobs: Iterable. Jobs whose status or step changed.
+        :return: None.
+        """
+        for job in jobs:
+            row = self._rows.get(job.id)
+            if row is not None:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def update_elapsed(self) -> None:
+        """
+        Refreshes the elapsed time of the running jobs.
+        :return: None.
+        """
+        for row, job in enumerate(self._jobs):
+            if job.started is not None and not job.finished:
+                index = self.index(row, self.ELAPSED)
+                self.dataChanged.emit(index, index)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._jobs)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        """
+        Returns the data of a cell.
+        :param index: QModelIndex. Cell.
+        :param role: int. Role.
+        :return: The data, or None.
+        """
+        if not index.isValid():
+            return None
+
+        job = self._jobs[index.row()]
+        column = self.COLUMNS[index.column()]
+
+        if role == Qt.DisplayRole:
+            if column == "Job":
+                return job.description
+            if column == "Detector":
+                return self._detectors[job.id]
+            if column == "Status":
+                return job.status.capitalize()
+            if column == "Step":
+                return job.step
+            if column == "Elapsed":
+                return JobsModel.format_seconds(job.elapsed) if job.started is not None else ""
+
+        elif role == Qt.ToolTipRole:
+            if column in ("Job", "Status") and job.error:
+                return job.error
+            if column == "Step" and job.timings:
+                return "\n".join(f"{step}: {secs:.1f} s" for step, secs in job.timings)
+
+        return None
+
+    def headerData(self, col: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        """
+        Returns the headers.
+        :param col: int. Column index.
+        :param orientation: Orientation.
+        :param role: int. Role.
+        :return: str. The column name.
+        """
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[col]
+        return None
+
+    @staticmethod
+    def format_seconds(secs: float) -> str:
+        """
+        Formats a duration.
+        :param secs: float. Seconds.
+        :return: str. Duration with the format H:MM:SS.
+        """
+        secs = int(secs)
+        return f"{secs // 3600}:{secs // 60 % 60:02d}:{secs % 60:02d}"
+
+
+class JobsPanel:
+    """
+    View and controller of the jobs groupbox. The detector panels submit their detections here, where they run in
+    worker processes of a DetectionQueue, which is polled by a timer of the GUI thread while there are unfinished jobs.
+    """
+
+    def __init__(self, main_window: QMainWindow, interval: int = 200):
+        """
+        :param main_window: QMainWindow. Main window.
+        :param interval: int, optional. Milliseconds between polls of the queue. Defaults to 200.
+        """
+        self.main_window = main_window
+        self.queue = DetectionQueue(max_workers=self.main_window.jobs_workers_in.value())
+        self.model = JobsModel()
+        self._callbacks = {}  # Job id: callable called with the job once it is finished
+
+        jobs_tbl: QTableView = self.main_window.jobs_tbl
+        jobs_tbl.setModel(self.model)
+
+        self.timer = QTimer()
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+
+        # Bind buttons and inputs
+        self.main_window.jobs_cancel_btn.clicked.connect(self.cancel_selected)
+        self.main_window.jobs_clear_btn.clicked.connect(self.clear_finished)
+        self.main_window.jobs_workers_in.valueChanged.connect(self.set_max_workers)
+
+    def submit(self, target, *args, description: str = "", detector: str = "", depends=(), done=None,
+               **kwargs) -> int:
+        """
+        Queues a job. See DetectionQueue.submit.
+        :param target: Callable. Picklable callable run in the worker process.
+        :param args: Positional arguments of target.
+        :param description: str, optional. Short description to display, e.g. the product name. Defaults to "".
+        :param detector: str, optional. Name of the detector to display. Defaults to "".
+        :param depends: Iterable, optional. Ids of the jobs that must be done before this one starts. Defaults to ().
+        :param done: Callable, optional. Called with the job once it is done, failed or cancelled. Defaults to None.
+        :param kwargs: Keyword arguments of target.
+        :return: int. Id of the job.
+        """
+        job_id = self.queue.submit(target, *args, description=description, depends=depends, **kwargs)
+        if done is not None:
+            self._callbacks[job_id] = done
+
+        self.model.add_job(self.queue.jobs[job_id], detector)
+        if not self.timer.isActive():
+            self.timer.start()
+        return job_id
+
+    def refresh(self) -> None:
+        """
+        Polls the queue and updates the table. The timer stops once every job is finished.
+        :return: None.
+        """
+        self.finish(self.queue.poll())
+        self.model.update_elapsed()
+
+        if all(x.finished for x in self.queue.jobs.values()):
+            self.timer.stop()
+
+    def finish(self, jobs) -> None:
+        """
+        Updates the rows of changed jobs, and calls the callbacks of those that are finished.
+        :param jobs: list. Changed jobs.
+        :return: None.
+        """
+        self.model.update_jobs(jobs)
+        for job in jobs:
+            if job.finished and job.id in self._callbacks:
+                self._callbacks.pop(job.id)(job)
+
+    def cancel_selected(self) -> None:
+        """
+        Cancels the selected jobs, along with the jobs that depend on them.
+        :return: None.
+        """
+        jobs_tbl: QTableView = self.main_window.jobs_tbl
+        rows = {x.row() for x in jobs_tbl.selectionModel().selectedRows()}
+
+        cancelled = []
+        for row in sorted(rows):
+            cancelled += self.queue.cancel(self.model.job(row).id)
+        self.finish(cancelled)
+
+    def clear_finished(self) -> None:
+        """
+        Removes the finished jobs from the table.
+        :return: None.
+        """
+        self.queue.clear_finished()
+        self.model.set_jobs(self.queue.jobs.values())
+
+    def set_max_workers(self, value: int) -> None:
+        """
+        Changes the number of jobs run at the same time. Running jobs are never stopped, so lowering it takes effect as
+        they finish.
+        :param value: int. Number of concurrent jobs.
+        :return: None.
+        """
+        self.queue.max_workers = value
+        if self.timer.isActive():
+            self.refresh()
+
+    def shutdown(self) -> None:
+        """
+        Cancels every job and terminates the worker processes.
+        :return: None.
+        """
+        self.timer.stop()
+        self.finish(self.queue.cancel_all())
@@ -2,13 +2,14 @@
 View-controller module for the Vessel Detection panel/tab.
 """
 import os.path
-from datetime import datetime
 
 import shapely.errors
 import shapely.wkt
 from PyQt5.QtWidgets import QLineEdit, QComboBox, QLabel, QMainWindow
 
 from model import VesselDetector
+from model.detection_queue import DONE
+from model.product_cache import ProductCache
 from view_controller.utils import load_products, set_dir, warning_dialog
 
 
@@ -78,14 +79,35 @@ class VesselDetectorPanel:
         self.detector = VesselDetector(subset=self.subset, out_dir=self.out_dir, steps=self.tmp_files, verbose=False,
                                        tgt_window=self.tgt_window, guard_wd_size=self.guard_wd_size,
                                        bg_wd_size=self.bg_wd_size, pfa=self.pfa, min_tgt=self.min_tgt,
-                                       max_tgt=self.max_tgt)
+                                       max_tgt=self.max_tgt, cache=ProductCache())
 
+        # Each product is processed by a job of its own, and the summary is saved once all of them are finished
+        detector = self.detector
+        paths = list(self.prod_paths)
+        finished = []
 
-        self.display_status("Processing...")
-        start = datetime.now()
-        self.detector.detect(*self.prod_paths)
-        end = datetime.now()
-        self.display_status(f"Complete. {end - start}")
+        def product_done(job):
+            finished.append(job)
+            if len(finished) == len(paths):
+                self.save_summary(detector, finished)
+
+        for path in paths:
+            self.main_window.jobs_panel.submit(detector.detect_product, path,
+                                               description=os.path.splitext(os.path.basename(path))[0],
+                                               detector="Vessel detection", done=product_done)
+
+        self.display_status(f"{len(paths)} products queued.")
+
+    def save_summary(self, detector: VesselDetector, jobs) -> None:
+        """
+        Saves the summary of a batch of detections once all of its jobs are finished.
+        :param detector: VesselDetector. Detector of the batch.
+        :param jobs: list. Finished jobs of the batch.
+        :return: None.
+        """
+        done = [x for x in sorted(jobs, key=lambda x: x.id) if x.status == DONE]
+        detector.save_summary([x.result for x in done if x.result is not None])
+        self.display_status(f"Complete. {len(done)} of {len(jobs)} products processed.")
 
     def sel_output_dir(self):
         """
@@ -0,0 +1,148 @@
+"""Module for the jobs that run off the GUI thread."""
+import queue
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class JobSignals(QObject):
+    """
+    Signals of a job. They are emitted from the pool's threads and delivered to the GUI thread, whose slots only apply
+    their results.
+    """
+
+    started = pyqtSignal()
+    progress = pyqtSignal('qint64', 'qint64')  # Done and total, in the job's own units, e.g. bytes
+    status = pyqtSignal(str, str)  # Item of the job, e.g. a product uuid, and its new status
+    result = pyqtSignal(object)  # Partial result, e.g. a page of search results
+    failed = pyqtSignal(str)  # Error message
+    cancelled = pyqtSignal()
+    finished = pyqtSignal(object)  # Return value of the job, None if it failed or was cancelled. Always emitted last
+
+
+class Job:
+    """
+    Unit of work of a JobPool. Subclasses implement work, which reports through the signals and checks cancelled every
+    now and then to stop early. Exceptions leaving work are reported through the failed signal.
+    """
+
+    def __init__(self, description: str = ""):
+        """
+        :param description: str, optional. Short description to display, e.g. in the status bar. Defaults to "".
+        """
+        self.description = description
+        self.signals = JobSignals()
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """
+        :return: bool. Whether the job has been cancelled.
+        """
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """
+        Asks the job to stop. Queued jobs do not start, and running ones stop when they next check cancelled.
+        :return: None.
+        """
+        self.cancel_event.set()
+
+    def run(self) -> None:
+        """
+        Does the job in the pool's thread and reports its outcome. Not to be called directly.
+        :return: None.
+        """
+        value = None
+        try:
+            if not self.cancelled:
+                self.signals.started.emit()
+                value = self.work()
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(str(e))
+        finally:
+            if self.cancelled:
+                value = None
+                self.signals.cancelled.emit()
+            self.signals.finished.emit(value)
+
+    def work(self):
+        """
+        Does the job.
+        :return: Result, delivered through the finished signal.
+        """
+        raise NotImplementedError
+
+
+class JobPool:
+    """
+    Queue of jobs run by up to max_threads worker threads. Jobs beyond max_threads wait for their turn, so that several
+    of them can be queued without blocking the GUI. The workers are started upon first use and live as long as the
+    app, so that libraries that keep native per-thread state, e.g. pyproj's PROJ contexts, find it again in the next
+    job. A QThreadPool does not allow that: its threads drop their Python thread state, and the thread locals of those
+    libraries with it, after each job.
+    """
+
+    def __init__(self, max_threads: int = 1):
+        """
+        :param max_threads: int, optional. Jobs run at the same time. Defaults to 1, so jobs run in order.
+        """
+        self.max_threads = max_threads
+        self.jobs = []  # Queued and running jobs
+        self._queue = queue.Queue()
+        self._threads = []
+        self._unfinished = 0
+        self._idle = threading.Condition()
+
+    def submit(self, job: Job) -> Job:
+        """
+        Queues a job.
+        :param job: Job. Job to run. Connect to its signals before submitting it.
+        :return: Job. The same job.
+        """
+        self.jobs.append(job)
+        job.signals.finished.connect(lambda _: self.jobs.remove(job) if job in self.jobs else None)
+
+        with self._idle:
+            self._unfinished += 1
+        self._queue.put(job)
+        if len(self._threads) < self.max_threads:
+            thread = threading.Thread(target=self._work, name=f"JobPool-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return job
+
+    def _work(self) -> None:
+        """
+        Runs the queued jobs, one after another. Body of the worker threads.
+        :return: None.
+        """
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                with self._idle:
+                    self._unfinished -= 1
+                    self._idle.notify_all()
+
+    def cancel_all(self) -> None:
+        """
+        Cancels every queued and running job.
+        :return: None.
+        """
+        for job in list(self.jobs):
+            job.cancel()
+
+    def wait(self, msecs: int = -1) -> bool:
+        """
+        Waits for the jobs to finish.
+        :param msecs: int, optional. Maximal time to wait, in milliseconds. Defaults to no limit.
+        :return: bool. Whether every job finished.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._unfinished, None if msecs < 0 else msecs / 1000)
+
+    def __len__(self):
+        return len(self.jobs)